@@ -3,12 +3,45 @@ import React, { useEffect, useRef, useState } from 'react';
 // NOTA: La etiqueta <script> para cargar three.min.js se ha movido al final de App.jsx.
 const THREE = window.THREE;
 
+// API de domicilios (misma IP que DomiciliosScreen)
+const API_DOMICILIOS = 'http://192.168.1.10:8080/domicilios/api';
+// Cada cuánto se vuelve a pedir el ETA del pedido (ms)
+const INTERVALO_ETA_MS = 30000;
+
 const OrderTrackingScreen = ({ navigate, orderDetails }) => {
     const canvasRef = useRef(null);
     const [statusMessage, setStatusMessage] = useState("Tu pedido está siendo preparado...");
 
+    const [etaMinutes, setEtaMinutes] = useState(null);
+
     // Detalles del pedido
-    const { storeName, deliveryAddress, total } = orderDetails;
+    const { storeName, deliveryAddress, total, orderId } = orderDetails;
+
+    // ETA real del pedido (solo si el checkout nos pasó su id)
+    useEffect(() => {
+        if (!orderId) return;
+        let cancelled = false;
+
+        const fetchEta = async () => {
+            try {
+                const response = await fetch(`${API_DOMICILIOS}/pedidos/${orderId}/eta/`, { credentials: 'include' });
+                if (!response.ok) return;
+                const data = await response.json();
+                if (!cancelled) {
+                    setEtaMinutes(data.eta && data.eta.entrega_s != null ? Math.max(1, Math.round(data.eta.entrega_s / 60)) : null);
+                }
+            } catch (error) {
+                console.error("No se pudo obtener el ETA del pedido:", error);
+            }
+        };
+
+        fetchEta();
+        const timer = setInterval(fetchEta, INTERVALO_ETA_MS);
+        return () => {
+            cancelled = true;
+            clearInterval(timer);
+        };
+    }, [orderId]);
 
     // Lógica de simulación 3D
     useEffect(() => {
@@ -206,6 +239,9 @@ const OrderTrackingScreen = ({ navigate, orderDetails }) => {
                 <div className="text-sm text-gray-600">
                     <p>Tienda: <span className="font-medium">{storeName}</span></p>
                     <p>Entrega en: <span className="font-medium">{deliveryAddress}</span></p>
+                    {etaMinutes !== null && (
+                        <p>Llegada estimada: <span className="font-medium">~{etaMinutes} min</span></p>
+                    )}
                 </div>
             </div>
 
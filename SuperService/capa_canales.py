@@ -0,0 +1,519 @@
+# SuperService/capa_canales.py
+
+import asyncio
+import atexit
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import deque
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Directorio compartido por los procesos del host: cada uno escucha en <id>.sock
+DIRECTORIO_POR_DEFECTO = '/tmp/superservice-canales'
+
+# Bytes pendientes de escritura hacia un proceso a partir de los cuales se
+# descartan sus mensajes (un proceso colgado no debe llenar la memoria del resto)
+LIMITE_BUFFER_PAR = 16 * 1024 * 1024
+
+# Cada trama es: longitud (4 bytes, big-endian) + lista msgpack
+CABECERA = struct.Struct('!I')
+
+
+def _trama(*partes):
+    datos = msgpack.packb(partes, use_bin_type=True)
+    return CABECERA.pack(len(datos)) + datos
+
+
+def _en_bucle(loop):
+    """True si el hilo actual está ejecutando 'loop'."""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def _empaquetar(mensaje):
+    return msgpack.packb(mensaje, use_bin_type=True)
+
+
+def _despertar(esperas):
+    for espera in esperas:
+        if not espera.done():
+            espera.set_result(None)
+
+
+class _CanalLocal:
+    """
+    Mensajes pendientes de un canal de este proceso (ya serializados: cada
+    receive() decodifica su propia copia) y las corrutinas que esperan en receive().
+    """
+    __slots__ = ('mensajes', 'esperas')
+
+    def __init__(self):
+        self.mensajes = deque()
+        self.esperas = []
+
+
+# ----------------------------------------------------------------------
+# 2. Nodo de Red (hilo propio con su bucle asyncio)
+# ----------------------------------------------------------------------
+
+class _Nodo:
+    """
+    Conexiones por sockets Unix con los demás procesos. Todo el E/S corre
+    en un hilo dedicado con su propio bucle: la capa se puede usar desde
+    el bucle de Daphne, desde async_to_sync o desde varios bucles a la vez
+    sin atar conexiones a ninguno.
+
+    Cada proceso escucha en <directorio>/<id>.sock y abre una conexión de
+    salida hacia cada par: al arrancar se conecta a los sockets que ya
+    existen y se presenta ('hola'); el par, al recibir la presentación de
+    alguien nuevo, se conecta de vuelta. Las tramas salientes se acumulan y
+    se escriben en bloque, una sola vez por vuelta del bucle.
+    """
+
+    def __init__(self, capa, directorio):
+        self.capa = capa
+        self.directorio = directorio
+        self.ruta = os.path.join(directorio, f'{capa.id}.sock')
+        self.loop = asyncio.new_event_loop()
+        self._servidor = None
+        self._lectores = set()    # tareas _atender, una por conexión entrante
+        self._pares = {}          # par_id -> StreamWriter (solo desde el hilo del nodo)
+        self._conectando = set()
+        self._salientes = {}      # par_id -> [tramas] pendientes (protegido por _lock)
+        self._lock = threading.Lock()
+        self._vaciado_pendiente = False
+        self._listo = threading.Event()
+        self._hilo = threading.Thread(target=self._ejecutar, name=f'capa-canales-{capa.id}', daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+        self._listo.wait(5)
+
+    def detener(self):
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._cerrar(), self.loop).result(timeout=2)
+            except Exception:
+                logger.debug("La capa de canales no cerró a tiempo.", exc_info=True)
+            # Se detiene después de entregar el resultado de _cerrar() (si no, .result() espera al timeout)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        try:
+            os.unlink(self.ruta)
+        except FileNotFoundError:
+            pass
+
+    def _ejecutar(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._arrancar())
+        self._listo.set()
+        self.loop.run_forever()
+
+    async def _cerrar(self):
+        # Primero el servidor (no entran más pares) y luego los lectores, que terminan
+        # sin propagar la cancelación: asyncio no registra un error por cada conexión
+        if self._servidor is not None:
+            self._servidor.close()
+        for escritor in self._pares.values():
+            escritor.close()
+        for lector in self._lectores:
+            lector.cancel()
+        await asyncio.gather(*self._lectores, return_exceptions=True)
+
+        tareas = [t for t in asyncio.all_tasks(self.loop) if t is not asyncio.current_task()]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    async def _arrancar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        self._servidor = await asyncio.start_unix_server(self._atender, path=self.ruta)
+        for nombre in os.listdir(self.directorio):
+            par_id, extension = os.path.splitext(nombre)
+            if extension == '.sock' and par_id != self.capa.id:
+                await self._conectar(par_id)
+        self.loop.create_task(self._limpieza_periodica())
+
+    # --- Salida ---
+
+    def enviar(self, par_id, trama):
+        """Encola una trama hacia un par (seguro desde cualquier hilo)."""
+        with self._lock:
+            self._salientes.setdefault(par_id, []).append(trama)
+            if self._vaciado_pendiente:
+                return
+            self._vaciado_pendiente = True
+        if _en_bucle(self.loop):
+            self.loop.call_soon(self._vaciar)
+        else:
+            self.loop.call_soon_threadsafe(self._vaciar)
+
+    def difundir(self, trama):
+        for par_id in list(self._pares):
+            self.enviar(par_id, trama)
+
+    def _vaciar(self):
+        with self._lock:
+            salientes, self._salientes = self._salientes, {}
+            self._vaciado_pendiente = False
+        for par_id, tramas in salientes.items():
+            escritor = self._pares.get(par_id)
+            if escritor is None or escritor.is_closing():
+                continue
+            if escritor.transport.get_write_buffer_size() > LIMITE_BUFFER_PAR:
+                self.capa.descartados += len(tramas)
+                continue
+            escritor.write(b''.join(tramas))
+
+    async def _conectar(self, par_id):
+        if par_id in self._pares or par_id in self._conectando:
+            return
+        self._conectando.add(par_id)
+        ruta = os.path.join(self.directorio, f'{par_id}.sock')
+        try:
+            _, escritor = await asyncio.open_unix_connection(ruta)
+        except ConnectionRefusedError:
+            # Socket de un proceso que murió sin limpiar
+            try:
+                os.unlink(ruta)
+            except FileNotFoundError:
+                pass
+            return
+        except (FileNotFoundError, OSError):
+            return
+        finally:
+            self._conectando.discard(par_id)
+        self._pares[par_id] = escritor
+        escritor.write(_trama('hola', self.capa.id, self.capa.grupos_locales()))
+
+    def _olvidar(self, par_id):
+        escritor = self._pares.pop(par_id, None)
+        if escritor is not None:
+            escritor.close()
+        self.capa.olvidar_par(par_id)
+
+    # --- Entrada ---
+
+    async def _atender(self, lector, escritor):
+        tarea = asyncio.current_task()
+        self._lectores.add(tarea)
+        par_id = None
+        try:
+            while True:
+                cabecera = await lector.readexactly(CABECERA.size)
+                datos = await lector.readexactly(CABECERA.unpack(cabecera)[0])
+                partes = msgpack.unpackb(datos, raw=False)
+                if partes[0] == 'hola':
+                    par_id = partes[1]
+                    self.capa.registrar_par(par_id, partes[2])
+                    await self._conectar(par_id)
+                else:
+                    self.capa.recibir_remoto(partes)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Solo la cancela _cerrar(): la tarea termina limpia en lugar de cancelada
+            pass
+        finally:
+            self._lectores.discard(tarea)
+            escritor.close()
+            if par_id is not None:
+                self._olvidar(par_id)
+
+    async def _limpieza_periodica(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.capa.expiry / 2))
+            self.capa.limpiar_expirados()
+
+
+# ----------------------------------------------------------------------
+# 3. Capa de Canales
+# ----------------------------------------------------------------------
+
+class CapaSocketsUnix(BaseChannelLayer):
+    """
+    Capa de canales para varios procesos (workers de Daphne/Uvicorn) en un
+    mismo host, sin Redis ni otro broker: los procesos se hablan
+    directamente por sockets Unix.
+
+    - Los nombres de canal llevan el id del proceso dueño
+      ('specific.<id>!<aleatorio>'), así que send() va directo a ese proceso.
+    - Cada proceso guarda solo sus miembros de grupo y avisa a los demás
+      cuando un grupo gana su primer miembro local o pierde el último. Un
+      group_send entrega a los miembros locales y manda UNA trama a cada
+      proceso con miembros, que hace el reparto final.
+
+    Como la capa en memoria, la entrega es "como mucho una vez": un proceso
+    que cae pierde sus mensajes pendientes. Se configura en CHANNEL_LAYERS:
+
+        'BACKEND': 'SuperService.capa_canales.CapaSocketsUnix',
+        'CONFIG': {'directorio': '/run/superservice-canales'},
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 directorio=DIRECTORIO_POR_DEFECTO, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        self._nodo = None
+        self._pid = None
+        self.descartados = 0
+        self._reiniciar_estado()
+
+    def _reiniciar_estado(self):
+        self.id = f'{os.getpid()}-{secrets.token_hex(4)}'
+        self._canales = {}   # canal -> _CanalLocal (con marca de tiempo por mensaje)
+        self._grupos = {}    # grupo -> {canal local: marca de ingreso}
+        self._remotos = {}   # grupo -> set(par_id) con miembros en ese grupo
+
+    def _asegurar_nodo(self):
+        # Un proceso hijo (fork) no hereda el hilo del nodo: arranca uno propio
+        if self._pid == os.getpid():
+            return self._nodo
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._nodo
+            self._reiniciar_estado()
+            nodo = self._nodo = _Nodo(self, self.directorio)
+            self._pid = os.getpid()
+        # Fuera del lock: al arrancar, el nodo lo necesita para presentarse a los pares
+        # (grupos_locales). Lo que se le envíe antes espera en la cola de su bucle.
+        nodo.iniciar()
+        atexit.register(nodo.detener)
+        return nodo
+
+    def _dueno(self, canal):
+        """Id del proceso dueño de un canal específico, o None si es un canal general."""
+        local, separador, _ = canal.partition('!')
+        return local.rsplit('.', 1)[-1] if separador else None
+
+    # --- API de canales ---
+
+    async def new_channel(self, prefix='specific'):
+        self._asegurar_nodo()
+        return f"{prefix.rstrip('.')}.{self.id}!{secrets.token_hex(6)}"
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        nodo = self._asegurar_nodo()
+        dueno = self._dueno(channel)
+        if dueno is None or dueno == self.id:
+            self._entregar([channel], _empaquetar(message), lanzar=True)
+        else:
+            nodo.enviar(dueno, _trama('canal', channel, _empaquetar(message)))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self._asegurar_nodo()
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                registro = self._canales.setdefault(channel, _CanalLocal())
+                if registro.mensajes:
+                    _, datos = registro.mensajes.popleft()
+                    if not registro.mensajes and not registro.esperas:
+                        del self._canales[channel]
+                    break
+                espera = loop.create_future()
+                registro.esperas.append((loop, espera))
+            try:
+                await espera
+            finally:
+                with self._lock:
+                    if (loop, espera) in registro.esperas:
+                        registro.esperas.remove((loop, espera))
+        return msgpack.unpackb(datos, raw=False)
+
+    def _entregar(self, canales, datos, lanzar=False):
+        """
+        Encola un mensaje serializado en canales de este proceso (desde cualquier
+        hilo) y despierta a quienes esperan: una sola llamada por bucle, no una
+        por canal, para que un grupo grande no sature el bucle de los consumidores.
+        """
+        ahora = time.time()
+        por_bucle = {}
+        with self._lock:
+            for canal in canales:
+                registro = self._canales.setdefault(canal, _CanalLocal())
+                if len(registro.mensajes) >= self.get_capacity(canal):
+                    if lanzar:
+                        raise ChannelFull(canal)
+                    self.descartados += 1
+                    continue
+                registro.mensajes.append((ahora, datos))
+                for loop, espera in registro.esperas:
+                    if not espera.done():
+                        por_bucle.setdefault(loop, []).append(espera)
+                        break
+        for loop, esperas in por_bucle.items():
+            if _en_bucle(loop):
+                _despertar(esperas)
+            else:
+                loop.call_soon_threadsafe(_despertar, esperas)
+
+    # --- Grupos ---
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        nodo = self._asegurar_nodo()
+        dueno = self._dueno(channel)
+        if dueno is not None and dueno != self.id:
+            nodo.enviar(dueno, _trama('unir', group, channel))
+            return
+        self._unir_local(group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        nodo = self._asegurar_nodo()
+        dueno = self._dueno(channel)
+        if dueno is not None and dueno != self.id:
+            nodo.enviar(dueno, _trama('salir', group, channel))
+            return
+        self._salir_local(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        nodo = self._asegurar_nodo()
+        with self._lock:
+            locales = list(self._grupos.get(group, ()))
+            pares = list(self._remotos.get(group, ()))
+        # Se serializa una sola vez; cada proceso reparte a sus miembros
+        datos = _empaquetar(message)
+        if pares:
+            trama = _trama('grupo', group, datos)
+            for par_id in pares:
+                nodo.enviar(par_id, trama)
+        if locales:
+            self._entregar(locales, datos)
+
+    def _unir_local(self, grupo, canal):
+        with self._lock:
+            primero = grupo not in self._grupos
+            self._grupos.setdefault(grupo, {})[canal] = time.time()
+        if primero:
+            self._nodo.difundir(_trama('suscribir', self.id, grupo))
+
+    def _salir_local(self, grupo, canal):
+        with self._lock:
+            miembros = self._grupos.get(grupo)
+            if not miembros or miembros.pop(canal, None) is None or miembros:
+                return
+            del self._grupos[grupo]
+        self._nodo.difundir(_trama('desuscribir', self.id, grupo))
+
+    def grupos_locales(self):
+        with self._lock:
+            return list(self._grupos)
+
+    # --- Mensajes de otros procesos (hilo del nodo) ---
+
+    def registrar_par(self, par_id, grupos):
+        with self._lock:
+            for grupo in grupos:
+                self._remotos.setdefault(grupo, set()).add(par_id)
+
+    def olvidar_par(self, par_id):
+        with self._lock:
+            for grupo in [g for g, pares in self._remotos.items() if par_id in pares]:
+                self._remotos[grupo].discard(par_id)
+                if not self._remotos[grupo]:
+                    del self._remotos[grupo]
+
+    def recibir_remoto(self, partes):
+        tipo = partes[0]
+        if tipo == 'grupo':
+            with self._lock:
+                locales = list(self._grupos.get(partes[1], ()))
+            if locales:
+                self._entregar(locales, partes[2])
+        elif tipo == 'canal':
+            self._entregar([partes[1]], partes[2])
+        elif tipo == 'suscribir':
+            with self._lock:
+                self._remotos.setdefault(partes[2], set()).add(partes[1])
+        elif tipo == 'desuscribir':
+            with self._lock:
+                pares = self._remotos.get(partes[2])
+                if pares is not None:
+                    pares.discard(partes[1])
+                    if not pares:
+                        del self._remotos[partes[2]]
+        elif tipo == 'unir':
+            self._unir_local(partes[1], partes[2])
+        elif tipo == 'salir':
+            self._salir_local(partes[1], partes[2])
+
+    # --- Expiración y mantenimiento ---
+
+    def limpiar_expirados(self):
+        """
+        Descarta mensajes más viejos que 'expiry' (nadie los leyó: el consumidor
+        ya no existe) y saca ese canal de sus grupos; vence las membresías más
+        viejas que 'group_expiry'. Corre periódicamente en el hilo del nodo.
+        """
+        ahora = time.time()
+        vacios = []
+        with self._lock:
+            for canal, registro in list(self._canales.items()):
+                vencido = False
+                while registro.mensajes and registro.mensajes[0][0] < ahora - self.expiry:
+                    registro.mensajes.popleft()
+                    vencido = True
+                if vencido:
+                    for grupo, miembros in self._grupos.items():
+                        miembros.pop(canal, None)
+                if not registro.mensajes and not registro.esperas:
+                    del self._canales[canal]
+            limite_grupo = ahora - self.group_expiry
+            for grupo, miembros in self._grupos.items():
+                for canal, marca in list(miembros.items()):
+                    if marca < limite_grupo:
+                        del miembros[canal]
+                if not miembros:
+                    vacios.append(grupo)
+            for grupo in vacios:
+                del self._grupos[grupo]
+        for grupo in vacios:
+            self._nodo.difundir(_trama('desuscribir', self.id, grupo))
+
+    async def flush(self):
+        with self._lock:
+            self._canales = {}
+            grupos, self._grupos = list(self._grupos), {}
+        if self._nodo is not None:
+            for grupo in grupos:
+                self._nodo.difundir(_trama('desuscribir', self.id, grupo))
+
+    async def close(self):
+        pass
+
+    def resumen(self):
+        with self._lock:
+            return {
+                'proceso': self.id,
+                'pares': len(self._nodo._pares) if self._nodo else 0,
+                'grupos_locales': len(self._grupos),
+                'grupos_remotos': len(self._remotos),
+                'canales_con_pendientes': len(self._canales),
+                'descartados': self.descartados,
+            }
@@ -0,0 +1,170 @@
+# SuperService/escritura_diferida.py
+
+import asyncio
+import atexit
+import logging
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import ModelSignal
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Cada cuánto se escriben las filas pendientes (segundos)
+INTERVALO_VACIADO_S = 0.05
+
+# Filas pendientes que disparan un vaciado sin esperar al intervalo
+TAMANO_LOTE = 200
+
+# Tope de filas retenidas si la BD no responde; por encima se descartan las más viejas
+MAXIMO_PENDIENTES = 20000
+
+# Pausa antes de reintentar cuando un vaciado no pudo escribir nada
+ESPERA_TRAS_FALLO_S = 1.0
+
+# bulk_create no envía post_save: tras cada lote insertado se envía esta señal
+# (sender=modelo, instancias=[...]) para quien mantenga datos derivados
+filas_insertadas = ModelSignal(use_caching=True)
+
+
+# ----------------------------------------------------------------------
+# 2. Escritor Diferido (Write-Behind)
+# ----------------------------------------------------------------------
+
+class EscritorDiferido:
+    """
+    Acumula instancias sin guardar (p. ej. mensajes de chat) y las inserta
+    con bulk_create: cada INTERVALO_VACIADO_S o en cuanto haya TAMANO_LOTE
+    pendientes. El consumidor difunde el mensaje al grupo de inmediato y
+    solo encola la fila: ni salto a un hilo ni INSERT por mensaje.
+
+    - Las filas de un lote se agrupan por modelo (un INSERT por modelo).
+    - Si el lote falla por integridad (p. ej. el viaje se borró), se
+      reintenta fila por fila y solo se descartan las que fallan.
+    - Si la BD no está disponible, las filas vuelven a la cola (hasta
+      MAXIMO_PENDIENTES) para el siguiente vaciado.
+    - Al apagar el proceso se escribe lo pendiente (atexit).
+
+    auto_now_add se asigna al insertar, así que 'timestamp' puede quedar
+    hasta un intervalo después de la recepción; el orden se conserva.
+    """
+
+    def __init__(self, intervalo=INTERVALO_VACIADO_S, tamano_lote=TAMANO_LOTE):
+        self.intervalo = intervalo
+        self.tamano_lote = tamano_lote
+        self.diferido = True
+        self._lock = threading.Lock()
+        self._pendientes = []
+        self._tarea = None
+        self._loop = None
+        self._lote_lleno = None
+        self.escritas = 0
+        self.descartadas = 0
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) la tarea periódica de vaciado en el bucle actual."""
+        if self._tarea is None or self._tarea.done() or self._loop.is_closed():
+            self._loop = asyncio.get_running_loop()
+            self._lote_lleno = asyncio.Event()
+            self._tarea = self._loop.create_task(self._bucle_vaciado())
+
+    def agregar(self, instancia):
+        """Encola una instancia sin guardar. Solo toca memoria; seguro desde cualquier hilo."""
+        with self._lock:
+            self._pendientes.append(instancia)
+            lleno = len(self._pendientes) == self.tamano_lote
+        if lleno and self._tarea is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._lote_lleno.set)
+
+    async def guardar(self, instancia):
+        """Encola la instancia; con 'diferido' desactivado la guarda al momento (una fila por mensaje)."""
+        from channels.db import database_sync_to_async
+
+        if self.diferido:
+            self.agregar(instancia)
+        else:
+            await database_sync_to_async(instancia.save)()
+
+    def pendientes(self):
+        return len(self._pendientes)
+
+    # --- Persistencia ---
+
+    def vaciar(self):
+        """Inserta en la BD las filas pendientes (síncrono). Devuelve las filas escritas."""
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return 0
+
+        por_modelo = {}
+        for instancia in lote:
+            por_modelo.setdefault(type(instancia), []).append(instancia)
+
+        escritas = 0
+        for modelo, instancias in por_modelo.items():
+            try:
+                with transaction.atomic():
+                    modelo.objects.bulk_create(instancias)
+                escritas += len(instancias)
+            except IntegrityError:
+                # save() sí envía post_save: no hace falta la señal de lote
+                escritas += self._guardar_una_a_una(instancias)
+                continue
+            except Exception:
+                self._reencolar(instancias)
+                logger.exception("No se pudieron guardar %d filas de %s.", len(instancias), modelo.__name__)
+                continue
+            try:
+                filas_insertadas.send(sender=modelo, instancias=instancias)
+            except Exception:
+                logger.exception("Falló un receptor de filas_insertadas para %s.", modelo.__name__)
+        self.escritas += escritas
+        return escritas
+
+    def _guardar_una_a_una(self, instancias):
+        escritas = 0
+        for instancia in instancias:
+            try:
+                with transaction.atomic():
+                    instancia.save(force_insert=True)
+                escritas += 1
+            except IntegrityError:
+                self.descartadas += 1
+                logger.warning("Se descarta una fila de %s que no se pudo insertar.", type(instancia).__name__)
+        return escritas
+
+    def _reencolar(self, instancias):
+        """Devuelve las filas al frente de la cola, sin pasar de MAXIMO_PENDIENTES."""
+        with self._lock:
+            self._pendientes[:0] = instancias
+            exceso = len(self._pendientes) - MAXIMO_PENDIENTES
+            if exceso > 0:
+                del self._pendientes[:exceso]
+                self.descartadas += exceso
+                logger.error("Cola de escritura diferida llena: se descartan %d filas.", exceso)
+
+    async def _bucle_vaciado(self):
+        from channels.db import database_sync_to_async
+
+        while True:
+            try:
+                await asyncio.wait_for(self._lote_lleno.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._lote_lleno.clear()
+            if self._pendientes:
+                escritas = await database_sync_to_async(self.vaciar)()
+                # Si no se pudo escribir nada, no se martillea la BD en cada intervalo
+                if not escritas and self._pendientes:
+                    await asyncio.sleep(ESPERA_TRAS_FALLO_S)
+
+
+escritor_mensajes = EscritorDiferido()
+
+# Al apagar el proceso se escribe lo que quede pendiente
+atexit.register(escritor_mensajes.vaciar)
@@ -0,0 +1,88 @@
+# SuperService/historial_chat.py
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Mensajes que trae la página inicial del chat y cada "cargar anteriores"
+LIMITE_POR_DEFECTO = 30
+LIMITE_MAXIMO = 100
+
+
+# ----------------------------------------------------------------------
+# 2. Cursor (timestamp, id)
+# ----------------------------------------------------------------------
+# Los tres modelos de mensajes (MensajeViaje, domicilios.Mensaje y
+# usuarios.Mensaje) tienen 'timestamp' y un índice (conversación, timestamp, id):
+# una página es un rango de ese índice, sin OFFSET, por larga que sea la conversación.
+
+def codificar_cursor(mensaje):
+    """Cursor opaco con la posición de un mensaje."""
+    crudo = f"{mensaje.timestamp.isoformat()}|{mensaje.pk}".encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(timestamp, id) de un cursor; ValueError si está mal formado."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        marca, pk = crudo.rsplit('|', 1)
+        return datetime.fromisoformat(marca), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as error:
+        raise ValueError(f"Cursor inválido: {cursor!r}") from error
+
+
+def pagina_anterior(mensajes, antes=None, limite=LIMITE_POR_DEFECTO):
+    """
+    Los 'limite' mensajes más nuevos de 'mensajes' (ya filtrado por
+    conversación) anteriores al cursor 'antes', o los últimos si no hay
+    cursor. Devuelve (mensajes del más viejo al más nuevo, cursor para la
+    página anterior o None si no quedan más).
+    """
+    if antes:
+        marca, pk = decodificar_cursor(antes)
+        mensajes = mensajes.filter(Q(timestamp__lt=marca) | Q(timestamp=marca, pk__lt=pk))
+
+    filas = list(mensajes.order_by('-timestamp', '-pk')[:limite + 1])
+    hay_mas = len(filas) > limite
+    filas = filas[:limite][::-1]
+    return filas, (codificar_cursor(filas[0]) if hay_mas else None)
+
+
+def leer_limite(parametros):
+    try:
+        return max(1, min(int(parametros.get('limite', LIMITE_POR_DEFECTO)), LIMITE_MAXIMO))
+    except (TypeError, ValueError):
+        return LIMITE_POR_DEFECTO
+
+
+# ----------------------------------------------------------------------
+# 3. Paginación de DRF
+# ----------------------------------------------------------------------
+
+class PaginacionHistorial(BasePagination):
+    """
+    ?antes=<cursor>&limite=<n>: mensajes anteriores al cursor, del más viejo
+    al más nuevo. La respuesta incluye 'anteriores', el cursor para pedir la
+    página siguiente hacia atrás (null al llegar al primer mensaje).
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            filas, self.anteriores = pagina_anterior(
+                queryset, request.query_params.get('antes'), leer_limite(request.query_params)
+            )
+        except ValueError:
+            raise ValidationError({'antes': "Cursor inválido."})
+        return filas
+
+    def get_paginated_response(self, data):
+        return Response({'anteriores': self.anteriores, 'results': data})
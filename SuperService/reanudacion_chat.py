@@ -0,0 +1,255 @@
+# SuperService/reanudacion_chat.py
+
+import asyncio
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from SuperService.escritura_diferida import INTERVALO_VACIADO_S
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Mensajes recientes que se guardan en memoria por grupo de chat
+CAPACIDAD_ANILLO = 200
+
+# Un anillo sin conexiones locales se conserva este tiempo para quien reconecte (segundos)
+TTL_ANILLO_S = 300
+
+# Tope de anillos por proceso; por encima se descartan primero los que no tienen conexiones
+MAXIMO_ANILLOS = 5000
+
+# Mensajes perdidos que se reenvían al reconectar; con más, el cliente recarga el historial por HTTP
+LIMITE_REPETICION = 500
+
+INTERVALO_LIMPIEZA_S = 60
+
+# Antes de reanudar desde la BD se espera un vaciado del escritor diferido (más
+# margen para el INSERT): lo que otro worker difundió justo antes de group_add no
+# llega en vivo y puede seguir en su cola
+ESPERA_VACIADO_S = 2 * INTERVALO_VACIADO_S
+
+
+def reloj_us():
+    return time.time_ns() // 1000
+
+
+# ----------------------------------------------------------------------
+# 2. Anillo de mensajes por grupo
+# ----------------------------------------------------------------------
+# Cada mensaje de chat lleva una secuencia 'seq': microsegundos de reloj,
+# max(reloj, última vista en este proceso + 1). Solo crece dentro de un
+# proceso: dos workers que difunden a la vez pueden emitir secuencias fuera
+# de orden, así que el cliente descarta repetidos por 'seq' vista y no por
+# ser menor que la última (static/js/reanudacion_chat.js). Se guarda con la
+# fila (campo 'secuencia') para poder reanudar desde la BD cuando el anillo
+# no alcanza.
+
+class AnilloMensajes:
+    """
+    Últimos CAPACIDAD_ANILLO eventos del grupo, en orden de llegada.
+
+    Está completo para toda secuencia > 'inicio' mientras el proceso tenga
+    alguna conexión en el grupo ('locales' > 0), porque entonces recibe cada
+    group_send. Sin conexiones queda congelado: conoce lo anterior a
+    'ultima' y lo posterior hay que buscarlo en la BD.
+    """
+
+    __slots__ = ('eventos', 'secuencias', 'inicio', 'ultima', 'locales', 'congelado_en')
+
+    def __init__(self):
+        self.eventos = deque()
+        self.secuencias = set()
+        self.inicio = reloj_us()
+        self.ultima = self.inicio
+        self.locales = 0
+        self.congelado_en = None
+
+    def registrar(self, evento):
+        seq = evento['seq']
+        if seq in self.secuencias:
+            return
+        self.eventos.append(evento)
+        self.secuencias.add(seq)
+        self.ultima = max(self.ultima, seq)
+        if len(self.eventos) > CAPACIDAD_ANILLO:
+            expulsado = self.eventos.popleft()
+            self.secuencias.discard(expulsado['seq'])
+            self.inicio = max(self.inicio, expulsado['seq'])
+
+    def posteriores(self, last_seq):
+        return sorted((evento for evento in self.eventos if evento['seq'] > last_seq), key=lambda e: e['seq'])
+
+
+# ----------------------------------------------------------------------
+# 3. Registro por proceso
+# ----------------------------------------------------------------------
+
+class RegistroReanudacion:
+    """
+    Anillos de los grupos de chat de este proceso. Solo se usa desde el
+    bucle de eventos (consumidores asíncronos), así que no necesita lock.
+    """
+
+    def __init__(self):
+        self._anillos = {}
+        self._proxima_limpieza = 0.0
+
+    def unir(self, grupo, last_seq=None):
+        """
+        Suma una conexión local al grupo. Con 'last_seq' devuelve lo que se
+        perdió: (eventos en memoria, secuencia desde la que falta consultar
+        la BD o None si la memoria alcanza).
+        """
+        self._limpiar()
+        anillo = self._anillos.get(grupo)
+        if anillo is None:
+            anillo = self._anillos[grupo] = AnilloMensajes()
+            perdidos = ([], last_seq)
+        elif last_seq is None:
+            perdidos = ([], None)
+        elif last_seq < anillo.inicio:
+            # Expulsado del anillo (o anterior a que existiera): todo desde la BD
+            perdidos = ([], last_seq)
+        else:
+            desde_bd = max(last_seq, anillo.ultima) if anillo.locales == 0 else None
+            perdidos = (anillo.posteriores(last_seq), desde_bd)
+
+        if anillo.locales == 0 and anillo.congelado_en is not None:
+            # Lo ocurrido mientras estuvo congelado no pasó por aquí: se empieza de nuevo
+            self._anillos[grupo] = anillo = AnilloMensajes()
+        anillo.locales += 1
+        return perdidos if last_seq is not None else ([], None)
+
+    def salir(self, grupo):
+        anillo = self._anillos.get(grupo)
+        if anillo is None:
+            return
+        anillo.locales -= 1
+        if anillo.locales <= 0:
+            anillo.locales = 0
+            anillo.congelado_en = time.monotonic()
+
+    def secuencia(self, grupo):
+        """Secuencia para un mensaje nuevo del grupo."""
+        anillo = self._anillos.get(grupo)
+        ultima = anillo.ultima if anillo is not None else 0
+        seq = max(reloj_us(), ultima + 1)
+        if anillo is not None:
+            anillo.ultima = seq
+        return seq
+
+    def registrar(self, grupo, evento):
+        anillo = self._anillos.get(grupo)
+        if anillo is not None:
+            anillo.registrar(evento)
+
+    def _limpiar(self):
+        ahora = time.monotonic()
+        if ahora < self._proxima_limpieza and len(self._anillos) < MAXIMO_ANILLOS:
+            return
+        self._proxima_limpieza = ahora + INTERVALO_LIMPIEZA_S
+        congelados = sorted(
+            (anillo.congelado_en, grupo) for grupo, anillo in self._anillos.items() if anillo.locales == 0
+        )
+        sobrantes = len(self._anillos) - MAXIMO_ANILLOS
+        for i, (congelado_en, grupo) in enumerate(congelados):
+            if i >= sobrantes and ahora - congelado_en < TTL_ANILLO_S:
+                break
+            del self._anillos[grupo]
+
+    def resumen(self):
+        return {
+            'anillos': len(self._anillos),
+            'activos': sum(1 for anillo in self._anillos.values() if anillo.locales),
+            'eventos': sum(len(anillo.eventos) for anillo in self._anillos.values()),
+        }
+
+
+registro_reanudacion = RegistroReanudacion()
+
+
+# ----------------------------------------------------------------------
+# 4. Sesión de reanudación (una por conexión)
+# ----------------------------------------------------------------------
+
+def leer_last_seq(scope):
+    """?last_seq=<n> de la URL del WebSocket, o None."""
+    try:
+        return int(parse_qs(scope.get('query_string', b'').decode()).get('last_seq', [''])[0])
+    except ValueError:
+        return None
+
+
+class SesionReanudacion:
+    """
+    Reanudación de un chat por WebSocket. El cliente que reconecta con
+    ?last_seq=<n> (la 'seq' del último mensaje que recibió) recibe solo lo
+    que se perdió: desde el anillo en memoria y, si este no alcanza, desde
+    la BD por el campo 'secuencia' (tras ESPERA_VACIADO_S, para que los
+    demás workers escriban lo que difundieron antes de la conexión).
+    Después llega {"tipo": "reanudacion", "seq": <última>, "completa": bool}; si
+    'completa' es false faltaron mensajes y conviene recargar el historial.
+
+    Uso en el consumidor: iniciar() tras group_add() y accept(); nuevo()
+    al principio de chat_message; secuencia() para cada mensaje enviado;
+    salir() al desconectar.
+    """
+
+    def __init__(self, grupo, scope):
+        self.grupo = grupo
+        self.last_seq = leer_last_seq(scope)
+        self.unido = False
+        self._repetidos = set()
+
+    async def iniciar(self, cargar_desde_bd):
+        """
+        Une la conexión al anillo del grupo y devuelve (eventos perdidos en
+        orden, completa). 'cargar_desde_bd(desde, limite)' es síncrona y
+        devuelve eventos con 'seq' > desde, en orden.
+        """
+        from channels.db import database_sync_to_async
+        from SuperService.escritura_diferida import escritor_mensajes
+
+        unido_en = time.monotonic()
+        eventos, desde_bd = registro_reanudacion.unir(self.grupo, self.last_seq)
+        self.unido = True
+        completa = True
+        if desde_bd is not None:
+            # Lo posterior a group_add llega por el grupo (y se deduplica con _repetidos)
+            await asyncio.sleep(max(0.0, unido_en + ESPERA_VACIADO_S - time.monotonic()))
+
+            def consultar():
+                # Lo que este proceso aún tiene en cola también debe verse en la BD
+                escritor_mensajes.vaciar()
+                return cargar_desde_bd(desde_bd, LIMITE_REPETICION + 1)
+
+            de_bd = await database_sync_to_async(consultar)()
+            completa = len(de_bd) <= LIMITE_REPETICION
+            eventos = eventos + de_bd[:LIMITE_REPETICION]
+
+        self._repetidos = {evento['seq'] for evento in eventos}
+        # Copias marcadas: los del anillo se comparten con las demás conexiones
+        return [dict(evento, repeticion=True) for evento in eventos], completa
+
+    def nuevo(self, evento):
+        """
+        Anota el evento del grupo en el anillo. False si ya se envió en la
+        reanudación (llegó por el grupo mientras se preparaba).
+        """
+        if evento.get('seq') is None or evento.get('repeticion'):
+            return True
+        registro_reanudacion.registrar(self.grupo, evento)
+        if evento['seq'] in self._repetidos:
+            self._repetidos.discard(evento['seq'])
+            return False
+        return True
+
+    def secuencia(self):
+        return registro_reanudacion.secuencia(self.grupo)
+
+    def salir(self):
+        if self.unido:
+            self.unido = False
+            registro_reanudacion.salir(self.grupo)
@@ -113,9 +113,31 @@ ASGI_APPLICATION = 'SuperService.asgi.application'
 CHANNEL_LAYERS = {
     'default': {
         # Usar la capa en memoria en desarrollo, o en caso de que Redis no esté configurado.
+        # Con varios workers en un mismo host y sin broker, usar
+        # 'SuperService.capa_canales.CapaSocketsUnix' (los procesos se hablan por sockets Unix).
         'BACKEND': config('CHANNEL_LAYER_BACKEND', default='channels.layers.InMemoryChannelLayer'),
     },
 }
+if CHANNEL_LAYERS['default']['BACKEND'] == 'SuperService.capa_canales.CapaSocketsUnix':
+    CHANNEL_LAYERS['default']['CONFIG'] = {
+        'directorio': config('CHANNEL_LAYER_DIR', default='/tmp/superservice-canales'),
+    }
+
+# Motor de asignación por lotes (transporte/asignacion.py): si está activo, el proceso
+# ASGI agrupa viajes 'solicitado' y conductores libres cada 2 s y los asigna en bloque.
+ASIGNACION_AUTOMATICA = config('ASIGNACION_AUTOMATICA', default=False, cast=bool)
+
+# Cómo se ofrecen los viajes nuevos (transporte/ofertas.py y transporte/cascada.py):
+# 'oleadas' avisa a grupos crecientes de conductores; 'cascada' a uno a la vez con
+# tiempo límite. Las asistencias viales siempre se ofrecen en cascada.
+MODO_OFERTAS_VIAJE = config('MODO_OFERTAS_VIAJE', default='oleadas')
+
+# Red vial local (transporte/ruteo.py) para distancias y tiempos por carretera sin
+# servicios externos. RED_VIAL_DIR: grafo generado con 'manage.py preprocesar_red_vial'
+# (se abre con mmap); RED_VIAL_OSM: extracto .osm que se compila al arrancar.
+# Sin ninguno se usa la línea recta.
+RED_VIAL_DIR = config('RED_VIAL_DIR', default='')
+RED_VIAL_OSM = config('RED_VIAL_OSM', default='')
 
 # ----------------------------------------------------------------------
 # CONFIGURACIÓN TRADICIONAL DE WSGI Y BASE DE DATOS
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class DomiciliosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'domicilios'
+
+    def ready(self):
+        # Registra las señales que invalidan el índice de comercios cercanos y liberan
+        # los pedidos de los lotes cancelados
+        from . import indice_comercios, lotes  # noqa: F401
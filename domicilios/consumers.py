@@ -2,11 +2,15 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
+from django.utils import timezone
 
 # Importa los modelos necesarios
 # Asegúrate que el modelo de usuario esté configurado en tu proyecto (settings.AUTH_USER_MODEL)
 from django.contrib.auth import get_user_model 
 from domicilios.models import Pedido, Mensaje 
+from SuperService.escritura_diferida import escritor_mensajes
+from SuperService.reanudacion_chat import SesionReanudacion
+from transporte.transiciones import SesionParticipante
 
 User = get_user_model() # Obtiene el modelo de usuario personalizado
 
@@ -20,6 +24,17 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
         self.pedido_id = self.scope['url_route']['kwargs']['pedido_id']
         self.room_group_name = 'chat_pedido_%s' % self.pedido_id
 
+        # Cliente, repartidor o staff: se resuelve una sola vez aquí y no en cada mensaje
+        self.sesion = SesionParticipante(self.scope["user"], 'pedido', self.pedido_id)
+        # ?last_seq=<n> al reconectar: solo se reenvía lo perdido (SuperService/reanudacion_chat.py)
+        self.reanudacion = SesionReanudacion(self.room_group_name, self.scope)
+        if not await self.autorizar():
+            await self.close()
+            return
+
+        # Vaciado periódico de los mensajes a la BD (una vez por proceso)
+        escritor_mensajes.iniciar()
+
         # Unirse al grupo de la sala
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -28,8 +43,10 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
 
         # Se acepta la conexión
         await self.accept()
+        await self.reanudar()
 
     async def disconnect(self, close_code):
+        self.reanudacion.salir()
         # Abandonar el grupo de la sala
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -40,11 +57,7 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
     # 2. MANEJO DE MENSAJES RECIBIDOS (del Cliente al Servidor)
     # ----------------------------------------------------
     async def receive(self, text_data):
-        """Recibe mensaje de WebSocket, lo guarda y lo reenvía al grupo."""
-        
-        # 🚨 DEBUG CRÍTICO: Debe aparecer en la consola de Daphne
-        print("--- MENSAJE RECIBIDO EN CONSUMER ---") 
-        
+        """Recibe mensaje de WebSocket, lo reenvía al grupo y lo encola para guardarlo."""
         try:
             data_json = json.loads(text_data)
             
@@ -60,25 +73,30 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
                      print("Usuario no autenticado, mensaje descartado.")
                 return
 
-            # 1. 💾 Guardar el mensaje en la Base de Datos (Operación SÍNCRONA)
-            # Llama a la función corregida save_message
-            mensaje_obj = await self.save_message(user, message) 
-            
-            # 2. 📢 Enviar el mensaje al grupo (Operación ASÍNCRONA)
-            timestamp = mensaje_obj.timestamp.strftime('%H:%M') # O el formato que uses
-            is_me = (user == mensaje_obj.emisor) # Revisa si el emisor es el usuario actual
-            
+            # Solo memoria; se vuelve a la BD únicamente si el pedido se reasignó o venció el TTL
+            if not self.sesion.vigente() and not await self.autorizar():
+                await self.close()
+                return
+
+            # 1. 📢 Enviar el mensaje al grupo (Operación ASÍNCRONA)
+            timestamp = timezone.now().strftime('%H:%M') # O el formato que uses
+            seq = self.reanudacion.secuencia()
+
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'chat_message',
                     'message': message,
                     'username': user.username,
-                    'is_me': is_me,
+                    'user_id': user.id,
                     'timestamp': timestamp,
+                    'seq': seq,
                 }
             )
 
+            # 2. 💾 Guardar el mensaje en la Base de Datos (en lote, ver SuperService/escritura_diferida.py)
+            await self.save_message(user, message, seq)
+
         except json.JSONDecodeError:
             print(f"Error: Datos recibidos no son JSON válido: {text_data}")
         except Exception as e:
@@ -91,6 +109,10 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
     # domicilios/consumers.py
 
     async def chat_message(self, event):
+        # Ya enviado al reanudar la conexión
+        if not self.reanudacion.nuevo(event):
+            return
+
         message = event['message']
         username = event['username']
         
@@ -106,24 +128,49 @@ class PedidoChatConsumer(AsyncWebsocketConsumer):
             'message': message,
             'username': username,
             'is_me': is_me, # Clave para que el frontend alinee la burbuja
+            'seq': event.get('seq'),
             # ⚠️ Nota: El frontend usa su propio timestamp, pero puedes enviar el del servidor si quieres.
         }))
 
+    async def reanudar(self):
+        """Reenvía los mensajes posteriores a ?last_seq= (si el cliente lo indicó)."""
+        eventos, completa = await self.reanudacion.iniciar(self.mensajes_desde_bd)
+        if self.reanudacion.last_seq is None:
+            return
+        for evento in eventos:
+            await self.chat_message(evento)
+        await self.send(text_data=json.dumps({
+            'tipo': 'reanudacion',
+            'seq': eventos[-1]['seq'] if eventos else self.reanudacion.last_seq,
+            'completa': completa,
+        }))
+
     # ----------------------------------------------------
-    # 4. FUNCIÓN ASÍNCRONA PARA GUARDAR EN DB (SÍNCRONA)
+    # 4. ACCESO A LA BD
     # ----------------------------------------------------
     @sync_to_async
-    def save_message(self, user, message):
-        # 🔑 Buscar el pedido para el mensaje
-        try:
-            pedido = Pedido.objects.get(pk=self.pedido_id)
-        except Pedido.DoesNotExist:
-            raise Exception("Pedido no encontrado")
-            
-        # 🔑 Crear y guardar el mensaje
+    def autorizar(self):
+        return self.sesion.resolver()
+
+    async def save_message(self, user, message, seq):
+        # 🔑 Encolar el mensaje: se inserta en lote junto con los demás
         # 🛑 CORRECCIÓN CLAVE: Usamos el nombre correcto 'Mensaje'
-        return Mensaje.objects.create(
-            pedido=pedido,
-            emisor=user,
-            contenido=message
-        )
\ No newline at end of file
+        await escritor_mensajes.guardar(
+            Mensaje(pedido_id=self.pedido_id, emisor=user, contenido=message, secuencia=seq)
+        )
+
+    def mensajes_desde_bd(self, desde, limite):
+        mensajes = Mensaje.objects.filter(
+            pedido_id=self.pedido_id, secuencia__gt=desde
+        ).select_related('emisor').order_by('secuencia')[:limite]
+        return [
+            {
+                'type': 'chat_message',
+                'message': m.contenido,
+                'username': m.emisor.username,
+                'user_id': m.emisor_id,
+                'timestamp': m.timestamp.strftime('%H:%M'),
+                'seq': m.secuencia,
+            }
+            for m in mensajes
+        ]
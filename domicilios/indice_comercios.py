@@ -0,0 +1,106 @@
+# domicilios/indice_comercios.py
+
+import threading
+import time
+
+import numpy as np
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from scipy.spatial import cKDTree
+
+from .utils import R_TIERRA_KM, distancias_haversine
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Vida máxima del índice. Los cambios hechos en ESTE proceso lo invalidan al
+# instante; el TTL cubre los cambios hechos por otros procesos/workers.
+TTL_INDICE_S = 60
+
+
+def _a_cartesianas(lats, lons):
+    """Convierte (lat, lon) en vectores unitarios 3D para el KD-tree."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.column_stack((cos_lat * np.cos(lons), cos_lat * np.sin(lons), np.sin(lats)))
+
+
+# ----------------------------------------------------------------------
+# 2. Índice KD-Tree de Comercios Activos
+# ----------------------------------------------------------------------
+
+class IndiceComercios:
+    """
+    KD-tree en memoria (scipy.spatial.cKDTree) con los comercios activos.
+
+    Los puntos se guardan como vectores unitarios en 3D, así que la distancia
+    euclidiana (cuerda) es monótona con la distancia sobre la Tierra y una
+    búsqueda por radio cuesta O(log n + resultados), sin importar cuántos
+    comercios existan. Se reconstruye de forma perezosa tras un cambio.
+    """
+
+    def __init__(self, ttl=TTL_INDICE_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = None
+        self._construido_en = 0.0
+
+    def invalidar(self):
+        self._datos = None
+
+    def _obtener(self):
+        datos = self._datos
+        if datos is not None and time.monotonic() - self._construido_en < self.ttl:
+            return datos
+
+        with self._lock:
+            if self._datos is None or time.monotonic() - self._construido_en >= self.ttl:
+                self._datos = self._construir()
+                self._construido_en = time.monotonic()
+            return self._datos
+
+    @staticmethod
+    def _construir():
+        from .models import Comercio
+
+        filas = list(Comercio.objects.filter(activo=True).values_list('id', 'latitud', 'longitud', 'tipo'))
+        ids = np.array([f[0] for f in filas], dtype=np.int64)
+        lats = np.array([float(f[1]) for f in filas], dtype=np.float64)
+        lons = np.array([float(f[2]) for f in filas], dtype=np.float64)
+        tipos = np.array([f[3] for f in filas], dtype=object)
+        arbol = cKDTree(_a_cartesianas(lats, lons)) if filas else None
+        return {'ids': ids, 'lats': lats, 'lons': lons, 'tipos': tipos, 'arbol': arbol}
+
+    def cercanos(self, lat, lon, radio_km, tipo=None):
+        """Lista [(comercio_id, distancia_km)] dentro del radio, ordenada por distancia."""
+        datos = self._obtener()
+        if datos['arbol'] is None:
+            return []
+
+        # Radio sobre la esfera -> longitud de cuerda en la esfera unitaria
+        cuerda = 2 * np.sin(min(radio_km / R_TIERRA_KM, np.pi) / 2)
+        indices = np.asarray(datos['arbol'].query_ball_point(_a_cartesianas([lat], [lon])[0], cuerda), dtype=np.int64)
+
+        if tipo and len(indices):
+            indices = indices[datos['tipos'][indices] == tipo]
+        if not len(indices):
+            return []
+
+        distancias = distancias_haversine(lat, lon, datos['lats'][indices], datos['lons'][indices])
+        orden = np.argsort(distancias, kind='stable')
+        return list(zip(datos['ids'][indices][orden].tolist(), distancias[orden].tolist()))
+
+
+indice_comercios = IndiceComercios()
+
+
+# ----------------------------------------------------------------------
+# 3. Invalidación al Cambiar un Comercio
+# ----------------------------------------------------------------------
+
+@receiver(post_save, sender='domicilios.Comercio')
+@receiver(post_delete, sender='domicilios.Comercio')
+def invalidar_indice_comercios(sender, **kwargs):
+    indice_comercios.invalidar()
@@ -0,0 +1,325 @@
+# domicilios/lotes.py
+
+import logging
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .utils import matriz_distancias_haversine
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros del Agrupador
+# ----------------------------------------------------------------------
+
+# Estados de un Pedido que todavía se pueden agrupar (aún no salieron del comercio)
+ESTADOS_AGRUPABLES = ['preparando', 'listo']
+
+# Unidades de producto (suma de ItemPedido.cantidad) que carga cada tipo de vehículo,
+# de menor a mayor. 'bus' no hace envíos.
+CAPACIDAD_UNIDADES = {
+    'moto': 8,
+    'auto': 20,
+    'camioneta': 60,
+}
+
+# Distancia máxima entre la entrega semilla del lote y cada entrega que se le suma
+RADIO_LOTE_KM = 2.0
+
+# Máximo de pedidos por lote (más paradas alargan demasiado la última entrega)
+MAXIMO_PEDIDOS_POR_LOTE = 4
+
+# Un lote entregado a los procesos ASGI que ninguno empezó a ofrecer en este plazo se cancela (segundos)
+PLAZO_TRASPASO_S = 60
+
+# Margen sobre la duración máxima de una cascada antes de dar por perdido un lote ofrecido (segundos)
+MARGEN_CASCADA_S = 60
+
+
+def tipos_con_capacidad(unidades):
+    """Tipos de vehículo que pueden llevar 'unidades', del más pequeño al más grande."""
+    return [tipo for tipo, capacidad in CAPACIDAD_UNIDADES.items() if capacidad >= unidades]
+
+
+# ----------------------------------------------------------------------
+# 2. Agrupación de los Pedidos de un Comercio
+# ----------------------------------------------------------------------
+
+def agrupar_pedidos(pedidos, radio_km=RADIO_LOTE_KM, maximo_pedidos=MAXIMO_PEDIDOS_POR_LOTE):
+    """
+    Agrupa los pedidos de UN comercio. 'pedidos' es una lista de dicts con
+    'id', 'unidades' y 'entrega' ((lat, lon)), ordenada del más antiguo al
+    más nuevo.
+
+    Agrupamiento voraz: el pedido más antiguo sin lote es la semilla y se le
+    suman las entregas más cercanas dentro de 'radio_km' mientras quepan en
+    el vehículo más grande. La matriz de distancias se calcula una vez,
+    vectorizada. Devuelve listas de índices; solo grupos de 2 o más.
+    """
+    if len(pedidos) < 2:
+        return []
+
+    coords = np.asarray([p['entrega'] for p in pedidos], dtype=np.float64)
+    distancias = matriz_distancias_haversine(coords[:, 0], coords[:, 1], coords[:, 0], coords[:, 1])
+    unidades = np.asarray([p['unidades'] for p in pedidos])
+    capacidad_maxima = max(CAPACIDAD_UNIDADES.values())
+
+    libres = np.ones(len(pedidos), dtype=bool)
+    grupos = []
+    for semilla in range(len(pedidos)):
+        if not libres[semilla]:
+            continue
+        libres[semilla] = False
+        grupo, carga = [semilla], int(unidades[semilla])
+
+        candidatos = np.flatnonzero(libres & (distancias[semilla] <= radio_km))
+        for indice in candidatos[np.argsort(distancias[semilla, candidatos])]:
+            if len(grupo) >= maximo_pedidos:
+                break
+            if carga + unidades[indice] > capacidad_maxima:
+                continue
+            grupo.append(int(indice))
+            carga += int(unidades[indice])
+            libres[indice] = False
+
+        if len(grupo) > 1:
+            grupos.append(grupo)
+        # Una semilla sin compañeros se entrega sola, como hasta ahora
+    return grupos
+
+
+# ----------------------------------------------------------------------
+# 3. Creación y Publicación de Lotes
+# ----------------------------------------------------------------------
+
+def armar_lotes(radio_km=RADIO_LOTE_KM, maximo_pedidos=MAXIMO_PEDIDOS_POR_LOTE):
+    """
+    Crea lotes con los pedidos agrupables (sin repartidor ni lote) de todos
+    los comercios y los ofrece, cada uno, a un solo repartidor con un
+    vehículo capaz de llevarlo. Son dos lecturas en total (pedidos y sus
+    unidades) más las escrituras de los lotes creados. Antes cancela los
+    lotes que se quedaron sin ofrecer (cancelar_lotes_vencidos).
+    Devuelve (lotes creados, tiempo_ms).
+    """
+    from .models import Pedido, ItemPedido
+
+    t0 = time.perf_counter()
+    cancelar_lotes_vencidos()
+
+    filas = list(
+        Pedido.objects.filter(estado__in=ESTADOS_AGRUPABLES, repartidor__isnull=True, lote__isnull=True)
+        .order_by('creado_en', 'id')
+        .values('id', 'comercio_id', 'lat_entrega', 'lon_entrega')
+    )
+    if not filas:
+        return [], 0.0
+
+    unidades = dict(
+        ItemPedido.objects.filter(pedido_id__in=[f['id'] for f in filas])
+        .values('pedido_id').annotate(total=Sum('cantidad')).values_list('pedido_id', 'total')
+    )
+
+    por_comercio = {}
+    for fila in filas:
+        por_comercio.setdefault(fila['comercio_id'], []).append({
+            'id': fila['id'],
+            # Un pedido sin items ocupa al menos una unidad
+            'unidades': max(int(unidades.get(fila['id']) or 0), 1),
+            'entrega': (float(fila['lat_entrega']), float(fila['lon_entrega'])),
+        })
+
+    creados = []
+    for comercio_id, pedidos in por_comercio.items():
+        for grupo in agrupar_pedidos(pedidos, radio_km, maximo_pedidos):
+            ids = [pedidos[i]['id'] for i in grupo]
+            total = sum(pedidos[i]['unidades'] for i in grupo)
+            lote = _crear_lote(comercio_id, ids, total)
+            if lote is not None:
+                creados.append(lote)
+
+    return creados, round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _crear_lote(comercio_id, pedido_ids, unidades):
+    from .models import Pedido, LoteEntrega
+
+    with transaction.atomic():
+        lote = LoteEntrega.objects.create(
+            comercio_id=comercio_id, unidades=unidades,
+            tipo_vehiculo_minimo=tipos_con_capacidad(unidades)[0],
+        )
+        # UPDATE condicional: un repartidor pudo tomar alguno de estos pedidos mientras tanto
+        asignados = Pedido.objects.filter(
+            pk__in=pedido_ids, repartidor__isnull=True, lote__isnull=True
+        ).update(lote=lote)
+        if asignados < 2:
+            transaction.set_rollback(True)
+            return None
+        transaction.on_commit(lambda: _publicar_o_cancelar(lote))
+    return lote
+
+
+def _publicar_o_cancelar(lote):
+    if not publicar_lote(lote):
+        logger.warning("No hay proceso que ofrezca el lote %s: se cancela y sus pedidos se liberan.", lote.pk)
+        cancelar_lote(lote.pk)
+
+
+def publicar_lote(lote):
+    """
+    Ofrece el lote en cascada a los repartidores disponibles con un vehículo
+    capaz. Un proceso sin el bucle de la cascada (comando 'armar_lotes',
+    WSGI) se lo entrega a los procesos ASGI por la capa de canales.
+    Devuelve False si nadie lo va a ofrecer.
+    """
+    from transporte.cascada import despachador_cascada
+
+    if despachador_cascada.activo():
+        return ofrecer_lote(lote.pk)
+    return despachador_cascada.traspasar_lote(lote.pk)
+
+
+def ofrecer_lote(lote_id):
+    """
+    Publica el lote en la cascada de ESTE proceso. Lo marca antes con un
+    UPDATE condicional sobre 'ofrecido_en', así que con varios procesos
+    ASGI lo ofrece uno solo. Si no se puede publicar o nadie lo acepta, el
+    lote se cancela. Devuelve False si no se pudo publicar.
+    """
+    from usuarios.models import UsuarioPersonalizado
+    from transporte.cascada import despachador_cascada
+    from .models import LoteEntrega
+
+    tomado = LoteEntrega.objects.filter(
+        pk=lote_id, estado='solicitado', ofrecido_en__isnull=True
+    ).update(ofrecido_en=timezone.now())
+    if not tomado:
+        # Ya lo ofrece otro proceso, o dejó de estar solicitado
+        return True
+
+    lote = LoteEntrega.objects.select_related('comercio').get(pk=lote_id)
+    repartidores = set(
+        UsuarioPersonalizado.objects.filter(rol='repartidor_domicilios', disponible=True)
+        .values_list('id', flat=True)
+    )
+    comercio = lote.comercio
+    datos = {
+        'lote_id': lote.pk,
+        'comercio': comercio.nombre,
+        'origen': [float(comercio.latitud), float(comercio.longitud)],
+        'pedidos': list(lote.pedidos.values_list('id', flat=True)),
+        'unidades': lote.unidades,
+    }
+    publicado = despachador_cascada.publicar_lote(
+        lote.pk, datos, tipos_con_capacidad(lote.unidades), repartidores,
+        al_agotar=lambda: cancelar_lote(lote_id),
+    )
+    if not publicado:
+        cancelar_lote(lote_id)
+    return publicado
+
+
+# ----------------------------------------------------------------------
+# 4. Cancelación
+# ----------------------------------------------------------------------
+
+def cancelar_lote(lote_id):
+    """
+    Cancela el lote si sigue esperando repartidor (nadie lo ofrece o nadie
+    lo aceptó). Sus pedidos se liberan en la señal de abajo y el próximo
+    armar_lotes los vuelve a agrupar. Devuelve True si lo canceló.
+    """
+    from transporte.transiciones import transicionar
+    from .models import LoteEntrega
+
+    with transaction.atomic():
+        # Bloqueado: un repartidor que lo acepte ahora no puede quedar con un lote cancelado
+        lote = LoteEntrega.objects.select_for_update().filter(pk=lote_id, estado='solicitado').first()
+        if lote is None:
+            return False
+        transicionar(lote, 'cancelado')
+    return True
+
+
+def cancelar_lotes_vencidos():
+    """
+    Cancela los lotes 'solicitado' que ningún proceso empezó a ofrecer en
+    PLAZO_TRASPASO_S (se perdió el traspaso) o cuya cascada ya debió
+    terminar (el proceso que la llevaba cayó). Devuelve cuántos canceló.
+    """
+    from transporte.cascada import MAXIMO_INTENTOS, TIEMPO_RESPUESTA_S
+    from .models import LoteEntrega
+
+    ahora = timezone.now()
+    duracion_cascada = MAXIMO_INTENTOS * TIEMPO_RESPUESTA_S + MARGEN_CASCADA_S
+    vencidos = LoteEntrega.objects.filter(estado='solicitado').filter(
+        Q(ofrecido_en__isnull=True, creado_en__lt=ahora - timedelta(seconds=PLAZO_TRASPASO_S))
+        | Q(ofrecido_en__lt=ahora - timedelta(seconds=duracion_cascada))
+    ).values_list('pk', flat=True)
+    return sum(1 for lote_id in list(vencidos) if cancelar_lote(lote_id))
+
+
+@receiver(post_save, sender='domicilios.LoteEntrega')
+def liberar_pedidos_lote_cancelado(sender, instance, update_fields=None, **kwargs):
+    """
+    Un lote cancelado (por cancelar_lote o por la API de transiciones)
+    devuelve al agrupador los pedidos que aún no salieron del comercio.
+    """
+    from transporte.transiciones import participantes
+    from .models import Pedido
+
+    if instance.estado != 'cancelado' or (update_fields is not None and 'estado' not in update_fields):
+        return
+    pedido_ids = list(
+        Pedido.objects.filter(lote=instance, estado__in=ESTADOS_AGRUPABLES).values_list('pk', flat=True)
+    )
+    if not pedido_ids:
+        return
+    Pedido.objects.filter(pk__in=pedido_ids).update(lote=None, repartidor=None, vehiculo_usado=None)
+    # El UPDATE no dispara post_save: los chats de esos pedidos pierden al repartidor
+    transaction.on_commit(lambda: participantes.invalidar('pedido', *pedido_ids))
+
+
+# ----------------------------------------------------------------------
+# 5. Aceptación
+# ----------------------------------------------------------------------
+
+def vehiculo_para_lote(repartidor, unidades):
+    """El vehículo aprobado más pequeño del repartidor que puede llevar el lote, o None."""
+    from transporte.models import Vehiculo
+
+    tipos = tipos_con_capacidad(unidades)
+    vehiculos = {
+        v.tipo: v for v in Vehiculo.objects.filter(conductor=repartidor, aprobado=True, tipo__in=tipos)
+    }
+    return next((vehiculos[tipo] for tipo in tipos if tipo in vehiculos), None)
+
+
+def reclamar_lote(lote, repartidor, vehiculo):
+    """
+    Toma el lote con el mismo UPDATE condicional que viajes y asistencias y
+    asigna todos sus pedidos al repartidor en la misma transacción.
+    Devuelve True si esta llamada se quedó con el lote.
+    """
+    from transporte.despacho import reclamar_solicitud
+    from transporte.cascada import despachador_cascada
+    from transporte.transiciones import participantes
+    from .models import Pedido, LoteEntrega
+
+    with transaction.atomic():
+        if not reclamar_solicitud(LoteEntrega, lote.pk, repartidor=repartidor, vehiculo_usado=vehiculo):
+            return False
+        pedido_ids = list(Pedido.objects.filter(lote=lote).values_list('pk', flat=True))
+        Pedido.objects.filter(pk__in=pedido_ids).update(repartidor=repartidor, vehiculo_usado=vehiculo)
+        # El UPDATE no dispara post_save: los chats de esos pedidos ganan repartidor
+        transaction.on_commit(lambda: participantes.invalidar('pedido', *pedido_ids))
+
+    despachador_cascada.aceptada(('lote', lote.pk), repartidor.pk)
+    return True
@@ -0,0 +1,32 @@
+# domicilios/management/commands/armar_lotes.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from domicilios.lotes import armar_lotes, RADIO_LOTE_KM, MAXIMO_PEDIDOS_POR_LOTE
+
+
+class Command(BaseCommand):
+    help = (
+        "Agrupa en lotes los pedidos 'preparando'/'listo' del mismo comercio con entregas "
+        "cercanas y ofrece cada lote a un solo repartidor con un vehículo de capacidad suficiente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ventana', type=float, default=30.0, help="Segundos entre pasadas.")
+        parser.add_argument('--radio', type=float, default=RADIO_LOTE_KM, help="Radio máximo entre entregas (km).")
+        parser.add_argument('--maximo', type=int, default=MAXIMO_PEDIDOS_POR_LOTE, help="Pedidos máximos por lote.")
+        parser.add_argument('--una-vez', action='store_true', help="Ejecuta una sola pasada y termina.")
+
+    def handle(self, *args, **options):
+        ventana = options['ventana']
+
+        while True:
+            inicio = time.monotonic()
+            lotes, tiempo_ms = armar_lotes(options['radio'], options['maximo'])
+            pedidos = sum(lote.pedidos.count() for lote in lotes)
+            self.stdout.write(f"{len(lotes)} lotes ({pedidos} pedidos) en {tiempo_ms:.1f} ms")
+            if options['una_vez']:
+                return
+            time.sleep(max(0.0, ventana - (time.monotonic() - inicio)))
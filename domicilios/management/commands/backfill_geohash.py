@@ -0,0 +1,55 @@
+# domicilios/management/commands/backfill_geohash.py
+
+from django.core.management.base import BaseCommand
+
+from domicilios.models import Comercio, Pedido
+from transporte.models import Viaje, SolicitudAsistencia
+
+MODELOS = {
+    'viaje': Viaje,
+    'asistencia': SolicitudAsistencia,
+    'comercio': Comercio,
+    'pedido': Pedido,
+}
+
+
+class Command(BaseCommand):
+    help = "Calcula la columna geohash de las filas existentes (Viaje, SolicitudAsistencia, Comercio, Pedido)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo', choices=sorted(MODELOS), action='append',
+            help="Limitar a uno o varios modelos (por defecto, todos).",
+        )
+        parser.add_argument('--todos', action='store_true', help="Recalcular también las filas que ya tienen geohash.")
+        parser.add_argument('--lote', type=int, default=1000, help="Filas por bulk_update.")
+
+    def handle(self, *args, **options):
+        for nombre in options['modelo'] or sorted(MODELOS):
+            modelo = MODELOS[nombre]
+            _, _, campo_geohash = modelo.GEOHASH_CAMPOS
+
+            queryset = modelo.objects.order_by('pk')
+            if not options['todos']:
+                queryset = queryset.filter(**{campo_geohash: ''})
+
+            lote = []
+            total = 0
+            for objeto in queryset.iterator(chunk_size=options['lote']):
+                objeto.calcular_geohash()
+                lote.append(objeto)
+                if len(lote) >= options['lote']:
+                    total += self._guardar(modelo, campo_geohash, lote)
+            total += self._guardar(modelo, campo_geohash, lote)
+
+            self.stdout.write(f"{modelo.__name__}: {total} filas actualizadas.")
+        self.stdout.write(self.style.SUCCESS("Backfill de geohash completado."))
+
+    @staticmethod
+    def _guardar(modelo, campo_geohash, lote):
+        if not lote:
+            return 0
+        modelo.objects.bulk_update(lote, [campo_geohash])
+        cantidad = len(lote)
+        lote.clear()
+        return cantidad
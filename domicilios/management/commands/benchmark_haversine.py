@@ -0,0 +1,66 @@
+# domicilios/management/commands/benchmark_haversine.py
+
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from domicilios.utils import (
+    calcular_distancia_haversine,
+    distancias_haversine,
+    matriz_distancias_haversine,
+    puntos_en_radio,
+)
+
+
+class Command(BaseCommand):
+    help = "Compara la versión escalar de Haversine con la versión vectorizada (NumPy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--puntos', type=int, default=100_000, help="Cantidad de puntos destino.")
+        parser.add_argument('--matriz', type=int, default=1_000, help="Lado de la matriz muchos-a-muchos.")
+        parser.add_argument('--radio', type=float, default=3.0, help="Radio (km) para el prefiltro de caja.")
+
+    def handle(self, *args, **options):
+        n = options['puntos']
+        m = options['matriz']
+        radio = options['radio']
+
+        # Puntos aleatorios alrededor de Caracas (≈ 40 km x 40 km)
+        rng = np.random.default_rng(42)
+        lats = 10.48 + rng.uniform(-0.2, 0.2, n)
+        lons = -66.90 + rng.uniform(-0.2, 0.2, n)
+        origen = (10.48, -66.90)
+
+        # 1. Escalar: un llamado por par de puntos
+        lista_lats, lista_lons = lats.tolist(), lons.tolist()
+        inicio = time.perf_counter()
+        escalar = [calcular_distancia_haversine(origen[0], origen[1], la, lo) for la, lo in zip(lista_lats, lista_lons)]
+        t_escalar = time.perf_counter() - inicio
+
+        # 2. Vectorizado: uno-a-muchos
+        inicio = time.perf_counter()
+        vectorizado = distancias_haversine(origen[0], origen[1], lats, lons)
+        t_vector = time.perf_counter() - inicio
+
+        error_maximo = float(np.max(np.abs(vectorizado - np.asarray(escalar))))
+
+        # 3. Prefiltro de caja + distancias exactas
+        inicio = time.perf_counter()
+        indices, _ = puntos_en_radio(origen[0], origen[1], radio, lats, lons)
+        t_radio = time.perf_counter() - inicio
+
+        # 4. Matriz muchos-a-muchos
+        muestra = random.Random(7).sample(range(n), min(m, n))
+        inicio = time.perf_counter()
+        matriz = matriz_distancias_haversine(lats[muestra], lons[muestra], lats[muestra], lons[muestra])
+        t_matriz = time.perf_counter() - inicio
+
+        self.stdout.write(f"Puntos: {n:,}")
+        self.stdout.write(f"  Escalar (math)           : {t_escalar * 1000:9.2f} ms")
+        self.stdout.write(f"  Vectorizado (NumPy)      : {t_vector * 1000:9.2f} ms  ({t_escalar / t_vector:.1f}x)")
+        self.stdout.write(f"  Error máximo             : {error_maximo:.2e} km")
+        self.stdout.write(f"  Caja + radio {radio:g} km     : {t_radio * 1000:9.2f} ms  ({len(indices):,} puntos dentro)")
+        self.stdout.write(f"  Matriz {matriz.shape[0]}x{matriz.shape[1]}         : {t_matriz * 1000:9.2f} ms")
+        self.stdout.write(self.style.SUCCESS("Benchmark completado."))
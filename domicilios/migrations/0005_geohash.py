@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0004_mensaje'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comercio',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='geohash_entrega',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0007_trazaviaje'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('domicilios', '0005_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteEntrega',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('solicitado', 'Esperando Repartidor'), ('aceptado', 'Aceptado por Repartidor'), ('completado', 'Completado'), ('cancelado', 'Cancelado')], db_index=True, default='solicitado', max_length=20)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('tipo_vehiculo_minimo', models.CharField(choices=[('auto', 'Automóvil (Viajes)'), ('moto', 'Motocicleta (Viajes y Envíos)'), ('bus', 'Autobús (Rutas Compartidas)'), ('camioneta', 'Camioneta (Asistencia Vial/Envío Grande)')], max_length=15)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('comercio', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lotes', to='domicilios.comercio')),
+                ('repartidor', models.ForeignKey(blank=True, limit_choices_to={'rol': 'repartidor_domicilios'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lotes_entrega', to=settings.AUTH_USER_MODEL)),
+                ('vehiculo_usado', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='transporte.vehiculo')),
+            ],
+            options={
+                'verbose_name': 'Lote de Entrega',
+                'verbose_name_plural': 'Lotes de Entrega',
+            },
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='lote',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pedidos', to='domicilios.loteentrega'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0006_loteentrega'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['pedido', 'timestamp', 'id'], name='mensajepedido_hist_idx'),
+        ),
+    ]
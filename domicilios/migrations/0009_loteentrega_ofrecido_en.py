@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domicilios', '0008_mensaje_secuencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loteentrega',
+            name='ofrecido_en',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
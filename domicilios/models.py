@@ -2,15 +2,18 @@
 from django.db import models
 from usuarios.models import UsuarioPersonalizado # Importar el modelo de usuario
 from transporte.models import Vehiculo
+from .utils import GeohashMixin, GeoQuerySet
 
 # ----------------------------------------------------------------------
 # 1. Gestión de Comercios (Proveedores)
 # ----------------------------------------------------------------------
 
-class Comercio(models.Model):
+class Comercio(GeohashMixin, models.Model):
     """
     Representa un restaurante, supermercado o farmacia en la plataforma.
     """
+    GEOHASH_CAMPOS = ('latitud', 'longitud', 'geohash')
+
     TIPO_CHOICES = (
         ('restaurante', 'Restaurante'),
         ('supermercado', 'Supermercado'),
@@ -32,9 +35,12 @@ class Comercio(models.Model):
     direccion = models.CharField(max_length=255)
     latitud = models.DecimalField(max_digits=9, decimal_places=6)
     longitud = models.DecimalField(max_digits=9, decimal_places=6)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     
     activo = models.BooleanField(default=True, help_text="Indica si el comercio está recibiendo pedidos.")
 
+    objects = GeoQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.nombre} ({self.get_tipo_display()})"
 
@@ -56,10 +62,12 @@ class Producto(models.Model):
 # 2. Gestión de Pedidos
 # ----------------------------------------------------------------------
 
-class Pedido(models.Model):
+class Pedido(GeohashMixin, models.Model):
     """
     Representa una solicitud de compra de un cliente a un comercio.
     """
+    GEOHASH_CAMPOS = ('lat_entrega', 'lon_entrega', 'geohash_entrega')
+
     ESTADO_CHOICES = (
         ('pendiente', 'Pendiente de Aceptación'),
         ('preparando', 'En Preparación'),
@@ -93,11 +101,20 @@ class Pedido(models.Model):
     )
 
     comercio = models.ForeignKey(Comercio, on_delete=models.PROTECT) # PROTECT para no borrar pedidos si se elimina el comercio
+
+    # Lote al que pertenece el pedido cuando se entrega junto con otros del mismo comercio
+    lote = models.ForeignKey(
+        'LoteEntrega',
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='pedidos'
+    )
     
     # Detalles de la entrega
     direccion_entrega = models.CharField(max_length=255)
     lat_entrega = models.DecimalField(max_digits=9, decimal_places=6)
     lon_entrega = models.DecimalField(max_digits=9, decimal_places=6)
+    geohash_entrega = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
     
@@ -108,6 +125,8 @@ class Pedido(models.Model):
     creado_en = models.DateTimeField(auto_now_add=True)
     entregado_en = models.DateTimeField(null=True, blank=True)
 
+    objects = GeoQuerySet.as_manager()
+
     def __str__(self):
         return f"Pedido #{self.id} a {self.comercio.nombre}"
 
@@ -126,6 +145,49 @@ class ItemPedido(models.Model):
     def __str__(self):
         return f"{self.cantidad} x {self.producto.nombre}"
 
+# ----------------------------------------------------------------------
+# 2b. Lotes de Entrega (varios pedidos, un solo repartidor)
+# ----------------------------------------------------------------------
+
+class LoteEntrega(models.Model):
+    """
+    Agrupa pedidos del mismo comercio con entregas cercanas para que los
+    lleve un único repartidor (ver domicilios/lotes.py).
+    """
+    ESTADO_CHOICES = (
+        ('solicitado', 'Esperando Repartidor'),
+        ('aceptado', 'Aceptado por Repartidor'),
+        ('completado', 'Completado'),
+        ('cancelado', 'Cancelado'),
+    )
+
+    comercio = models.ForeignKey(Comercio, on_delete=models.PROTECT, related_name='lotes')
+    repartidor = models.ForeignKey(
+        UsuarioPersonalizado,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        limit_choices_to={'rol': 'repartidor_domicilios'},
+        related_name='lotes_entrega'
+    )
+    vehiculo_usado = models.ForeignKey(Vehiculo, on_delete=models.SET_NULL, null=True, blank=True)
+
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='solicitado', db_index=True)
+
+    # Volumen total (unidades de producto) y vehículo más pequeño que lo puede llevar
+    unidades = models.PositiveIntegerField(default=0)
+    tipo_vehiculo_minimo = models.CharField(max_length=15, choices=Vehiculo.TIPO_CHOICES)
+
+    creado_en = models.DateTimeField(auto_now_add=True)
+    # Cuándo un proceso empezó a ofrecerlo en cascada (lo toma uno solo: lotes.ofrecer_lote)
+    ofrecido_en = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = "Lote de Entrega"
+        verbose_name_plural = "Lotes de Entrega"
+
+    def __str__(self):
+        return f"Lote #{self.id} de {self.comercio.nombre} ({self.get_estado_display()})"
+
 
 
 # domicilios/models.py (Añadir al final del archivo)
@@ -165,11 +227,19 @@ class Mensaje(models.Model):
         verbose_name='Fecha/Hora de Envío'
     )
 
+    # Secuencia del chat en vivo para reanudar tras reconectar (SuperService/reanudacion_chat.py)
+    secuencia = models.BigIntegerField(null=True, blank=True, editable=False)
+
     class Meta:
         verbose_name = "Mensaje de Pedido"
         verbose_name_plural = "Mensajes de Pedido"
         # Ordenamos los mensajes por la hora de envío para el historial del chat
         ordering = ['timestamp']
+        # Historial por páginas (SuperService/historial_chat.py)
+        indexes = [
+            models.Index(fields=['pedido', 'timestamp', 'id'], name='mensajepedido_hist_idx'),
+            models.Index(fields=['pedido', 'secuencia'], name='mensajepedido_seq_idx'),
+        ]
 
     def __str__(self):
         # Muestra un extracto del mensaje para fácil identificación
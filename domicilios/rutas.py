@@ -0,0 +1,236 @@
+# domicilios/rutas.py
+
+import time
+
+import numpy as np
+
+from .utils import matriz_distancias_haversine
+
+# ----------------------------------------------------------------------
+# 1. Parámetros del Planificador
+# ----------------------------------------------------------------------
+
+# Estados de un Pedido que todavía requieren paradas del repartidor
+ESTADOS_EN_RUTA = ['preparando', 'listo', 'en_camino']
+
+# En 'en_camino' el pedido ya se recogió: solo falta la entrega
+ESTADOS_RECOGIDOS = ['en_camino']
+
+# Tope de pasadas de 2-opt (en la práctica converge en pocas)
+MAXIMO_PASADAS_2OPT = 50
+
+
+# ----------------------------------------------------------------------
+# 2. Construcción: Inserción más Cercana con Recogida antes de Entrega
+# ----------------------------------------------------------------------
+
+def _costo_ruta(distancias, ruta):
+    return float(distancias[ruta[:-1], ruta[1:]].sum()) if len(ruta) > 1 else 0.0
+
+
+def _insertar_par(distancias, ruta, recogida, entrega):
+    """
+    Inserta (recogida, entrega) en la posición de menor costo manteniendo la
+    recogida antes de la entrega. Los costos de todos los huecos se calculan
+    vectorizados; el mejor par i <= j sale de un mínimo de sufijos.
+    Si 'recogida' es None solo se inserta la entrega.
+    """
+    nodos = np.asarray(ruta)
+    previos = nodos
+    siguientes = np.append(nodos[1:], -1)
+    es_final = siguientes == -1
+    siguientes_seguros = np.where(es_final, nodos, siguientes)
+
+    def delta(nodo):
+        # Costo de insertar 'nodo' después de cada posición de la ruta (ruta abierta)
+        extra = distancias[previos, nodo] + np.where(es_final, 0.0, distancias[nodo, siguientes_seguros])
+        return extra - np.where(es_final, 0.0, distancias[previos, siguientes_seguros])
+
+    delta_entrega = delta(entrega)
+    if recogida is None:
+        j = int(np.argmin(delta_entrega))
+        return ruta[:j + 1] + [entrega] + ruta[j + 1:]
+
+    delta_recogida = delta(recogida)
+
+    # a) Recogida y entrega juntas en el mismo hueco: a -> p -> d -> b
+    juntas = (
+        distancias[previos, recogida] + distancias[recogida, entrega]
+        + np.where(es_final, 0.0, distancias[entrega, siguientes_seguros])
+        - np.where(es_final, 0.0, distancias[previos, siguientes_seguros])
+    )
+    i_juntas = int(np.argmin(juntas))
+    mejor = (float(juntas[i_juntas]), i_juntas, i_juntas)
+
+    # b) En huecos distintos i < j: delta_recogida[i] + min(delta_entrega[j > i])
+    if len(ruta) > 1:
+        # Índice del mínimo de cada sufijo de delta_entrega
+        arg_sufijo = np.empty(len(ruta), dtype=np.int64)
+        arg = len(ruta) - 1
+        for k in range(len(ruta) - 1, -1, -1):
+            if delta_entrega[k] <= delta_entrega[arg]:
+                arg = k
+            arg_sufijo[k] = arg
+        separadas = delta_recogida[:-1] + delta_entrega[arg_sufijo[1:]]
+        i = int(np.argmin(separadas))
+        if separadas[i] < mejor[0]:
+            mejor = (float(separadas[i]), i, int(arg_sufijo[i + 1]))
+
+    _, i, j = mejor
+    if i == j:
+        return ruta[:i + 1] + [recogida, entrega] + ruta[i + 1:]
+    return ruta[:i + 1] + [recogida] + ruta[i + 1:j + 1] + [entrega] + ruta[j + 1:]
+
+
+def construir_ruta(distancias, pares):
+    """
+    Ruta inicial desde el nodo 0 (posición del repartidor). 'pares' es una
+    lista de (recogida o None, entrega). Se inserta primero el par cuyo
+    primer nodo está más cerca de la ruta actual (inserción más cercana).
+    """
+    ruta = [0]
+    pendientes = list(pares)
+    while pendientes:
+        en_ruta = np.asarray(ruta)
+        primeros = np.array([p if p is not None else d for p, d in pendientes])
+        cercania = distancias[np.ix_(en_ruta, primeros)].min(axis=0)
+        recogida, entrega = pendientes.pop(int(np.argmin(cercania)))
+        ruta = _insertar_par(distancias, ruta, recogida, entrega)
+    return ruta
+
+
+# ----------------------------------------------------------------------
+# 3. Mejora: 2-opt que Respeta el Orden Recogida -> Entrega
+# ----------------------------------------------------------------------
+
+def mejorar_2opt(distancias, ruta, recogida_de):
+    """
+    2-opt sobre una ruta abierta con inicio fijo. Invertir el tramo
+    ruta[i..j] solo es válido si ningún pedido tiene su recogida y su
+    entrega dentro del tramo (quedarían en orden inverso).
+    'recogida_de' mapea nodo de entrega -> nodo de recogida.
+    """
+    ruta = list(ruta)
+    n = len(ruta)
+    for _ in range(MAXIMO_PASADAS_2OPT):
+        mejoro = False
+        for i in range(1, n - 1):
+            a, c = ruta[i - 1], ruta[i]
+            # Ganancia de todas las j > i de una vez
+            js = np.arange(i + 1, n)
+            ruta_arr = np.asarray(ruta)
+            d_nodos = ruta_arr[js]
+            b_nodos = np.where(js + 1 < n, ruta_arr[np.minimum(js + 1, n - 1)], -1)
+            hay_b = b_nodos != -1
+            b_seguros = np.where(hay_b, b_nodos, d_nodos)
+            antes = distancias[a, c] + np.where(hay_b, distancias[d_nodos, b_seguros], 0.0)
+            despues = distancias[a, d_nodos] + np.where(hay_b, distancias[c, b_seguros], 0.0)
+            ganancias = antes - despues
+
+            for k in np.argsort(-ganancias):
+                if ganancias[k] <= 1e-9:
+                    break
+                j = int(js[k])
+                tramo = ruta[i:j + 1]
+                en_tramo = set(tramo)
+                if any(recogida_de.get(nodo) in en_tramo for nodo in tramo):
+                    continue
+                ruta[i:j + 1] = ruta[i:j + 1][::-1]
+                mejoro = True
+                break
+        if not mejoro:
+            break
+    return ruta
+
+
+# ----------------------------------------------------------------------
+# 4. Plan de un Repartidor
+# ----------------------------------------------------------------------
+
+def planificar_ruta(inicio, pedidos):
+    """
+    Ordena las paradas de un repartidor.
+
+    'inicio' es (lat, lon) del repartidor; 'pedidos' una lista de dicts con
+    'id', 'recogida' ((lat, lon) del comercio o None si ya se recogió),
+    'entrega' ((lat, lon) del cliente) y opcionalmente 'comercio'.
+
+    Devuelve {'paradas': [...], 'distancia_total_km', 'tiempo_ms'}.
+    """
+    t0 = time.perf_counter()
+
+    # Nodo 0 = repartidor; luego recogidas y entregas
+    coords = [inicio]
+    paradas = [None]
+    pares = []
+    recogida_de = {}
+    for pedido in pedidos:
+        recogida = None
+        if pedido.get('recogida') is not None:
+            recogida = len(coords)
+            coords.append(pedido['recogida'])
+            paradas.append(('recoger', pedido))
+        entrega = len(coords)
+        coords.append(pedido['entrega'])
+        paradas.append(('entregar', pedido))
+        pares.append((recogida, entrega))
+        if recogida is not None:
+            recogida_de[entrega] = recogida
+
+    coords = np.asarray(coords, dtype=np.float64)
+    distancias = matriz_distancias_haversine(coords[:, 0], coords[:, 1], coords[:, 0], coords[:, 1])
+
+    ruta = construir_ruta(distancias, pares)
+    ruta = mejorar_2opt(distancias, ruta, recogida_de)
+
+    resultado = []
+    acumulada = 0.0
+    for anterior, nodo in zip(ruta[:-1], ruta[1:]):
+        acumulada += float(distancias[anterior, nodo])
+        tipo, pedido = paradas[nodo]
+        lat, lon = coords[nodo]
+        resultado.append({
+            'tipo': tipo,
+            'pedido': pedido['id'],
+            'comercio': pedido.get('comercio'),
+            'lat': round(float(lat), 6),
+            'lon': round(float(lon), 6),
+            'distancia_acumulada_km': round(acumulada, 3),
+        })
+
+    return {
+        'paradas': resultado,
+        'distancia_total_km': round(_costo_ruta(distancias, np.asarray(ruta)), 3),
+        'tiempo_ms': round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+
+def planificar_ruta_repartidor(repartidor, inicio=None):
+    """
+    Plan para los pedidos asignados a un repartidor. Si no se indica
+    'inicio' se usa su última posición guardada. Devuelve None si no hay
+    posición conocida.
+    """
+    from .models import Pedido
+
+    if inicio is None:
+        if repartidor.latitud is None or repartidor.longitud is None:
+            return None
+        inicio = (float(repartidor.latitud), float(repartidor.longitud))
+
+    pedidos = [
+        {
+            'id': p['id'],
+            'comercio': p['comercio__nombre'],
+            'recogida': None if p['estado'] in ESTADOS_RECOGIDOS
+            else (float(p['comercio__latitud']), float(p['comercio__longitud'])),
+            'entrega': (float(p['lat_entrega']), float(p['lon_entrega'])),
+        }
+        for p in Pedido.objects.filter(repartidor=repartidor, estado__in=ESTADOS_EN_RUTA).values(
+            'id', 'estado', 'lat_entrega', 'lon_entrega',
+            'comercio__nombre', 'comercio__latitud', 'comercio__longitud',
+        )
+    ]
+    if not pedidos:
+        return {'paradas': [], 'distancia_total_km': 0.0, 'tiempo_ms': 0.0}
+    return planificar_ruta(inicio, pedidos)
@@ -2,7 +2,8 @@
 
 # domicilios/serializers.py
 from rest_framework import serializers
-from .models import Comercio, Categoria, Producto, Pedido, ItemPedido
+from .models import Comercio, Categoria, Producto, Pedido, ItemPedido, LoteEntrega, Mensaje
+from transporte.geocercas import exigir_cobertura, punto_enviado
 
 # 1. Categoría
 class CategoriaSerializer(serializers.ModelSerializer):
@@ -25,6 +26,13 @@ class ComercioSerializer(serializers.ModelSerializer):
         model = Comercio
         fields = '__all__'
 
+# 3b. Comercio con distancia (búsqueda "cerca de mí")
+class ComercioCercanoSerializer(ComercioSerializer):
+    distancia_km = serializers.SerializerMethodField()
+
+    def get_distancia_km(self, obj):
+        return round(obj.distancia_km, 3)
+
 # 4. Items (Detalle del pedido)
 class ItemPedidoSerializer(serializers.ModelSerializer):
     producto_nombre = serializers.ReadOnlyField(source='producto.nombre')
@@ -42,4 +50,26 @@ class PedidoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pedido
         fields = '__all__'
-        read_only_fields = ['repartidor', 'estado', 'total_final', 'creado_en']
\ No newline at end of file
+        read_only_fields = ['repartidor', 'estado', 'total_final', 'creado_en']
+
+    def validate(self, attrs):
+        exigir_cobertura({'lat_entrega': punto_enviado(attrs, self.instance, 'lat_entrega', 'lon_entrega')})
+        return attrs
+
+# 6. Lote de Entrega (varios pedidos del mismo comercio)
+class LoteEntregaSerializer(serializers.ModelSerializer):
+    comercio_nombre = serializers.ReadOnlyField(source='comercio.nombre')
+    pedidos = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+
+    class Meta:
+        model = LoteEntrega
+        fields = '__all__'
+
+# 7. Mensaje del chat de un pedido
+class MensajeSerializer(serializers.ModelSerializer):
+    emisor_username = serializers.ReadOnlyField(source='emisor.username')
+
+    class Meta:
+        model = Mensaje
+        fields = ['id', 'pedido', 'emisor', 'emisor_username', 'contenido', 'timestamp', 'secuencia']
+        read_only_fields = ['emisor', 'timestamp', 'secuencia']
@@ -1,3 +1,59 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from transporte.models import EventoEstado
+from usuarios.models import UsuarioPersonalizado
+from .models import Comercio, Pedido
+
+
+class EstadoPedidoComercioTests(TestCase):
+    """El dueño del comercio avanza sus pedidos por la API de transiciones."""
+
+    def setUp(self):
+        self.cliente = UsuarioPersonalizado.objects.create_user('cliente', password='x')
+        self.propietario = UsuarioPersonalizado.objects.create_user('propietario', password='x')
+        self.otro = UsuarioPersonalizado.objects.create_user('otro', password='x')
+        comercio = Comercio.objects.create(
+            nombre='Panadería', tipo='restaurante', propietario=self.propietario,
+            direccion='Av. Principal', latitud=10.48, longitud=-66.90,
+        )
+        self.pedido = Pedido.objects.create(
+            cliente=self.cliente, comercio=comercio, direccion_entrega='Calle 1',
+            lat_entrega=10.49, lon_entrega=-66.91,
+        )
+        self.api = APIClient()
+
+    def cambiar_estado(self, usuario, estado):
+        self.api.force_authenticate(usuario)
+        return self.api.post(f'/domicilios/api/pedidos/{self.pedido.pk}/estado/', {'estado': estado}, format='json')
+
+    def test_propietario_pasa_a_preparando_y_listo(self):
+        respuesta = self.cambiar_estado(self.propietario, 'preparando')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['estado'], 'preparando')
+
+        respuesta = self.cambiar_estado(self.propietario, 'listo')
+        self.assertEqual(respuesta.status_code, 200)
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.estado, 'listo')
+        eventos = EventoEstado.objects.filter(tipo='pedido', objeto_id=self.pedido.pk, actor=self.propietario)
+        self.assertEqual(list(eventos.values_list('estado_nuevo', flat=True)), ['preparando', 'listo'])
+
+    def test_propietario_ve_los_pedidos_de_su_comercio(self):
+        self.api.force_authenticate(self.propietario)
+        respuesta = self.api.get('/domicilios/api/pedidos/')
+        self.assertEqual([p['id'] for p in respuesta.json()], [self.pedido.pk])
+
+    def test_propietario_no_puede_editar_ni_borrar_el_pedido(self):
+        self.api.force_authenticate(self.propietario)
+        url = f'/domicilios/api/pedidos/{self.pedido.pk}/'
+        self.assertEqual(self.api.patch(url, {'direccion_entrega': 'Otra'}, format='json').status_code, 404)
+        self.assertEqual(self.api.delete(url).status_code, 404)
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.direccion_entrega, 'Calle 1')
+
+    def test_cliente_no_puede_marcar_preparando(self):
+        self.assertEqual(self.cambiar_estado(self.cliente, 'preparando').status_code, 403)
+
+    def test_ajeno_no_encuentra_el_pedido(self):
+        self.assertEqual(self.cambiar_estado(self.otro, 'preparando').status_code, 404)
@@ -11,7 +11,8 @@ from .views import (
     CategoriaViewSet, 
     ProductoViewSet, 
     PedidoViewSet, 
-    ItemPedidoViewSet
+    ItemPedidoViewSet,
+    LoteEntregaViewSet
 )
 
 app_name = 'domicilios'
@@ -23,6 +24,7 @@ router.register(r'categorias', CategoriaViewSet, basename='api-categorias')
 router.register(r'productos', ProductoViewSet, basename='api-productos')
 router.register(r'pedidos', PedidoViewSet, basename='api-pedidos')
 router.register(r'items-pedido', ItemPedidoViewSet, basename='api-items')
+router.register(r'lotes', LoteEntregaViewSet, basename='api-lotes')
 
 urlpatterns = [
     # URLs de la Web (Aquí es donde fallaba antes por no tener el import de 'views')
@@ -2,6 +2,9 @@
 
 from math import radians, cos, sin, asin, sqrt
 
+import numpy as np
+from django.db import models
+
 # Radio de la Tierra en kilómetros
 R_TIERRA_KM = 6371.0
 
@@ -28,4 +31,224 @@ def calcular_distancia_haversine(lat1, lon1, lat2, lon2):
     # 4. Distancia en kilómetros
     distancia_km = R_TIERRA_KM * c
 
-    return distancia_km
\ No newline at end of file
+    return distancia_km
+
+
+# ----------------------------------------------------------------------
+# Versión Vectorizada (NumPy) para Lotes de Coordenadas
+# ----------------------------------------------------------------------
+
+# Kilómetros por grado de latitud (usado en el prefiltro de caja)
+KM_POR_GRADO = 111.32
+
+
+def distancias_haversine(lat, lon, lats, lons):
+    """
+    Distancias (km) de UN punto (lat, lon) a MUCHOS puntos (lats, lons).
+    'lats' y 'lons' pueden ser listas o arreglos; devuelve un ndarray float64.
+    """
+    lat1 = np.radians(float(lat))
+    lon1 = np.radians(float(lon))
+    lats2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lons2 = np.radians(np.asarray(lons, dtype=np.float64))
+
+    a = np.sin((lats2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lats2) * np.sin((lons2 - lon1) / 2) ** 2
+    return 2 * R_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def matriz_distancias_haversine(lats1, lons1, lats2, lons2):
+    """
+    Matriz de distancias (km) de MUCHOS a MUCHOS puntos.
+    Devuelve un ndarray de forma (len(lats1), len(lats2)).
+    """
+    lats1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, np.newaxis]
+    lons1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, np.newaxis]
+    lats2 = np.radians(np.asarray(lats2, dtype=np.float64))[np.newaxis, :]
+    lons2 = np.radians(np.asarray(lons2, dtype=np.float64))[np.newaxis, :]
+
+    a = np.sin((lats2 - lats1) / 2) ** 2 + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2
+    return 2 * R_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def caja_alrededor(lat, lon, radio_km):
+    """Devuelve (lat_min, lat_max, lon_min, lon_max) de la caja que contiene el círculo."""
+    lat = float(lat)
+    lon = float(lon)
+    delta_lat = radio_km / KM_POR_GRADO
+    delta_lon = radio_km / (KM_POR_GRADO * max(cos(radians(lat)), 0.01))
+    return (lat - delta_lat, lat + delta_lat, lon - delta_lon, lon + delta_lon)
+
+
+def filtrar_por_caja(lat, lon, radio_km, lats, lons):
+    """
+    Prefiltro barato: máscara booleana de los puntos que caen dentro de la
+    caja que contiene el círculo de 'radio_km'. Descarta la mayoría de los
+    puntos con comparaciones simples antes de calcular distancias exactas.
+    """
+    lat_min, lat_max, lon_min, lon_max = caja_alrededor(lat, lon, radio_km)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return (lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)
+
+
+def puntos_en_radio(lat, lon, radio_km, lats, lons):
+    """
+    Índices y distancias de los puntos a menos de 'radio_km', ordenados por
+    distancia. Combina el prefiltro de caja con el cálculo vectorizado.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    candidatos = np.flatnonzero(filtrar_por_caja(lat, lon, radio_km, lats, lons))
+    distancias = distancias_haversine(lat, lon, lats[candidatos], lons[candidatos])
+
+    dentro = distancias <= radio_km
+    candidatos, distancias = candidatos[dentro], distancias[dentro]
+    orden = np.argsort(distancias, kind='stable')
+    return candidatos[orden], distancias[orden]
+
+
+# ----------------------------------------------------------------------
+# Geohash: Celdas Indexables para Búsquedas "Cerca de Mí"
+# ----------------------------------------------------------------------
+
+_BASE32_GEOHASH = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precisión almacenada en las columnas (7 caracteres ≈ celdas de 153 m x 153 m)
+PRECISION_GEOHASH = 7
+
+# Máximo de prefijos con los que se cubre una caja de búsqueda
+MAXIMO_CELDAS_COBERTURA = 16
+
+
+def codificar_geohash(lat, lon, precision=PRECISION_GEOHASH):
+    """Codifica (lat, lon) como geohash de 'precision' caracteres."""
+    lat_rango = [-90.0, 90.0]
+    lon_rango = [-180.0, 180.0]
+    lat, lon = float(lat), float(lon)
+
+    resultado = []
+    bits = 0
+    valor = 0
+    es_lon = True
+    while len(resultado) < precision:
+        rango, coordenada = (lon_rango, lon) if es_lon else (lat_rango, lat)
+        medio = (rango[0] + rango[1]) / 2
+        valor <<= 1
+        if coordenada >= medio:
+            valor |= 1
+            rango[0] = medio
+        else:
+            rango[1] = medio
+        es_lon = not es_lon
+        bits += 1
+        if bits == 5:
+            resultado.append(_BASE32_GEOHASH[valor])
+            bits = 0
+            valor = 0
+    return ''.join(resultado)
+
+
+def _dimensiones_celda(precision):
+    """(alto, ancho) en grados de una celda geohash de 'precision' caracteres."""
+    bits = 5 * precision
+    bits_lon = (bits + 1) // 2
+    bits_lat = bits // 2
+    return 180.0 / (2 ** bits_lat), 360.0 / (2 ** bits_lon)
+
+
+def prefijos_geohash_caja(lat_min, lat_max, lon_min, lon_max, max_celdas=MAXIMO_CELDAS_COBERTURA):
+    """
+    Conjunto de prefijos geohash que cubre la caja. Se elige la precisión más
+    fina que no supere 'max_celdas' celdas, para que la consulta use pocas
+    condiciones 'startswith' sobre la columna indexada.
+    """
+    for precision in range(PRECISION_GEOHASH, 0, -1):
+        alto, ancho = _dimensiones_celda(precision)
+        filas = int(lat_max // alto) - int(lat_min // alto) + 1
+        columnas = int(lon_max // ancho) - int(lon_min // ancho) + 1
+        if filas * columnas <= max_celdas or precision == 1:
+            break
+
+    prefijos = set()
+    lat = lat_min
+    while True:
+        lon = lon_min
+        while True:
+            prefijos.add(codificar_geohash(min(lat, lat_max), min(lon, lon_max), precision))
+            if lon >= lon_max:
+                break
+            lon += ancho
+        if lat >= lat_max:
+            break
+        lat += alto
+    return prefijos
+
+
+class GeoQuerySet(models.QuerySet):
+    """
+    QuerySet para modelos con coordenadas y columna geohash indexada.
+    El modelo declara GEOHASH_CAMPOS = (campo_lat, campo_lon, campo_geohash).
+    """
+
+    def en_caja(self, lat_min, lat_max, lon_min, lon_max):
+        """Filas dentro de la caja: prefiltro por prefijos geohash (índice) + rango exacto."""
+        campo_lat, campo_lon, campo_geohash = self.model.GEOHASH_CAMPOS
+        condicion = models.Q()
+        for prefijo in prefijos_geohash_caja(lat_min, lat_max, lon_min, lon_max):
+            condicion |= models.Q(**{f'{campo_geohash}__startswith': prefijo})
+        return self.filter(condicion).filter(**{
+            f'{campo_lat}__range': (lat_min, lat_max),
+            f'{campo_lon}__range': (lon_min, lon_max),
+        })
+
+    def en_radio(self, lat, lon, radio_km):
+        """Filas dentro de la caja que contiene el círculo (filtrado exacto con cercanos())."""
+        return self.en_caja(*caja_alrededor(lat, lon, radio_km))
+
+    def cercanos(self, lat, lon, radio_km, limite=None):
+        """
+        Lista de objetos a menos de 'radio_km', ordenados por distancia, cada
+        uno con el atributo 'distancia_km'. La distancia exacta se calcula en
+        lote (NumPy) solo sobre los candidatos de la caja.
+        """
+        campo_lat, campo_lon, _ = self.model.GEOHASH_CAMPOS
+        candidatos = list(self.en_radio(lat, lon, radio_km))
+        if not candidatos:
+            return []
+
+        distancias = distancias_haversine(
+            lat, lon,
+            [float(getattr(o, campo_lat)) for o in candidatos],
+            [float(getattr(o, campo_lon)) for o in candidatos],
+        )
+        resultado = []
+        for indice in np.argsort(distancias, kind='stable'):
+            if distancias[indice] > radio_km:
+                break
+            objeto = candidatos[indice]
+            objeto.distancia_km = float(distancias[indice])
+            resultado.append(objeto)
+        return resultado[:limite] if limite else resultado
+
+
+class GeohashMixin:
+    """
+    Mantiene la columna geohash sincronizada con las coordenadas en cada save().
+    (Los .update() masivos no pasan por aquí: si cambian coordenadas, ejecutar
+    'manage.py backfill_geohash'.)
+    """
+
+    def calcular_geohash(self):
+        campo_lat, campo_lon, campo_geohash = self.GEOHASH_CAMPOS
+        lat, lon = getattr(self, campo_lat), getattr(self, campo_lon)
+        valor = codificar_geohash(lat, lon) if lat is not None and lon is not None else ''
+        setattr(self, campo_geohash, valor)
+
+    def save(self, *args, **kwargs):
+        self.calcular_geohash()
+        campo_lat, campo_lon, campo_geohash = self.GEOHASH_CAMPOS
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({campo_lat, campo_lon} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {campo_geohash}
+        super().save(*args, **kwargs)
+
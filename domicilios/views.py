@@ -1,5 +1,7 @@
 # domicilios/views.py
 # domicilios/views.py
+import math
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.views.generic import CreateView, ListView, DetailView
@@ -10,16 +12,22 @@ from django.http import JsonResponse, Http404
 
 # API Rest Framework
 from rest_framework import viewsets, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 # Modelos y Serializadores
-from .models import Comercio, Producto, Pedido, ItemPedido, Categoria, Mensaje
+from .models import Comercio, Producto, Pedido, ItemPedido, Categoria, Mensaje, LoteEntrega
 from .serializers import (
-    ComercioSerializer, PedidoSerializer, 
-    ItemPedidoSerializer, ProductoSerializer, CategoriaSerializer
+    ComercioSerializer, ComercioCercanoSerializer, PedidoSerializer, 
+    ItemPedidoSerializer, ProductoSerializer, CategoriaSerializer, LoteEntregaSerializer, MensajeSerializer
 )
+from .indice_comercios import indice_comercios
+from .rutas import planificar_ruta_repartidor
+from .lotes import armar_lotes, reclamar_lote, vehiculo_para_lote
+from transporte.transiciones import AccionesEstadoMixin, transicionar, TransicionInvalida
+from SuperService.historial_chat import PaginacionHistorial, pagina_anterior
 
 # ----------------------------------------------------------------------
 # 1. MIXINS DE SEGURIDAD
@@ -59,17 +67,38 @@ class PedidoDetailView(DetailView):
     model = Pedido
     template_name = 'domicilios/pedido_detalle.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Solo los mensajes más recientes; los anteriores se piden con "Cargar anteriores"
+        context['mensajes'], context['mensajes_anteriores'] = pagina_anterior(
+            self.object.mensajes.select_related('emisor')
+        )
+        return context
+
 class RepartidorDashboardView(ListView):
     model = Pedido
     template_name = 'domicilios/repartidor_dashboard.html'
 
-class RecogerPedidoView(View):
-    def post(self, request, pedido_id):
-        return JsonResponse({'status': 'recogido'})
+class CambioEstadoPedidoView(LoginRequiredMixin, View):
+    """El repartidor asignado avanza el pedido por la capa de transiciones (transporte/transiciones.py)."""
+    estado_nuevo = None
+    respuesta = None
 
-class EntregarPedidoView(View):
     def post(self, request, pedido_id):
-        return JsonResponse({'status': 'entregado'})
+        pedido = get_object_or_404(Pedido, pk=pedido_id, repartidor=request.user)
+        try:
+            transicionar(pedido, self.estado_nuevo, actor=request.user)
+        except TransicionInvalida as error:
+            return JsonResponse({'status': 'error', 'error': str(error)}, status=409)
+        return JsonResponse({'status': self.respuesta, 'estado': pedido.estado})
+
+class RecogerPedidoView(CambioEstadoPedidoView):
+    estado_nuevo = 'en_camino'
+    respuesta = 'recogido'
+
+class EntregarPedidoView(CambioEstadoPedidoView):
+    estado_nuevo = 'entregado'
+    respuesta = 'entregado'
 
 # Vistas de Admin
 class ComercioListViewAdmin(ListView):
@@ -93,11 +122,58 @@ class ProductoCreateView(CreateView):
 # ----------------------------------------------------------------------
 # 3. VIEWSETS PARA LA API (LO QUE USA NORBE EN LA APP)
 # ----------------------------------------------------------------------
+class PaginacionCercania(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
 class ComercioViewSet(viewsets.ModelViewSet):
+    """
+    Sin parámetros devuelve todos los comercios activos (como siempre).
+    Con ?lat=&lon= devuelve los comercios cercanos ordenados por distancia y
+    paginados; acepta además ?radius= (km, por defecto 5) y ?tipo=.
+    """
     queryset = Comercio.objects.filter(activo=True)
     serializer_class = ComercioSerializer
     permission_classes = [IsAuthenticated]
 
+    RADIO_POR_DEFECTO_KM = 5.0
+    RADIO_MAXIMO_KM = 50.0
+
+    def list(self, request, *args, **kwargs):
+        if 'lat' not in request.query_params or 'lon' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            radio = min(float(request.query_params.get('radius', self.RADIO_POR_DEFECTO_KM)), self.RADIO_MAXIMO_KM)
+            # float() acepta 'nan' e 'inf', que el KD-tree rechaza
+            if not all(math.isfinite(valor) for valor in (lat, lon, radio)):
+                raise ValueError
+        except ValueError:
+            return Response({"error": "Parámetros 'lat', 'lon' o 'radius' inválidos."}, status=status.HTTP_400_BAD_REQUEST)
+
+        tipo = request.query_params.get('tipo')
+        if tipo and tipo not in dict(Comercio.TIPO_CHOICES):
+            return Response({"error": f"Tipo de comercio '{tipo}' no válido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. El KD-tree devuelve (id, distancia) ya ordenados; solo se paginan tuplas
+        paginador = PaginacionCercania()
+        pagina = paginador.paginate_queryset(indice_comercios.cercanos(lat, lon, radio, tipo=tipo), request, view=self)
+
+        # 2. Una sola consulta a la BD con los ids de la página, respetando el orden por distancia
+        objetos = Comercio.objects.filter(activo=True).in_bulk([comercio_id for comercio_id, _ in pagina])
+        comercios = []
+        for comercio_id, distancia in pagina:
+            comercio = objetos.get(comercio_id)
+            if comercio is not None:
+                comercio.distancia_km = distancia
+                comercios.append(comercio)
+
+        serializer = ComercioCercanoSerializer(comercios, many=True, context=self.get_serializer_context())
+        return paginador.get_paginated_response(serializer.data)
+
 class CategoriaViewSet(viewsets.ModelViewSet):
     queryset = Categoria.objects.all()
     serializer_class = CategoriaSerializer
@@ -108,15 +184,105 @@ class ProductoViewSet(viewsets.ModelViewSet):
     serializer_class = ProductoSerializer
     permission_classes = [IsAuthenticated]
 
-class PedidoViewSet(viewsets.ModelViewSet):
+class PedidoViewSet(AccionesEstadoMixin, viewsets.ModelViewSet):
     serializer_class = PedidoSerializer
     permission_classes = [IsAuthenticated]
+    # Acciones en las que el dueño del comercio llega a sus pedidos: las de lectura y
+    # las transiciones ('preparando', 'listo'). Editarlos o borrarlos sigue siendo del cliente.
+    ACCIONES_COMERCIO = ('list', 'retrieve', 'cambiar_estado', 'eventos')
+
     def get_queryset(self):
-        return Pedido.objects.filter(Q(cliente=self.request.user) | Q(repartidor=self.request.user))
+        user = self.request.user
+        filtro = Q(cliente=user) | Q(repartidor=user)
+        if self.action in self.ACCIONES_COMERCIO:
+            filtro |= Q(comercio__propietario=user)
+        return Pedido.objects.filter(filtro)
     def perform_create(self, serializer):
         serializer.save(cliente=self.request.user)
 
+    @action(detail=False, methods=['get'])
+    def ruta(self, request):
+        """
+        Orden sugerido de recogidas y entregas para los pedidos asignados al
+        repartidor. Parte de ?lat=&lon= o, si no se envían, de su última posición.
+        """
+        if request.user.rol != 'repartidor_domicilios':
+            return Response({"error": "Solo los repartidores tienen ruta de entregas."}, status=status.HTTP_403_FORBIDDEN)
+
+        inicio = None
+        if 'lat' in request.query_params or 'lon' in request.query_params:
+            try:
+                inicio = (float(request.query_params['lat']), float(request.query_params['lon']))
+                if not all(math.isfinite(valor) for valor in inicio):
+                    raise ValueError
+            except (KeyError, ValueError):
+                return Response({"error": "Parámetros 'lat' y 'lon' inválidos."}, status=status.HTTP_400_BAD_REQUEST)
+
+        plan = planificar_ruta_repartidor(request.user, inicio)
+        if plan is None:
+            return Response({"error": "No se conoce tu ubicación; envía 'lat' y 'lon'."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(plan)
+
+    @action(detail=True, methods=['get'])
+    def eta(self, request, pk=None):
+        """Tiempo estimado de recogida en el comercio y de entrega (perfiles de velocidad por zona y hora)."""
+        from transporte.eta import eta_pedido
+
+        pedido = get_object_or_404(self.get_queryset().select_related('comercio', 'repartidor'), pk=pk)
+        return Response({"estado": pedido.estado, "eta": eta_pedido(pedido)})
+
+    @action(detail=True, methods=['get'])
+    def mensajes(self, request, pk=None):
+        """Chat del pedido por páginas hacia atrás: ?antes=<cursor>&limite=<n>."""
+        pedido = self.get_object()
+        paginador = PaginacionHistorial()
+        pagina = paginador.paginate_queryset(pedido.mensajes.select_related('emisor'), request, view=self)
+        return paginador.get_paginated_response(MensajeSerializer(pagina, many=True).data)
+
 class ItemPedidoViewSet(viewsets.ModelViewSet):
     queryset = ItemPedido.objects.all()
     serializer_class = ItemPedidoSerializer
-    permission_classes = [IsAuthenticated]
\ No newline at end of file
+    permission_classes = [IsAuthenticated]
+
+class LoteEntregaViewSet(AccionesEstadoMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Lotes de pedidos del mismo comercio (domicilios/lotes.py). El repartidor
+    ve sus lotes y los abiertos; el staff ve todos.
+    """
+    serializer_class = LoteEntregaSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        lotes = LoteEntrega.objects.select_related('comercio').prefetch_related('pedidos').order_by('-creado_en')
+        user = self.request.user
+        if user.is_staff:
+            return lotes
+        if user.rol != 'repartidor_domicilios':
+            return lotes.none()
+        return lotes.filter(Q(repartidor=user) | Q(estado='solicitado'))
+
+    @action(detail=True, methods=['post'])
+    def aceptar(self, request, pk=None):
+        """El repartidor toma el lote completo con un vehículo aprobado que tenga capacidad."""
+        lote = get_object_or_404(self.get_queryset(), pk=pk)
+        vehiculo = vehiculo_para_lote(request.user, lote.unidades)
+        if vehiculo is None:
+            return Response(
+                {"error": f"Necesitas un vehículo aprobado con capacidad para {lote.unidades} unidades."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not reclamar_lote(lote, request.user, vehiculo):
+            return Response({"error": "El lote ya fue tomado por otro repartidor."}, status=status.HTTP_409_CONFLICT)
+
+        lote.refresh_from_db()
+        return Response(self.get_serializer(lote).data)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def armar(self, request):
+        """Ejecuta una pasada del agrupador (normalmente lo hace el comando 'armar_lotes')."""
+        lotes, tiempo_ms = armar_lotes()
+        return Response({
+            'lotes': self.get_serializer(lotes, many=True).data,
+            'tiempo_ms': tiempo_ms,
+        }, status=status.HTTP_201_CREATED if lotes else status.HTTP_200_OK)
\ No newline at end of file
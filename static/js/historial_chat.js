@@ -0,0 +1,75 @@
+/**
+ * Historial de chat por páginas: botón "Cargar mensajes anteriores".
+ *
+ * La página muestra solo los mensajes más recientes. El botón
+ * #chat-cargar-anteriores lleva en data-* lo que necesita:
+ *   data-url      endpoint JSON ({anteriores, results}) que acepta ?antes=<cursor>
+ *   data-cursor   cursor de la página anterior (SuperService/historial_chat.py)
+ *   data-usuario  id del usuario actual (para alinear sus burbujas)
+ *   data-campo    campo del remitente en cada resultado ('emisor' o 'autor')
+ *   data-scroll   id del contenedor con scroll
+ * Los mensajes se insertan justo después del contenedor del botón,
+ * conservando la posición de lectura.
+ */
+(function() {
+  "use strict";
+
+  function crearBurbuja(mensaje, campo, usuarioId) {
+    const esMio = String(mensaje[campo]) === String(usuarioId);
+    const hora = new Date(mensaje.timestamp).toLocaleTimeString('es-ES', { hour: '2-digit', minute: '2-digit' });
+
+    const contenedor = document.createElement('div');
+    contenedor.classList.add('d-flex', esMio ? 'justify-content-end' : 'justify-content-start', 'mb-2');
+
+    const burbuja = document.createElement('div');
+    burbuja.classList.add('p-2', 'rounded', esMio ? 'bg-success' : 'bg-light', esMio ? 'text-white' : 'border');
+    burbuja.style.maxWidth = '85%';
+
+    const encabezado = document.createElement('small');
+    encabezado.classList.add('d-block', 'mb-1', 'opacity-75', esMio ? 'text-white' : 'text-muted');
+    encabezado.textContent = (esMio ? 'Tú' : mensaje[campo + '_username']) + ' - ' + hora;
+
+    const texto = document.createElement('p');
+    texto.classList.add('mb-0');
+    texto.textContent = mensaje.contenido;
+
+    burbuja.appendChild(encabezado);
+    burbuja.appendChild(texto);
+    contenedor.appendChild(burbuja);
+    return contenedor;
+  }
+
+  async function cargarAnteriores(boton) {
+    const ventana = document.getElementById(boton.dataset.scroll);
+    const separador = boton.dataset.url.includes('?') ? '&' : '?';
+    boton.disabled = true;
+    try {
+      const respuesta = await fetch(
+        boton.dataset.url + separador + 'antes=' + encodeURIComponent(boton.dataset.cursor),
+        { credentials: 'same-origin', headers: { 'Accept': 'application/json' } }
+      );
+      if (!respuesta.ok) throw new Error('HTTP ' + respuesta.status);
+      const pagina = await respuesta.json();
+
+      const altoPrevio = ventana ? ventana.scrollHeight : 0;
+      const burbujas = pagina.results.map(m => crearBurbuja(m, boton.dataset.campo, boton.dataset.usuario));
+      boton.parentElement.after(...burbujas);
+      if (ventana) ventana.scrollTop += ventana.scrollHeight - altoPrevio;
+
+      if (pagina.anteriores) {
+        boton.dataset.cursor = pagina.anteriores;
+      } else {
+        boton.parentElement.remove();
+      }
+    } catch (error) {
+      console.error('No se pudieron cargar los mensajes anteriores:', error);
+    } finally {
+      boton.disabled = false;
+    }
+  }
+
+  document.addEventListener('DOMContentLoaded', function() {
+    const boton = document.getElementById('chat-cargar-anteriores');
+    if (boton) boton.addEventListener('click', () => cargarAnteriores(boton));
+  });
+})();
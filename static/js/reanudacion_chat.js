@@ -0,0 +1,88 @@
+/**
+ * WebSocket de chat que se reanuda tras un corte.
+ *
+ * Guarda la 'seq' más alta recibida y, cuando la conexión se cierra,
+ * reconecta (con espera creciente) pidiendo ?last_seq=<n>: el servidor
+ * reenvía solo lo perdido (SuperService/reanudacion_chat.py) y termina con
+ * {"tipo": "reanudacion", "seq": <n>, "completa": bool}. Si 'completa' es
+ * false faltaron mensajes y se recarga la página para traer el historial.
+ *
+ * La 'seq' solo crece dentro de un proceso del servidor: lo difundido por
+ * workers distintos puede llegar desordenado, así que los repetidos se
+ * descartan por 'seq' ya vista y no por ser menores que la última.
+ *
+ *   const chat = conectarChatReanudable(url, {
+ *     ultimaSeq: seq del último mensaje renderizado (o null),
+ *     alMensaje: function(data) { ... },   // cada mensaje nuevo
+ *     alAbrir, alCerrar, alIncompleta       // opcionales
+ *   });
+ *   chat.enviar({'message': '...'});        // false si no hay conexión abierta
+ */
+(function() {
+  "use strict";
+
+  const ESPERA_INICIAL_MS = 1000;
+  const ESPERA_MAXIMA_MS = 30000;
+  // Secuencias recordadas para descartar repetidos (las más viejas se olvidan)
+  const SECUENCIAS_RECORDADAS = 1000;
+
+  function conectarChatReanudable(url, opciones) {
+    let ultimaSeq = opciones.ultimaSeq == null ? null : Number(opciones.ultimaSeq);
+    const vistas = new Set();
+    let socket = null;
+    let espera = ESPERA_INICIAL_MS;
+
+    function recordar(seq) {
+      vistas.add(seq);
+      if (vistas.size > SECUENCIAS_RECORDADAS) {
+        vistas.delete(vistas.values().next().value);
+      }
+      if (ultimaSeq === null || seq > ultimaSeq) ultimaSeq = seq;
+    }
+
+    function abrir() {
+      const separador = url.includes('?') ? '&' : '?';
+      socket = new WebSocket(ultimaSeq === null ? url : url + separador + 'last_seq=' + ultimaSeq);
+
+      socket.onopen = function(e) {
+        espera = ESPERA_INICIAL_MS;
+        if (opciones.alAbrir) opciones.alAbrir(e);
+      };
+
+      socket.onclose = function(e) {
+        if (opciones.alCerrar) opciones.alCerrar(e);
+        setTimeout(abrir, espera);
+        espera = Math.min(espera * 2, ESPERA_MAXIMA_MS);
+      };
+
+      socket.onmessage = function(e) {
+        const data = JSON.parse(e.data);
+        if (data.tipo === 'reanudacion') {
+          if (!data.completa) {
+            if (opciones.alIncompleta) opciones.alIncompleta(data);
+            else window.location.reload();
+          }
+          return;
+        }
+        if (data.seq != null) {
+          if (vistas.has(data.seq)) return;
+          recordar(data.seq);
+        }
+        opciones.alMensaje(data);
+      };
+    }
+
+    abrir();
+
+    return {
+      enviar: function(datos) {
+        if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+        socket.send(JSON.stringify(datos));
+        return true;
+      },
+      get socket() { return socket; },
+    };
+  }
+
+  window.conectarChatReanudable = conectarChatReanudable;
+})();
@@ -3,4 +3,6 @@ from .models import *
 # Register your models here.
 admin.site.register(Vehiculo)
 admin.site.register(Viaje)
-admin.site.register(SolicitudAsistencia)
\ No newline at end of file
+admin.site.register(SolicitudAsistencia)
+admin.site.register(ZonaServicio)
+admin.site.register(EventoEstado)
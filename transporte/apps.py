@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TransporteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transporte'
+
+    def ready(self):
+        # Registra las señales de los contadores de demanda por zona, de compactación de trazas,
+        # de la cola de asistencias y de los eventos de alta de solicitudes
+        from . import demanda, trazas, colas_asistencia, transiciones  # noqa: F401
@@ -0,0 +1,306 @@
+# transporte/asignacion.py
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Case, When, Value
+from django.utils import timezone
+from scipy.optimize import linear_sum_assignment
+
+from domicilios.utils import matriz_distancias_haversine
+from .despacho import (
+    indice_conductores,
+    RADIO_BUSQUEDA_KM,
+    EDAD_MAXIMA_POSICION_S,
+    TIPOS_VEHICULO_POR_SERVICIO,
+    ESTADOS_OCUPADO,
+)
+from .demanda import mapa_demanda
+from .models import Viaje, Vehiculo
+from .ofertas import retirar_ofertas
+from .ruteo import matriz_km_vial
+from .transiciones import registrar_eventos
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros del Motor de Asignación
+# ----------------------------------------------------------------------
+
+# Ventana durante la que se acumulan solicitudes y conductores libres (segundos)
+VENTANA_S = 2.0
+
+# Costo usado para pares imposibles (vehículo incompatible o demasiado lejos)
+COSTO_PROHIBIDO = 1e9
+
+# Máximo de viajes que entran en una ronda (los más antiguos primero)
+MAXIMO_VIAJES_POR_RONDA = 5000
+
+
+# ----------------------------------------------------------------------
+# 2. Métricas
+# ----------------------------------------------------------------------
+
+class MetricasAsignacion:
+    """Guarda las últimas rondas para reportar latencias (ms) y volumen asignado."""
+
+    def __init__(self, historial=500):
+        self._rondas = deque(maxlen=historial)
+        self._lock = threading.Lock()
+        self.total_asignados = 0
+        self.total_rondas = 0
+
+    def registrar(self, **ronda):
+        with self._lock:
+            self._rondas.append(ronda)
+            self.total_asignados += ronda.get('asignados', 0)
+            self.total_rondas += 1
+
+    def resumen(self):
+        with self._lock:
+            rondas = list(self._rondas)
+
+        def percentiles(clave):
+            valores = np.array([r[clave] for r in rondas]) if rondas else np.zeros(1)
+            return {
+                'p50': round(float(np.percentile(valores, 50)), 3),
+                'p95': round(float(np.percentile(valores, 95)), 3),
+                'max': round(float(valores.max()), 3),
+            }
+
+        return {
+            'rondas': self.total_rondas,
+            'asignados': self.total_asignados,
+            'ultima_ronda': rondas[-1] if rondas else None,
+            'latencia_total_ms': percentiles('total_ms'),
+            'latencia_resolucion_ms': percentiles('resolucion_ms'),
+        }
+
+
+metricas_asignacion = MetricasAsignacion()
+
+
+# ----------------------------------------------------------------------
+# 3. Núcleo: Matriz de Costos y Asignación Óptima
+# ----------------------------------------------------------------------
+
+def construir_matriz_costos(viajes_lat, viajes_lon, viajes_tipos, cond_lat, cond_lon, cond_tipos):
+    """
+    Matriz (viajes x conductores) con la distancia de recogida en km.
+    Los pares incompatibles o fuera del radio de búsqueda valen COSTO_PROHIBIDO.
+    'viajes_tipos' y 'cond_tipos' son listas de conjuntos de Vehiculo.tipo.
+    Con red vial cargada, la distancia es por carretera (del conductor al
+    origen); la línea recta solo sirve de prefiltro y de respaldo.
+    """
+    costos = matriz_distancias_haversine(viajes_lat, viajes_lon, cond_lat, cond_lon)
+
+    # Compatibilidad por tipo de vehículo: una máscara booleana por tipo
+    tipos = sorted(set().union(*viajes_tipos, *cond_tipos)) if len(viajes_tipos) and len(cond_tipos) else []
+    compatible = np.zeros(costos.shape, dtype=bool)
+    for tipo in tipos:
+        pide = np.fromiter((tipo in t for t in viajes_tipos), dtype=bool, count=len(viajes_tipos))
+        ofrece = np.fromiter((tipo in t for t in cond_tipos), dtype=bool, count=len(cond_tipos))
+        compatible |= pide[:, np.newaxis] & ofrece[np.newaxis, :]
+
+    if (compatible & (costos <= RADIO_BUSQUEDA_KM)).any():
+        viales = matriz_km_vial(cond_lat, cond_lon, viajes_lat, viajes_lon, limite_km=RADIO_BUSQUEDA_KM)
+        if viales is not None:
+            # NaN = punto fuera de la red: se conserva la línea recta
+            viales = viales.T
+            costos = np.where(np.isnan(viales), costos, viales)
+
+    costos[~compatible | ~(costos <= RADIO_BUSQUEDA_KM)] = COSTO_PROHIBIDO
+    return costos
+
+
+def resolver_asignacion(costos):
+    """
+    Asignación de costo total mínimo (algoritmo húngaro de SciPy) sobre una
+    matriz rectangular. Devuelve [(fila, columna, costo)] sin los pares prohibidos.
+    """
+    if costos.size == 0:
+        return []
+    filas, columnas = linear_sum_assignment(costos)
+    valores = costos[filas, columnas]
+    validos = valores < COSTO_PROHIBIDO
+    return list(zip(filas[validos].tolist(), columnas[validos].tolist(), valores[validos].tolist()))
+
+
+# ----------------------------------------------------------------------
+# 4. Conductores Libres
+# ----------------------------------------------------------------------
+
+def conductores_desde_bd():
+    """
+    {conductor_id: (lat, lon, tipos)} a partir de la última posición guardada.
+    Se usa cuando el motor corre en un proceso distinto al que recibe las
+    pings (p. ej. 'manage.py asignar_viajes'), donde el índice está vacío.
+    """
+    limite = timezone.now() - timedelta(seconds=EDAD_MAXIMA_POSICION_S)
+    conductores = {}
+    for conductor_id, lat, lon, tipo in Vehiculo.objects.filter(
+        aprobado=True,
+        conductor__disponible=True,
+        conductor__latitud__isnull=False,
+        conductor__ubicacion_actualizada_en__gte=limite,
+    ).values_list('conductor_id', 'conductor__latitud', 'conductor__longitud', 'tipo'):
+        _, _, tipos = conductores.setdefault(conductor_id, (float(lat), float(lon), set()))
+        tipos.add(tipo)
+    return conductores
+
+
+def conductores_libres(desde_bd=False):
+    """Conductores disponibles que no tienen un viaje en curso."""
+    conductores = conductores_desde_bd() if desde_bd else indice_conductores.conductores()
+    ocupados = set(
+        Viaje.objects.filter(estado__in=ESTADOS_OCUPADO, conductor__isnull=False).values_list('conductor_id', flat=True)
+    )
+    return {cid: datos for cid, datos in conductores.items() if cid not in ocupados}
+
+
+# ----------------------------------------------------------------------
+# 5. Ronda Completa: Recolectar, Resolver y Confirmar en Bloque
+# ----------------------------------------------------------------------
+
+def ejecutar_ronda(desde_bd=False):
+    """
+    Ejecuta una ronda de asignación y devuelve {viaje_id: conductor_id} con
+    las asignaciones que quedaron confirmadas en la BD.
+    """
+    inicio = time.perf_counter()
+
+    viajes = list(
+        Viaje.objects.filter(estado='solicitado')
+        .order_by('creado_en')
+        .values('id', 'origen_lat', 'origen_lon', 'tipo_servicio', 'cliente_id')[:MAXIMO_VIAJES_POR_RONDA]
+    )
+    libres = conductores_libres(desde_bd=desde_bd)
+
+    if not viajes or not libres:
+        metricas_asignacion.registrar(
+            viajes=len(viajes), conductores=len(libres), asignados=0,
+            resolucion_ms=0.0, total_ms=(time.perf_counter() - inicio) * 1000,
+        )
+        return {}
+
+    conductor_ids = list(libres)
+    costos = construir_matriz_costos(
+        [float(v['origen_lat']) for v in viajes],
+        [float(v['origen_lon']) for v in viajes],
+        [set(TIPOS_VEHICULO_POR_SERVICIO.get(v['tipo_servicio'], ())) for v in viajes],
+        [libres[c][0] for c in conductor_ids],
+        [libres[c][1] for c in conductor_ids],
+        [libres[c][2] for c in conductor_ids],
+    )
+
+    # Un cliente que también es conductor no puede tomar su propio viaje
+    columnas = {cid: j for j, cid in enumerate(conductor_ids)}
+    for i, v in enumerate(viajes):
+        j = columnas.get(v['cliente_id'])
+        if j is not None:
+            costos[i, j] = COSTO_PROHIBIDO
+
+    inicio_resolucion = time.perf_counter()
+    pares = resolver_asignacion(costos)
+    resolucion_ms = (time.perf_counter() - inicio_resolucion) * 1000
+
+    propuestas = {viajes[i]['id']: (conductor_ids[j], viajes[i]['tipo_servicio']) for i, j, _ in pares}
+    confirmadas = confirmar_asignaciones(propuestas)
+    retirar_ofertas(confirmadas, confirmadas)
+    for viaje_id, conductor_id in confirmadas.items():
+        mapa_demanda.viaje_cerrado(viaje_id, conductor_id)
+
+    metricas_asignacion.registrar(
+        viajes=len(viajes),
+        conductores=len(libres),
+        asignados=len(confirmadas),
+        distancia_media_km=round(float(np.mean([c for _, _, c in pares])), 3) if pares else 0.0,
+        resolucion_ms=resolucion_ms,
+        total_ms=(time.perf_counter() - inicio) * 1000,
+    )
+    return confirmadas
+
+
+def confirmar_asignaciones(propuestas):
+    """
+    Escribe todas las asignaciones con UN UPDATE condicional (CASE por id):
+    solo se tocan viajes que sigan en 'solicitado', así que un conductor que
+    aceptó a mano mientras corría la ronda conserva su viaje. Luego una
+    lectura confirma cuáles quedaron con el conductor propuesto.
+    """
+    if not propuestas:
+        return {}
+
+    # Vehículo aprobado y compatible de cada conductor (una sola consulta)
+    vehiculos = {}
+    for v in Vehiculo.objects.filter(
+        conductor_id__in={c for c, _ in propuestas.values()}, aprobado=True
+    ).values('id', 'conductor_id', 'tipo'):
+        vehiculos.setdefault(v['conductor_id'], []).append(v)
+
+    conductor_por_viaje = {}
+    vehiculo_por_viaje = {}
+    for viaje_id, (conductor_id, tipo_servicio) in propuestas.items():
+        aptos = TIPOS_VEHICULO_POR_SERVICIO.get(tipo_servicio, ())
+        vehiculo = next((v for v in vehiculos.get(conductor_id, []) if v['tipo'] in aptos), None)
+        if vehiculo:
+            conductor_por_viaje[viaje_id] = conductor_id
+            vehiculo_por_viaje[viaje_id] = vehiculo['id']
+
+    if not conductor_por_viaje:
+        return {}
+
+    Viaje.objects.filter(pk__in=list(conductor_por_viaje), estado='solicitado').update(
+        estado='aceptado',
+        conductor_id=Case(*[When(pk=v, then=Value(c)) for v, c in conductor_por_viaje.items()]),
+        vehiculo_usado_id=Case(*[When(pk=v, then=Value(h)) for v, h in vehiculo_por_viaje.items()]),
+    )
+
+    confirmados = {
+        viaje_id: conductor_id
+        for viaje_id, conductor_id in Viaje.objects.filter(
+            pk__in=list(conductor_por_viaje), estado='aceptado'
+        ).values_list('id', 'conductor_id')
+        if conductor_por_viaje[viaje_id] == conductor_id
+    }
+    registrar_eventos('viaje', [(viaje_id, 'solicitado', 'aceptado') for viaje_id in confirmados], confirmados)
+    return confirmados
+
+
+# ----------------------------------------------------------------------
+# 6. Bucle por Ventanas
+# ----------------------------------------------------------------------
+
+_tarea_asignacion = None
+
+
+def iniciar_motor():
+    """
+    Arranca (una vez por proceso) el bucle de asignación en el bucle asyncio
+    actual. Solo corre si settings.ASIGNACION_AUTOMATICA está activo.
+    """
+    global _tarea_asignacion
+    from django.conf import settings
+
+    if not getattr(settings, 'ASIGNACION_AUTOMATICA', False):
+        return
+    if _tarea_asignacion is None or _tarea_asignacion.done():
+        _tarea_asignacion = asyncio.get_running_loop().create_task(bucle_asignacion())
+
+
+async def bucle_asignacion(ventana=VENTANA_S):
+    """Ejecuta una ronda cada 'ventana' segundos dentro de un bucle asyncio."""
+    from channels.db import database_sync_to_async
+
+    while True:
+        inicio = time.monotonic()
+        try:
+            await database_sync_to_async(ejecutar_ronda)()
+        except Exception:
+            logger.exception("Falló la ronda de asignación de viajes.")
+        await asyncio.sleep(max(0.0, ventana - (time.monotonic() - inicio)))
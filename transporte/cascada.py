@@ -0,0 +1,431 @@
+# transporte/cascada.py
+
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+
+from channels.layers import get_channel_layer
+
+from .despacho import indice_conductores, TIPOS_VEHICULO_POR_SERVICIO, TIPOS_VEHICULO_POR_ASISTENCIA
+from .ofertas import grupo_conductor, datos_oferta, ejecutar_en_bucle
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros de la Cascada
+# ----------------------------------------------------------------------
+
+# Tiempo que tiene cada conductor para responder una oferta (segundos)
+TIEMPO_RESPUESTA_S = 15.0
+
+# Candidatos que se piden al índice cada vez que se agota la lista
+CANDIDATOS_POR_CONSULTA = 8
+
+# Máximo de conductores a los que se ofrece una misma solicitud antes de rendirse
+MAXIMO_INTENTOS = 20
+
+# Resolución y tamaño de la rueda de temporizadores
+RESOLUCION_RUEDA_S = 0.25
+RANURAS_RUEDA = 512
+
+# Límites (segundos) de los cubos del histograma de latencias
+CUBOS_LATENCIA_S = (0.5, 1, 2, 5, 10, 15, 30, 60, 120, 300)
+
+# Grupo de Channels por el que los procesos sin bucle (comando 'armar_lotes', WSGI)
+# entregan sus lotes a los procesos ASGI para que los ofrezcan
+GRUPO_TRASPASO_LOTES = 'cascada_traspaso_lotes'
+
+# Cada cuánto el receptor renueva su membresía en el grupo (antes de que venza)
+RENOVAR_GRUPO_S = 3600
+
+
+# ----------------------------------------------------------------------
+# 2. Rueda de Temporizadores
+# ----------------------------------------------------------------------
+
+class RuedaTemporizadores:
+    """
+    Rueda de temporizadores con hash (hashed timing wheel).
+
+    Un solo bucle avanza la rueda cada 'resolucion' segundos y dispara los
+    vencidos de la ranura actual; programar y cancelar son O(1) y cada
+    temporizador pendiente cuesta una entrada de diccionario, en lugar de
+    una tarea asyncio dormida por oferta. Los retrasos mayores que una
+    vuelta completa guardan cuántas vueltas faltan.
+    """
+
+    def __init__(self, resolucion=RESOLUCION_RUEDA_S, ranuras=RANURAS_RUEDA):
+        self.resolucion = resolucion
+        self._ranuras = [dict() for _ in range(ranuras)]
+        # clave -> índice de la ranura donde está su temporizador
+        self._ubicacion = {}
+        self._actual = 0
+        self._tarea = None
+
+    def __len__(self):
+        return len(self._ubicacion)
+
+    def __contains__(self, clave):
+        return clave in self._ubicacion
+
+    def programar(self, clave, retraso_s, funcion, *args):
+        """Programa funcion(*args) dentro de 'retraso_s'. Reemplaza el temporizador previo de 'clave'."""
+        self.cancelar(clave)
+        # +1 tick: la ranura actual ya está parcialmente transcurrida y nunca se debe disparar antes de tiempo
+        ticks = math.ceil(retraso_s / self.resolucion) + 1
+        total = len(self._ranuras)
+        ranura = (self._actual + ticks) % total
+        self._ranuras[ranura][clave] = ((ticks - 1) // total, funcion, args)
+        self._ubicacion[clave] = ranura
+
+    def cancelar(self, clave):
+        ranura = self._ubicacion.pop(clave, None)
+        if ranura is not None:
+            self._ranuras[ranura].pop(clave, None)
+
+    def avanzar(self):
+        """Avanza un tick y ejecuta los temporizadores vencidos. Devuelve cuántos disparó."""
+        self._actual = (self._actual + 1) % len(self._ranuras)
+        ranura = self._ranuras[self._actual]
+        vencidos = []
+        for clave, (vueltas, funcion, args) in list(ranura.items()):
+            if vueltas:
+                ranura[clave] = (vueltas - 1, funcion, args)
+            else:
+                del ranura[clave]
+                del self._ubicacion[clave]
+                vencidos.append((clave, funcion, args))
+
+        for clave, funcion, args in vencidos:
+            try:
+                funcion(*args)
+            except Exception:
+                logger.exception("Falló el temporizador %s.", clave)
+        return len(vencidos)
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) el bucle que avanza la rueda."""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._girar())
+
+    async def _girar(self):
+        # Se avanza según el reloj monotónico para no acumular deriva si el bucle se retrasa
+        siguiente = time.monotonic() + self.resolucion
+        while True:
+            await asyncio.sleep(max(0.0, siguiente - time.monotonic()))
+            while time.monotonic() >= siguiente:
+                self.avanzar()
+                siguiente += self.resolucion
+
+
+# ----------------------------------------------------------------------
+# 3. Histograma de Latencias
+# ----------------------------------------------------------------------
+
+class HistogramaLatencias:
+    """Histograma de cubos fijos: memoria constante sin importar el volumen."""
+
+    def __init__(self, cubos=CUBOS_LATENCIA_S):
+        self.cubos = tuple(cubos)
+        self._conteos = [0] * (len(self.cubos) + 1)
+        self._suma = 0.0
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos):
+        with self._lock:
+            self._conteos[bisect.bisect_left(self.cubos, segundos)] += 1
+            self._suma += segundos
+
+    def resumen(self):
+        with self._lock:
+            conteos = list(self._conteos)
+            suma = self._suma
+        total = sum(conteos)
+
+        etiquetas = [f'<={c}s' for c in self.cubos] + [f'>{self.cubos[-1]}s']
+
+        def percentil(p):
+            # Cubo donde cae el percentil (la resolución es la de los cubos)
+            if not total:
+                return None
+            objetivo, acumulado = p * total, 0
+            for etiqueta, conteo in zip(etiquetas, conteos):
+                acumulado += conteo
+                if acumulado >= objetivo:
+                    return etiqueta
+            return etiquetas[-1]
+
+        return {
+            'total': total,
+            'media_s': round(suma / total, 3) if total else None,
+            'p50': percentil(0.5),
+            'p95': percentil(0.95),
+            'cubos': dict(zip(etiquetas, conteos)),
+        }
+
+
+# ----------------------------------------------------------------------
+# 4. Despachador en Cascada
+# ----------------------------------------------------------------------
+
+class OfertaCascada:
+    """Estado de una solicitud en cascada (__slots__ para miles de ofertas en vuelo)."""
+    __slots__ = ('clave', 'datos', 'tipos', 'admitidos', 'al_agotar', 'candidatos', 'intentados', 'actual', 'inicio')
+
+    def __init__(self, clave, datos, tipos, excluir, admitidos=None, al_agotar=None):
+        self.clave = clave
+        self.datos = datos
+        self.tipos = tipos
+        self.admitidos = admitidos
+        # Función síncrona sin argumentos que se llama si nadie acepta
+        self.al_agotar = al_agotar
+        self.candidatos = []
+        self.intentados = set(excluir)
+        self.actual = None
+        self.inicio = time.monotonic()
+
+
+class DespachadorCascada:
+    """
+    Ofrece una solicitud (Viaje, SolicitudAsistencia o LoteEntrega) a un conductor a la
+    vez: si no responde en TIEMPO_RESPUESTA_S o la rechaza, pasa al
+    siguiente candidato más cercano. Los vencimientos usan una única
+    RuedaTemporizadores; todo el estado vive en el hilo del bucle asyncio
+    registrado con iniciar() (las vistas solo agendan trabajo en él).
+
+    Las claves son ('viaje', id), ('asistencia', id) o ('lote', id).
+    """
+
+    def __init__(self, tiempo_respuesta=TIEMPO_RESPUESTA_S, maximo_intentos=MAXIMO_INTENTOS):
+        self.tiempo_respuesta = tiempo_respuesta
+        self.maximo_intentos = maximo_intentos
+        self.rueda = RuedaTemporizadores()
+        self.latencia_aceptacion = HistogramaLatencias()
+        self._loop = None
+        self._receptor = None
+        self._en_vuelo = {}
+        self.contadores = {'publicadas': 0, 'aceptadas': 0, 'vencidas': 0, 'rechazadas': 0, 'agotadas': 0}
+
+    def __len__(self):
+        return len(self._en_vuelo)
+
+    def __contains__(self, clave):
+        return clave in self._en_vuelo
+
+    def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self.rueda.iniciar()
+        if get_channel_layer() is not None and (self._receptor is None or self._receptor.done()):
+            self._receptor = self._loop.create_task(self._recibir_traspasos())
+
+    def _bucle_disponible(self):
+        return self._loop is not None and self._loop.is_running() and not self._loop.is_closed()
+
+    def activo(self):
+        """True si este proceso tiene el bucle de la cascada (proceso ASGI con conductores conectados)."""
+        return self._bucle_disponible()
+
+    # --- API para vistas y consumers (cualquier hilo) ---
+
+    def publicar_viaje(self, viaje):
+        excluir = {viaje.cliente_id} if viaje.cliente_id else ()
+        oferta = OfertaCascada(
+            ('viaje', viaje.pk), datos_oferta(viaje),
+            TIPOS_VEHICULO_POR_SERVICIO.get(viaje.tipo_servicio), excluir,
+        )
+        return self._publicar(oferta)
+
+    def publicar_asistencia(self, asistencia):
+        excluir = {asistencia.cliente_id} if asistencia.cliente_id else ()
+        datos = {
+            'asistencia_id': asistencia.pk,
+            'tipo_asistencia': asistencia.tipo_asistencia,
+            'origen': [float(asistencia.ubicacion_lat), float(asistencia.ubicacion_lon)],
+            'descripcion': asistencia.descripcion or '',
+        }
+        # Solo proveedores cuyo vehículo sirve para el trabajo (p. ej. camioneta para la grúa)
+        tipos = TIPOS_VEHICULO_POR_ASISTENCIA.get(asistencia.tipo_asistencia)
+        return self._publicar(OfertaCascada(('asistencia', asistencia.pk), datos, tipos, excluir))
+
+    def publicar_lote(self, lote_id, datos, tipos, admitidos, al_agotar=None):
+        """Lote de pedidos (domicilios/lotes.py): solo a 'admitidos' con un vehículo de 'tipos'."""
+        return self._publicar(OfertaCascada(('lote', lote_id), datos, tipos, (), frozenset(admitidos), al_agotar))
+
+    def traspasar_lote(self, lote_id):
+        """
+        Entrega el lote a los procesos ASGI por la capa de canales (desde un
+        proceso sin bucle). False si la capa no sale de este proceso (en
+        memoria o sin configurar): nadie más lo recibiría.
+        """
+        from asgiref.sync import async_to_sync
+        from channels.layers import InMemoryChannelLayer
+
+        capa = get_channel_layer()
+        if capa is None or isinstance(capa, InMemoryChannelLayer):
+            return False
+        async_to_sync(capa.group_send)(GRUPO_TRASPASO_LOTES, {'type': 'cascada.lote', 'lote_id': lote_id})
+        return True
+
+    def aceptada(self, clave, conductor_id):
+        """La solicitud fue tomada (por este despachador o por otra vía)."""
+        if self._bucle_disponible():
+            ejecutar_en_bucle(self._loop, self._cerrar, clave, conductor_id)
+
+    def rechazada(self, clave, conductor_id):
+        """El conductor actual rechazó la oferta: pasar al siguiente sin esperar el vencimiento."""
+        if self._bucle_disponible():
+            ejecutar_en_bucle(self._loop, self._rechazar, clave, conductor_id)
+
+    def resumen(self):
+        return dict(
+            self.contadores,
+            en_vuelo=len(self._en_vuelo),
+            temporizadores=len(self.rueda),
+            latencia_aceptacion=self.latencia_aceptacion.resumen(),
+        )
+
+    def _publicar(self, oferta):
+        if not self._bucle_disponible():
+            return False
+        ejecutar_en_bucle(self._loop, self._abrir, oferta)
+        return True
+
+    # --- Dentro del bucle asyncio ---
+
+    async def _abrir(self, oferta):
+        if oferta.clave in self._en_vuelo:
+            return
+        self._en_vuelo[oferta.clave] = oferta
+        self.contadores['publicadas'] += 1
+        await self._ofrecer_siguiente(oferta.clave)
+
+    async def _ofrecer_siguiente(self, clave):
+        from channels.db import database_sync_to_async
+
+        oferta = self._en_vuelo.get(clave)
+        if oferta is None:
+            return
+
+        if oferta.actual is not None and not await database_sync_to_async(sigue_solicitada)(clave):
+            self._cerrar(clave, None)
+            return
+
+        conductor_id = self._siguiente_candidato(oferta)
+        if conductor_id is None:
+            # Nadie más disponible: queda para el dashboard / motor por lotes
+            self._en_vuelo.pop(clave, None)
+            self.contadores['agotadas'] += 1
+            if oferta.al_agotar is not None:
+                await database_sync_to_async(oferta.al_agotar)()
+            return
+
+        oferta.actual = conductor_id
+        oferta.intentados.add(conductor_id)
+        self.rueda.programar(clave, self.tiempo_respuesta, self._vencida, clave, conductor_id)
+
+        tipo, _ = clave
+        await get_channel_layer().group_send(grupo_conductor(conductor_id), {
+            'type': f'oferta_{tipo}',
+            'oferta': dict(oferta.datos, expira_en_s=self.tiempo_respuesta),
+        })
+
+    def _siguiente_candidato(self, oferta):
+        if len(oferta.intentados) >= self.maximo_intentos:
+            return None
+        if not oferta.candidatos:
+            lat, lon = oferta.datos['origen']
+            # Se piden en orden inverso para sacar el más cercano con pop()
+            oferta.candidatos = [
+                conductor_id for conductor_id, _ in reversed(indice_conductores.cercanos(
+                    lat, lon, k=CANDIDATOS_POR_CONSULTA, tipos=oferta.tipos,
+                    excluir=oferta.intentados, admitidos=oferta.admitidos,
+                ))
+            ]
+        while oferta.candidatos:
+            conductor_id = oferta.candidatos.pop()
+            # El conductor pudo salir del índice (no disponible) desde la consulta
+            if conductor_id in indice_conductores and conductor_id not in oferta.intentados:
+                return conductor_id
+        return None
+
+    def _vencida(self, clave, conductor_id):
+        oferta = self._en_vuelo.get(clave)
+        if oferta is None or oferta.actual != conductor_id:
+            return
+        self.contadores['vencidas'] += 1
+        self._loop.create_task(self._avanzar(clave, conductor_id))
+
+    def _rechazar(self, clave, conductor_id):
+        oferta = self._en_vuelo.get(clave)
+        if oferta is None or oferta.actual != conductor_id:
+            return
+        self.rueda.cancelar(clave)
+        self.contadores['rechazadas'] += 1
+        self._loop.create_task(self._avanzar(clave, None))
+
+    async def _avanzar(self, clave, retirar_a):
+        try:
+            if retirar_a is not None:
+                await self._avisar_retiro(clave, retirar_a)
+            await self._ofrecer_siguiente(clave)
+        except Exception:
+            logger.exception("Falló la cascada de la oferta %s.", clave)
+
+    def _cerrar(self, clave, conductor_id):
+        oferta = self._en_vuelo.pop(clave, None)
+        if oferta is None:
+            return
+        self.rueda.cancelar(clave)
+        if conductor_id is not None:
+            self.contadores['aceptadas'] += 1
+            self.latencia_aceptacion.registrar(time.monotonic() - oferta.inicio)
+        if oferta.actual is not None and oferta.actual != conductor_id:
+            self._loop.create_task(self._avisar_retiro(clave, oferta.actual))
+
+    async def _avisar_retiro(self, clave, conductor_id):
+        tipo, solicitud_id = clave
+        await get_channel_layer().group_send(grupo_conductor(conductor_id), {
+            'type': 'oferta_retirada', f'{tipo}_id': solicitud_id,
+        })
+
+    async def _recibir_traspasos(self):
+        """Ofrece desde aquí los lotes que entregan los procesos sin bucle (traspasar_lote)."""
+        from channels.db import database_sync_to_async
+        # Import diferido: domicilios ya depende de transporte
+        from domicilios.lotes import ofrecer_lote
+
+        capa = get_channel_layer()
+        canal = await capa.new_channel()
+        while True:
+            await capa.group_add(GRUPO_TRASPASO_LOTES, canal)
+            try:
+                mensaje = await asyncio.wait_for(capa.receive(canal), RENOVAR_GRUPO_S)
+            except asyncio.TimeoutError:
+                continue
+            try:
+                await database_sync_to_async(ofrecer_lote)(mensaje['lote_id'])
+            except Exception:
+                logger.exception("Falló la oferta del lote %s recibido de otro proceso.", mensaje.get('lote_id'))
+
+
+# Modelo de cada tipo de clave (se resuelven con apps.get_model para no importar domicilios aquí)
+MODELOS_POR_TIPO = {
+    'viaje': 'transporte.Viaje',
+    'asistencia': 'transporte.SolicitudAsistencia',
+    'lote': 'domicilios.LoteEntrega',
+}
+
+
+def sigue_solicitada(clave):
+    from django.apps import apps
+
+    tipo, solicitud_id = clave
+    modelo = apps.get_model(MODELOS_POR_TIPO[tipo])
+    return modelo.objects.filter(pk=solicitud_id, estado='solicitado').exists()
+
+
+# Despachador único por proceso
+despachador_cascada = DespachadorCascada()
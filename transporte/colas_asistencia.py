@@ -0,0 +1,229 @@
+# transporte/colas_asistencia.py
+
+import heapq
+import threading
+import time
+from collections import Counter
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .despacho import TIPOS_VEHICULO_POR_ASISTENCIA
+
+# ----------------------------------------------------------------------
+# 1. Parámetros de la Cola
+# ----------------------------------------------------------------------
+
+# Tiempo máximo (minutos) para que un proveedor tome cada tipo de asistencia.
+# La prioridad de una solicitud es su vencimiento: creado_en + SLA.
+SLA_MINUTOS_POR_TIPO = {
+    'grua': 30,
+    'llanta': 20,
+    'gasolina': 15,
+    'bateria': 20,
+}
+
+# Con más entradas obsoletas que esto (y más que vivas) se reconstruye el heap
+MINIMO_OBSOLETAS_COMPACTAR = 64
+
+# Vida máxima de la cola sin releer la BD. Los cambios de ESTE proceso llegan
+# al instante por señales; el TTL cubre los hechos por otros procesos/workers.
+TTL_COLA_S = 15
+
+
+def puede_atender(tipo_asistencia, tipos_vehiculo):
+    """True si alguno de los vehículos (Vehiculo.tipo) sirve para ese tipo de asistencia."""
+    requeridos = TIPOS_VEHICULO_POR_ASISTENCIA.get(tipo_asistencia)
+    return requeridos is None or bool(set(requeridos) & set(tipos_vehiculo))
+
+
+def _marca(fecha):
+    return fecha.timestamp()
+
+
+# ----------------------------------------------------------------------
+# 2. Cola de Despacho por Tipo de Asistencia
+# ----------------------------------------------------------------------
+
+class ColaAsistencia:
+    """
+    Un heap por tipo_asistencia con las solicitudes abiertas, ordenadas por
+    vencimiento del SLA (la más urgente primero).
+
+    Los proveedores solo ven los heaps de los tipos que sus vehículos pueden
+    atender, así que buscarles trabajo mira a lo sumo cuatro cimas en lugar
+    de recorrer la tabla. Retirar una solicitud es O(1): se quita del mapa
+    de abiertas y su entrada del heap se descarta al llegar a la cima
+    (borrado perezoso). Se mantiene al día con señales y con
+    reclamar_solicitud(), y se resincroniza con la BD cada 'ttl' segundos.
+    """
+
+    def __init__(self, ttl=TTL_COLA_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        # tipo_asistencia -> heap de (vence_en, asistencia_id)
+        self._heaps = {tipo: [] for tipo in SLA_MINUTOS_POR_TIPO}
+        # asistencia_id -> (tipo, vence_en, cliente_id)
+        self._abiertas = {}
+        # Entradas vivas por tipo (el resto de cada heap son obsoletas)
+        self._vivas = Counter()
+        self._cargado_en = None
+        # Retiradas durante una resincronización (no se deben revivir con la lectura)
+        self._retiradas = None
+
+    def __len__(self):
+        return len(self._abiertas)
+
+    def __contains__(self, asistencia_id):
+        return asistencia_id in self._abiertas
+
+    def agregar(self, asistencia_id, tipo, creado_en, cliente_id=None):
+        vence_en = _marca(creado_en) + SLA_MINUTOS_POR_TIPO.get(tipo, 30) * 60
+        with self._lock:
+            anterior = self._abiertas.get(asistencia_id)
+            if anterior is not None:
+                if anterior[:2] == (tipo, vence_en):
+                    return
+                self._vivas[anterior[0]] -= 1
+            self._abiertas[asistencia_id] = (tipo, vence_en, cliente_id)
+            self._vivas[tipo] += 1
+            heapq.heappush(self._heaps.setdefault(tipo, []), (vence_en, asistencia_id))
+
+    def retirar(self, asistencia_id):
+        with self._lock:
+            if self._retiradas is not None:
+                self._retiradas.add(asistencia_id)
+            actual = self._abiertas.pop(asistencia_id, None)
+            if actual is not None:
+                self._vivas[actual[0]] -= 1
+                self._compactar_si_corresponde(actual[0])
+
+    def cargar(self):
+        """
+        Sincroniza la cola con las asistencias abiertas en la BD: la primera
+        vez en cada proceso y luego cada 'ttl' segundos, para recoger las que
+        otros procesos crearon, tomaron o cancelaron (sus señales no llegan
+        aquí). Mientras un hilo resincroniza, los demás leen la cola actual.
+        """
+        from .models import SolicitudAsistencia
+
+        if self._cargado_en is not None and time.monotonic() - self._cargado_en < self.ttl:
+            return
+        if not self._lock_carga.acquire(blocking=self._cargado_en is None):
+            return
+        try:
+            if self._cargado_en is not None and time.monotonic() - self._cargado_en < self.ttl:
+                return
+            inicio = time.monotonic()
+            with self._lock:
+                previas = set(self._abiertas)
+                self._retiradas = set()
+            try:
+                abiertas = list(SolicitudAsistencia.objects.filter(estado='solicitado').values_list(
+                    'id', 'tipo_asistencia', 'creado_en', 'cliente_id'
+                ))
+            finally:
+                with self._lock:
+                    retiradas, self._retiradas = self._retiradas, None
+
+            en_bd = set()
+            for asistencia_id, tipo, creado_en, cliente_id in abiertas:
+                en_bd.add(asistencia_id)
+                if asistencia_id not in retiradas:
+                    self.agregar(asistencia_id, tipo, creado_en, cliente_id)
+            # Las que llegaron por señal durante la lectura no están en 'previas' y se conservan
+            for asistencia_id in previas - en_bd:
+                self.retirar(asistencia_id)
+            self._cargado_en = inicio
+        finally:
+            self._lock_carga.release()
+
+    # --- Lectura ---
+
+    def siguientes(self, tipos_vehiculo, k=5, excluir_cliente=None):
+        """
+        Las k asistencias más urgentes que puede atender un proveedor con
+        esos tipos de vehículo, de la más a la menos urgente. Cada heap
+        aporta como máximo k candidatos, que se devuelven a su sitio.
+        """
+        self.cargar()
+        ahora = _marca(timezone.now())
+        tipos = [tipo for tipo in self._heaps if puede_atender(tipo, tipos_vehiculo)]
+
+        candidatos = []
+        with self._lock:
+            for tipo in tipos:
+                heap = self._heaps[tipo]
+                apartados = []
+                while heap and len(apartados) < k:
+                    vence_en, asistencia_id = heapq.heappop(heap)
+                    actual = self._abiertas.get(asistencia_id)
+                    if actual is None or actual[:2] != (tipo, vence_en):
+                        continue  # Entrada obsoleta: ya se tomó, canceló o cambió de tipo
+                    apartados.append((vence_en, asistencia_id))
+                    if excluir_cliente is None or actual[2] != excluir_cliente:
+                        candidatos.append((vence_en, asistencia_id, tipo))
+                for entrada in apartados:
+                    heapq.heappush(heap, entrada)
+
+        candidatos.sort()
+        return [
+            {
+                'id': asistencia_id,
+                'tipo_asistencia': tipo,
+                'restante_s': round(vence_en - ahora, 1),
+                'vencida': vence_en < ahora,
+            }
+            for vence_en, asistencia_id, tipo in candidatos[:k]
+        ]
+
+    def resumen(self):
+        """Abiertas y vencidas por tipo de asistencia (recorre solo las abiertas)."""
+        self.cargar()
+        ahora = _marca(timezone.now())
+        with self._lock:
+            abiertas = list(self._abiertas.values())
+        resumen = {tipo: {'abiertas': 0, 'vencidas': 0, 'sla_min': sla} for tipo, sla in SLA_MINUTOS_POR_TIPO.items()}
+        for tipo, vence_en, _ in abiertas:
+            fila = resumen.setdefault(tipo, {'abiertas': 0, 'vencidas': 0, 'sla_min': None})
+            fila['abiertas'] += 1
+            fila['vencidas'] += vence_en < ahora
+        return resumen
+
+    # --- Auxiliares internos ---
+
+    def _compactar_si_corresponde(self, tipo):
+        # Reconstrucción amortizada O(1): solo cuando las obsoletas superan a las vivas
+        heap = self._heaps.get(tipo, [])
+        vivas = self._vivas[tipo]
+        if len(heap) - vivas > max(vivas, MINIMO_OBSOLETAS_COMPACTAR):
+            self._heaps[tipo] = [
+                (vence_en, asistencia_id) for vence_en, asistencia_id in heap
+                if self._abiertas.get(asistencia_id, (None, None))[:2] == (tipo, vence_en)
+            ]
+            heapq.heapify(self._heaps[tipo])
+
+
+# Cola única por proceso
+cola_asistencia = ColaAsistencia()
+
+
+# ----------------------------------------------------------------------
+# 3. Señales: creación, finalización y cancelación por save()
+# ----------------------------------------------------------------------
+# Las aceptaciones por UPDATE condicional (reclamar_solicitud) no disparan
+# señales: esa ruta llama a cola_asistencia.retirar() directamente.
+
+@receiver(post_save, sender='transporte.SolicitudAsistencia')
+def actualizar_cola(sender, instance, **kwargs):
+    if instance.estado == 'solicitado':
+        cola_asistencia.agregar(instance.pk, instance.tipo_asistencia, instance.creado_en, instance.cliente_id)
+    else:
+        cola_asistencia.retirar(instance.pk)
+
+
+@receiver(post_delete, sender='transporte.SolicitudAsistencia')
+def retirar_de_cola(sender, instance, **kwargs):
+    cola_asistencia.retirar(instance.pk)
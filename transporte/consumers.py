@@ -1,10 +1,21 @@
 # transporte/consumers.py (Modificado y Corregido)
 
 import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
 from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from .models import Viaje, MensajeViaje
+from .despacho import indice_conductores, registrar_posicion_conductor
+from .ubicaciones import registro_ubicaciones
+from .asignacion import iniciar_motor
+from .ofertas import grupo_conductor, difusor_ofertas
+from .cascada import despachador_cascada
+from .demanda import mapa_demanda, GRUPO_DEMANDA
+from .transiciones import MODELOS_POR_TIPO, SesionParticipante, grupo_estado, es_participante, eventos_de, modelo_de
+from SuperService.escritura_diferida import escritor_mensajes
+from SuperService.reanudacion_chat import SesionReanudacion
 
 UsuarioPersonalizado = get_user_model()
 
@@ -17,6 +28,10 @@ class ViajeChatConsumer(AsyncWebsocketConsumer):
         # El nombre del grupo es único para este viaje
         self.room_group_name = f'viaje_{self.viaje_id}'
         self.user = self.scope["user"] 
+        # Participantes resueltos una vez por conexión (ver transiciones.SesionParticipante)
+        self.sesion = SesionParticipante(self.user, 'viaje', self.viaje_id)
+        # ?last_seq=<n> al reconectar: solo se reenvía lo perdido (SuperService/reanudacion_chat.py)
+        self.reanudacion = SesionReanudacion(self.room_group_name, self.scope)
 
         # 1. Verificar si el usuario está autorizado para este viaje (Cliente, Conductor o Admin)
         # ✅ CORRECCIÓN 2: Llama a is_authorized sin argumento, ya que usa self.viaje_id
@@ -24,14 +39,19 @@ class ViajeChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        # Vaciado periódico de los mensajes a la BD (una vez por proceso)
+        escritor_mensajes.iniciar()
+
         # 2. Unirse al grupo
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         await self.accept()
+        await self.reanudar()
 
     async def disconnect(self, close_code):
+        self.reanudacion.salir()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -45,56 +65,261 @@ class ViajeChatConsumer(AsyncWebsocketConsumer):
         if not message.strip():
             return
 
-        # 3. Guardar mensaje en la BD (síncrona)
-        await self.save_message(message)
+        # Solo memoria; se vuelve a la BD únicamente si el viaje se reasignó o venció el TTL
+        if not self.sesion.vigente() and not await self.is_authorized():
+            await self.close()
+            return
 
-        # 4. Enviar mensaje al grupo (broadcast)
+        # 3. Enviar mensaje al grupo (broadcast)
         # Nota: El 'username' se envía aquí.
+        seq = self.reanudacion.secuencia()
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
                 'message': message,
                 'username': self.user.username,
+                'seq': seq,
                 # Se puede añadir el ID para mayor seguridad en el front-end, pero el username es suficiente aquí
             }
         )
 
+        # 4. Guardar mensaje en la BD (en lote, ver SuperService/escritura_diferida.py)
+        await self.save_message(message, seq)
+
     # Recibir mensaje del grupo (broadcast)
     async def chat_message(self, event):
+        # Ya enviado al reanudar la conexión
+        if not self.reanudacion.nuevo(event):
+            return
+
         # Determina si el mensaje fue enviado por el usuario actual del socket
         is_me = event['username'] == self.user.username 
         
         await self.send(text_data=json.dumps({
             'message': event['message'],
             'username': event['username'],
-            'is_me': is_me
+            'is_me': is_me,
+            'seq': event.get('seq'),
+        }))
+
+    async def reanudar(self):
+        """Reenvía los mensajes posteriores a ?last_seq= (si el cliente lo indicó)."""
+        eventos, completa = await self.reanudacion.iniciar(self.mensajes_desde_bd)
+        if self.reanudacion.last_seq is None:
+            return
+        for evento in eventos:
+            await self.chat_message(evento)
+        await self.send(text_data=json.dumps({
+            'tipo': 'reanudacion',
+            'seq': eventos[-1]['seq'] if eventos else self.reanudacion.last_seq,
+            'completa': completa,
         }))
+
+    def mensajes_desde_bd(self, desde, limite):
+        mensajes = MensajeViaje.objects.filter(
+            viaje_id=self.viaje_id, secuencia__gt=desde
+        ).select_related('emisor').order_by('secuencia')[:limite]
+        return [
+            {'type': 'chat_message', 'message': m.contenido, 'username': m.emisor.username, 'seq': m.secuencia}
+            for m in mensajes
+        ]
         
-    @sync_to_async
+    @database_sync_to_async
     # ✅ CORRECCIÓN 3: is_authorized no recibe el ID como argumento, usa self.viaje_id
     def is_authorized(self): 
-        """Verifica si el usuario es el cliente, conductor del viaje, o admin."""
-        try:
-            viaje = Viaje.objects.get(pk=self.viaje_id) # Usa self.viaje_id
-            
-            # ✅ CORRECCIÓN 4: Permite la conexión a usuarios staff/administradores
-            return self.user.is_staff or self.user == viaje.cliente or self.user == viaje.conductor
-        except Viaje.DoesNotExist:
-            return False
-
-    @sync_to_async
+        """Verifica si el usuario es el cliente, conductor del viaje, o admin (caché de participantes)."""
+        # ✅ CORRECCIÓN 4: Permite la conexión a usuarios staff/administradores
+        return self.sesion.resolver()
+
     # ✅ CORRECCIÓN 5: save_message usa self.viaje_id
-    def save_message(self, content): 
-        """Guarda el mensaje en MensajeViaje."""
+    async def save_message(self, content, seq): 
+        """Encola el mensaje para MensajeViaje; el viaje ya se verificó en connect()."""
+        await escritor_mensajes.guardar(
+            MensajeViaje(viaje_id=self.viaje_id, emisor=self.user, contenido=content, secuencia=seq)
+        )
+
+
+# ----------------------------------------------------------------------
+# Ubicación en Vivo de Conductores
+# ----------------------------------------------------------------------
+
+class UbicacionConductorConsumer(AsyncWebsocketConsumer):
+    """
+    Recibe las pings de GPS del conductor: {"lat": 10.48, "lon": -66.90}.
+    Cada ping solo toca memoria (buffer circular + índice de despacho); la BD
+    se actualiza en lotes desde transporte/ubicaciones.py.
+
+    Por el mismo socket el conductor recibe las ofertas de viaje y asistencia
+    ({"tipo": "oferta_viaje", ...}) enviadas a su grupo 'conductor_<id>', y
+    puede rechazarlas: {"accion": "rechazar", "viaje_id": 12} (o "asistencia_id").
+    """
+    # Cada cuánto se vuelve a consultar si un conductor fuera del índice ya está disponible
+    INTERVALO_REVISION_S = 30
+
+    async def connect(self):
+        self.user = self.scope["user"]
+
+        if not self.user.is_authenticated or self.user.rol not in ['conductor', 'repartidor_domicilios']:
+            await self.close()
+            return
+
+        self.conductor_id = self.user.pk
+        self.proxima_revision = 0.0
+
+        # Arranca (una sola vez por proceso) el vaciado periódico a la BD, el motor de asignación y las ofertas
+        registro_ubicaciones.iniciar()
+        iniciar_motor()
+        difusor_ofertas.iniciar()
+        despachador_cascada.iniciar()
+
+        # Grupo personal para recibir ofertas de viaje
+        self.grupo = grupo_conductor(self.conductor_id)
+        await self.channel_layer.group_add(self.grupo, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'conductor_id', None):
+            registro_ubicaciones.olvidar(self.conductor_id)
+            await self.channel_layer.group_discard(self.grupo, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            datos = json.loads(text_data)
+            if isinstance(datos, dict) and datos.get('accion') == 'rechazar':
+                self.rechazar_oferta(datos)
+                return
+            lat = float(datos['lat'])
+            lon = float(datos['lon'])
+        except (ValueError, KeyError, TypeError):
+            return
+
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return
+
+        registro_ubicaciones.registrar(self.conductor_id, lat, lon)
+
+        # Fuera del índice (no disponible o recién conectado): revisar la BD de vez en cuando, no en cada ping
+        if self.conductor_id not in indice_conductores:
+            ahora = time.monotonic()
+            if ahora >= self.proxima_revision:
+                self.proxima_revision = ahora + self.INTERVALO_REVISION_S
+                await self.entrar_al_indice(lat, lon)
+
+    # Ofertas empujadas por transporte/ofertas.py
+    async def oferta_viaje(self, event):
+        await self.send(text_data=json.dumps(dict(event['oferta'], tipo='oferta_viaje')))
+
+    async def oferta_asistencia(self, event):
+        await self.send(text_data=json.dumps(dict(event['oferta'], tipo='oferta_asistencia')))
+
+    async def oferta_lote(self, event):
+        await self.send(text_data=json.dumps(dict(event['oferta'], tipo='oferta_lote')))
+
+    async def oferta_retirada(self, event):
+        datos = {clave: valor for clave, valor in event.items() if clave != 'type'}
+        await self.send(text_data=json.dumps(dict(datos, tipo='oferta_retirada')))
+
+    def rechazar_oferta(self, datos):
+        for tipo in ('viaje', 'asistencia', 'lote'):
+            solicitud_id = datos.get(f'{tipo}_id')
+            if isinstance(solicitud_id, int):
+                despachador_cascada.rechazada((tipo, solicitud_id), self.conductor_id)
+
+    @database_sync_to_async
+    def entrar_al_indice(self, lat, lon):
+        """Incorpora al conductor al índice de despacho si está disponible y tiene vehículo aprobado."""
+        self.user.refresh_from_db(fields=['disponible'])
+        return registrar_posicion_conductor(self.user, lat, lon)
+
+
+# ----------------------------------------------------------------------
+# Mapa de Oferta y Demanda (Operaciones / Precios)
+# ----------------------------------------------------------------------
+
+class DemandaConsumer(AsyncWebsocketConsumer):
+    """
+    Envía al conectar todas las zonas activas ({"tipo": "zonas", "completo": true})
+    y luego, cada pocos segundos, solo las zonas cuyo conteo cambió. Solo staff.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated or not self.user.is_staff:
+            await self.close()
+            return
+
+        mapa_demanda.iniciar()
+        await self.channel_layer.group_add(GRUPO_DEMANDA, self.channel_name)
+        await self.accept()
+
+        zonas = await database_sync_to_async(mapa_demanda.zonas)()
+        await self.send(text_data=json.dumps({'tipo': 'zonas', 'completo': True, 'zonas': zonas}))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(GRUPO_DEMANDA, self.channel_name)
+
+    async def demanda_zonas(self, event):
+        await self.send(text_data=json.dumps({'tipo': 'zonas', 'completo': False, 'zonas': event['zonas']}))
+
+
+# ----------------------------------------------------------------------
+# Eventos de Estado de Viajes, Asistencias, Pedidos y Lotes
+# ----------------------------------------------------------------------
+
+class EstadoConsumer(AsyncWebsocketConsumer):
+    """
+    ws/estado/<tipo>/<id>/?desde=<evento_id>: los participantes (y staff)
+    reciben cada cambio de estado del objeto en cuanto se confirma, en
+    lugar de volver a pedir el objeto completo. Al conectar se envía el
+    estado actual y, si se indica 'desde', los eventos que se perdieron.
+    Los eventos llegan una sola vez aunque se confirmen mientras se
+    cargaban los perdidos (el grupo ya estaba unido): se recuerda el id más
+    alto enviado.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.tipo = self.scope['url_route']['kwargs']['tipo']
+        self.objeto_id = int(self.scope['url_route']['kwargs']['objeto_id'])
+        if (
+            self.tipo not in MODELOS_POR_TIPO or not self.user.is_authenticated
+            or not await database_sync_to_async(es_participante)(self.user, self.tipo, self.objeto_id)
+        ):
+            await self.close()
+            return
+
+        self.ultimo_evento = 0
+        self.grupo = grupo_estado(self.tipo, self.objeto_id)
+        await self.channel_layer.group_add(self.grupo, self.channel_name)
+        await self.accept()
+
+        estado, perdidos = await self.estado_inicial()
+        await self.send(text_data=json.dumps({'tipo': 'estado', 'estado': estado}))
+        for evento in perdidos:
+            await self.enviar_evento(evento)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'grupo'):
+            await self.channel_layer.group_discard(self.grupo, self.channel_name)
+
+    async def estado_evento(self, event):
+        await self.enviar_evento(event['evento'])
+
+    async def enviar_evento(self, evento):
+        # Un evento ya enviado con los perdidos también llega por el grupo
+        if evento['id'] <= self.ultimo_evento:
+            return
+        self.ultimo_evento = evento['id']
+        await self.send(text_data=json.dumps({'tipo': 'evento', 'evento': evento}))
+
+    @database_sync_to_async
+    def estado_inicial(self):
+        from urllib.parse import parse_qs
+
+        estado = modelo_de(self.tipo).objects.filter(pk=self.objeto_id).values_list('estado', flat=True).first()
         try:
-            viaje = Viaje.objects.get(pk=self.viaje_id)
-            MensajeViaje.objects.create(
-                viaje=viaje,
-                emisor=self.user,
-                contenido=content
-            )
-            # Debugging opcional para ver en la consola de Daphne que se guardó
-            # print(f"Mensaje guardado en DB para Viaje {self.viaje_id}.") 
-        except Viaje.DoesNotExist:
-            print(f"ERROR: Viaje {self.viaje_id} no encontrado para guardar mensaje.")
\ No newline at end of file
+            desde = int(parse_qs(self.scope.get('query_string', b'').decode()).get('desde', [''])[0])
+        except ValueError:
+            return estado, []
+        return estado, eventos_de(self.tipo, self.objeto_id, desde)
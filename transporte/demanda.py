@@ -0,0 +1,229 @@
+# transporte/demanda.py
+
+import asyncio
+import threading
+from collections import Counter
+
+from channels.layers import get_channel_layer
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .despacho import celda_de, indice_conductores, ESTADOS_OCUPADO, TAMANO_CELDA_GRADOS
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Grupo de Channels al que se envían los cambios por zona
+GRUPO_DEMANDA = 'demanda'
+
+# Cada cuánto se envían los cambios acumulados por WebSocket (segundos)
+INTERVALO_EMISION_S = 2.0
+
+
+def zona_de(lat, lon):
+    """Las zonas son las mismas celdas del índice de despacho (≈1.1 km)."""
+    return celda_de(lat, lon)
+
+
+def centro_de(zona):
+    return (round((zona[0] + 0.5) * TAMANO_CELDA_GRADOS, 6), round((zona[1] + 0.5) * TAMANO_CELDA_GRADOS, 6))
+
+
+# ----------------------------------------------------------------------
+# 2. Contadores de Oferta y Demanda
+# ----------------------------------------------------------------------
+
+class MapaDemanda:
+    """
+    Contadores en memoria de viajes abiertos ('solicitado') por zona.
+
+    Se actualizan de forma incremental en cada creación, aceptación,
+    finalización o cancelación de un viaje: nunca se recuenta la tabla
+    (salvo la carga inicial del proceso). La oferta de cada zona es el
+    número de conductores del índice de despacho en esa celda con posición
+    reciente y sin un viaje en curso; los viajes en curso se siguen aquí
+    con los mismos eventos que la demanda.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._demanda = Counter()
+        # viaje_id -> zona, para restar en la zona correcta (y ser idempotente)
+        self._zona_viaje = {}
+        # viaje_id -> conductor_id de los viajes en ESTADOS_OCUPADO, y viajes en curso por conductor
+        self._conductor_viaje = {}
+        self._ocupados = Counter()
+        # Cambios recibidos mientras se hace la carga inicial (None si no hay carga en curso)
+        self._diario = None
+        self._cargado = False
+        self._ultimo_emitido = {}
+        self._tarea = None
+
+    def viaje_abierto(self, viaje_id, lat, lon):
+        self._aplicar(('abierto', viaje_id, zona_de(lat, lon)))
+
+    def viaje_cerrado(self, viaje_id, conductor_id=None):
+        """El viaje deja de ser demanda; con 'conductor_id' ese conductor queda ocupado con él."""
+        self._aplicar(('cerrado', viaje_id, conductor_id))
+
+    def _aplicar(self, cambio):
+        with self._lock:
+            self._cambiar(cambio)
+            if self._diario is not None:
+                self._diario.append(cambio)
+
+    def _cambiar(self, cambio):
+        tipo, viaje_id, valor = cambio
+        if tipo == 'abierto':
+            self._liberar(viaje_id)
+            anterior = self._zona_viaje.get(viaje_id)
+            if anterior == valor:
+                return
+            if anterior is not None:
+                self._restar(anterior)
+            self._zona_viaje[viaje_id] = valor
+            self._demanda[valor] += 1
+        else:
+            zona = self._zona_viaje.pop(viaje_id, None)
+            if zona is not None:
+                self._restar(zona)
+            if self._conductor_viaje.get(viaje_id) != valor:
+                self._liberar(viaje_id)
+                if valor is not None:
+                    self._conductor_viaje[viaje_id] = valor
+                    self._ocupados[valor] += 1
+
+    def _restar(self, zona):
+        self._demanda[zona] -= 1
+        if self._demanda[zona] <= 0:
+            del self._demanda[zona]
+
+    def _liberar(self, viaje_id):
+        conductor_id = self._conductor_viaje.pop(viaje_id, None)
+        if conductor_id is not None:
+            self._ocupados[conductor_id] -= 1
+            if self._ocupados[conductor_id] <= 0:
+                del self._ocupados[conductor_id]
+
+    def cargar(self):
+        """
+        Carga inicial (una vez por proceso) de los viajes abiertos y en curso.
+        La consulta corre fuera del lock; los cambios que llegan por señal
+        mientras tanto se anotan en un diario y se vuelven a aplicar sobre
+        la foto, así un viaje cerrado durante la carga no queda como demanda.
+        """
+        from .models import Viaje
+
+        with self._lock:
+            if self._cargado:
+                return
+            if self._diario is None:
+                self._diario = []
+        abiertos = list(Viaje.objects.filter(estado='solicitado').values_list('id', 'origen_lat', 'origen_lon'))
+        en_curso = list(
+            Viaje.objects.filter(estado__in=ESTADOS_OCUPADO, conductor__isnull=False).values_list('id', 'conductor_id')
+        )
+        with self._lock:
+            if self._cargado:
+                return
+            diario, self._diario = self._diario, None
+            self._demanda.clear()
+            self._zona_viaje.clear()
+            self._conductor_viaje.clear()
+            self._ocupados.clear()
+            for viaje_id, lat, lon in abiertos:
+                self._cambiar(('abierto', viaje_id, zona_de(lat, lon)))
+            for viaje_id, conductor_id in en_curso:
+                self._cambiar(('cerrado', viaje_id, conductor_id))
+            for cambio in diario:
+                self._cambiar(cambio)
+            self._cargado = True
+
+    # --- Lectura ---
+
+    def zona(self, zona):
+        """{'demanda', 'oferta', 'ratio'} de una zona; solo se miran los conductores de esa celda."""
+        self.cargar()
+        demanda = self._demanda.get(zona, 0)
+        # Solo consultas de pertenencia: no hace falta copiar los ocupados
+        oferta = indice_conductores.conteo_celda(zona, excluir=self._ocupados)
+        return self._describir(zona, demanda, oferta)
+
+    def zonas(self):
+        """Todas las zonas con demanda u oferta, de mayor a menor ratio."""
+        self.cargar()
+        with self._lock:
+            demanda = dict(self._demanda)
+        oferta = indice_conductores.conteos_por_celda(excluir=self._ocupados)
+        resultado = [
+            self._describir(zona, demanda.get(zona, 0), oferta.get(zona, 0))
+            for zona in demanda.keys() | oferta.keys()
+        ]
+        resultado.sort(key=lambda z: (z['ratio'], z['demanda']), reverse=True)
+        return resultado
+
+    @staticmethod
+    def _describir(zona, demanda, oferta):
+        return {
+            'zona': list(zona),
+            'centro': list(centro_de(zona)),
+            'demanda': demanda,
+            'oferta': oferta,
+            # Sin conductores la zona cuenta como si tuviera uno, para que el ratio sea finito
+            'ratio': round(demanda / max(oferta, 1), 2),
+        }
+
+    def cambios(self):
+        """Zonas cuyo (demanda, oferta) cambió desde la última llamada."""
+        actuales = {tuple(z['zona']): z for z in self.zonas()}
+        cambiadas = [
+            z for clave, z in actuales.items()
+            if self._ultimo_emitido.get(clave) != (z['demanda'], z['oferta'])
+        ]
+        # Las zonas que quedaron vacías se emiten en cero para que el cliente las borre
+        for clave in self._ultimo_emitido.keys() - actuales.keys():
+            cambiadas.append(self._describir(clave, 0, 0))
+        self._ultimo_emitido = {clave: (z['demanda'], z['oferta']) for clave, z in actuales.items()}
+        return cambiadas
+
+    # --- Emisión por WebSocket ---
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) la emisión periódica de cambios al grupo 'demanda'."""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._bucle_emision())
+
+    async def _bucle_emision(self):
+        from channels.db import database_sync_to_async
+
+        await database_sync_to_async(self.cargar)()
+        while True:
+            await asyncio.sleep(INTERVALO_EMISION_S)
+            cambiadas = self.cambios()
+            if cambiadas:
+                await get_channel_layer().group_send(GRUPO_DEMANDA, {'type': 'demanda_zonas', 'zonas': cambiadas})
+
+
+mapa_demanda = MapaDemanda()
+
+
+# ----------------------------------------------------------------------
+# 3. Señales: creación, finalización y cancelación por save()
+# ----------------------------------------------------------------------
+# Las aceptaciones por UPDATE condicional (reclamar_solicitud, motor por
+# lotes) no disparan señales: esas rutas llaman a viaje_cerrado() directamente.
+
+@receiver(post_save, sender='transporte.Viaje')
+def actualizar_demanda(sender, instance, **kwargs):
+    if instance.estado == 'solicitado':
+        mapa_demanda.viaje_abierto(instance.pk, instance.origen_lat, instance.origen_lon)
+    elif instance.estado in ESTADOS_OCUPADO:
+        mapa_demanda.viaje_cerrado(instance.pk, instance.conductor_id)
+    else:
+        mapa_demanda.viaje_cerrado(instance.pk)
+
+
+@receiver(post_delete, sender='transporte.Viaje')
+def retirar_demanda(sender, instance, **kwargs):
+    mapa_demanda.viaje_cerrado(instance.pk)
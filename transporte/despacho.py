@@ -0,0 +1,310 @@
+# transporte/despacho.py
+
+import math
+import threading
+import time
+
+from domicilios.utils import calcular_distancia_haversine, KM_POR_GRADO
+
+# ----------------------------------------------------------------------
+# 1. Parámetros del Índice Geográfico
+# ----------------------------------------------------------------------
+
+# Tamaño de la celda de la cuadrícula en grados (0.01° ≈ 1.1 km de latitud)
+TAMANO_CELDA_GRADOS = 0.01
+
+# Radio máximo de búsqueda de conductores alrededor de un origen
+RADIO_BUSQUEDA_KM = 15.0
+
+# Una posición más vieja que esto se considera abandonada (app cerrada, sin señal)
+EDAD_MAXIMA_POSICION_S = 300
+
+# Estados en los que un conductor está ocupado y no puede recibir otro viaje
+ESTADOS_OCUPADO = ['aceptado', 'en_ruta_origen', 'en_curso']
+
+# Tipos de vehículo (Vehiculo.tipo) que pueden atender cada Viaje.tipo_servicio
+TIPOS_VEHICULO_POR_SERVICIO = {
+    'economy': ('auto',),
+    'premium': ('auto',),
+    'moto': ('moto',),
+}
+
+# Tipos de vehículo que pueden atender cada SolicitudAsistencia.tipo_asistencia
+TIPOS_VEHICULO_POR_ASISTENCIA = {
+    'grua': ('camioneta',),
+    'llanta': ('auto', 'camioneta'),
+    'gasolina': ('moto', 'auto', 'camioneta'),
+    'bateria': ('auto', 'camioneta'),
+}
+
+
+def celda_de(lat, lon, tamano=TAMANO_CELDA_GRADOS):
+    """Devuelve la celda (fila, columna) de la cuadrícula que contiene el punto."""
+    return (math.floor(float(lat) / tamano), math.floor(float(lon) / tamano))
+
+
+# ----------------------------------------------------------------------
+# 2. Índice de Conductores Disponibles
+# ----------------------------------------------------------------------
+
+class IndiceConductores:
+    """
+    Índice en memoria (cuadrícula uniforme) de los conductores disponibles.
+
+    Cada conductor ocupa una celda según su última posición reportada. La
+    búsqueda de los k más cercanos recorre anillos de celdas alrededor del
+    origen y se detiene en cuanto ningún anillo exterior puede mejorar el
+    resultado, así que solo se calculan distancias para un puñado de
+    candidatos en lugar de recorrer toda la flota.
+    """
+
+    def __init__(self, tamano_celda=TAMANO_CELDA_GRADOS):
+        self.tamano_celda = tamano_celda
+        self._lock = threading.RLock()
+        # celda -> set(conductor_id)
+        self._celdas = {}
+        # conductor_id -> (lat, lon, celda, tipos, actualizado_en)
+        self._conductores = {}
+
+    def __len__(self):
+        return len(self._conductores)
+
+    def __contains__(self, conductor_id):
+        return conductor_id in self._conductores
+
+    def actualizar(self, conductor_id, lat, lon, tipos=None):
+        """
+        Registra o mueve a un conductor. Si 'tipos' es None se conservan los
+        tipos de vehículo ya conocidos (las pings de posición no los envían).
+        """
+        lat, lon = float(lat), float(lon)
+        celda = celda_de(lat, lon, self.tamano_celda)
+
+        with self._lock:
+            anterior = self._conductores.get(conductor_id)
+            if tipos is None:
+                tipos = anterior[3] if anterior else frozenset()
+            else:
+                tipos = frozenset(tipos)
+
+            if anterior and anterior[2] != celda:
+                self._quitar_de_celda(conductor_id, anterior[2])
+            if not anterior or anterior[2] != celda:
+                self._celdas.setdefault(celda, set()).add(conductor_id)
+
+            self._conductores[conductor_id] = (lat, lon, celda, tipos, time.monotonic())
+
+    def mover(self, conductor_id, lat, lon):
+        """
+        Mueve a un conductor que ya está indexado. Devuelve False si no lo
+        está, de modo que las pings de un conductor no disponible no lo
+        vuelvan a meter en el índice.
+        """
+        with self._lock:
+            if conductor_id not in self._conductores:
+                return False
+            self.actualizar(conductor_id, lat, lon)
+            return True
+
+    def actualizar_tipos(self, conductor_id, tipos):
+        """Cambia los tipos de vehículo de un conductor ya indexado (p. ej. al aprobar un vehículo)."""
+        with self._lock:
+            actual = self._conductores.get(conductor_id)
+            if actual:
+                self._conductores[conductor_id] = actual[:3] + (frozenset(tipos),) + actual[4:]
+
+    def retirar(self, conductor_id):
+        """Saca al conductor del índice (deja de estar disponible)."""
+        with self._lock:
+            actual = self._conductores.pop(conductor_id, None)
+            if actual:
+                self._quitar_de_celda(conductor_id, actual[2])
+
+    def posicion(self, conductor_id):
+        """Devuelve (lat, lon) del conductor o None si no está indexado."""
+        actual = self._conductores.get(conductor_id)
+        return (actual[0], actual[1]) if actual else None
+
+    def tipos(self, conductor_id):
+        actual = self._conductores.get(conductor_id)
+        return actual[3] if actual else frozenset()
+
+    def conteo_celda(self, celda, excluir=()):
+        """Conductores de una celda con posición reciente, sin contar los de 'excluir'."""
+        limite_edad = time.monotonic() - EDAD_MAXIMA_POSICION_S
+        with self._lock:
+            return sum(
+                1 for conductor_id in self._celdas.get(celda, ())
+                if conductor_id not in excluir and self._conductores[conductor_id][4] >= limite_edad
+            )
+
+    def conteos_por_celda(self, excluir=()):
+        """{celda: conductores con posición reciente}, sin contar los de 'excluir'."""
+        limite_edad = time.monotonic() - EDAD_MAXIMA_POSICION_S
+        conteos = {}
+        with self._lock:
+            for conductor_id, (_, _, celda, _, actualizado) in self._conductores.items():
+                if actualizado >= limite_edad and conductor_id not in excluir:
+                    conteos[celda] = conteos.get(celda, 0) + 1
+        return conteos
+
+    def conductores(self):
+        """Copia de {conductor_id: (lat, lon, tipos)} para procesos por lotes."""
+        with self._lock:
+            return {cid: (d[0], d[1], d[3]) for cid, d in self._conductores.items()}
+
+    def cercanos(self, lat, lon, k=5, tipos=None, radio_km=RADIO_BUSQUEDA_KM, excluir=(), admitidos=None):
+        """
+        Devuelve hasta k tuplas (conductor_id, distancia_km) ordenadas por
+        distancia. 'tipos' restringe a conductores con alguno de esos tipos
+        de vehículo; 'excluir' es un conjunto de ids a ignorar y 'admitidos',
+        si se indica, el único conjunto de ids aceptables (p. ej. por rol).
+        """
+        if k <= 0:
+            return []
+        lat, lon = float(lat), float(lon)
+        fila0, col0 = celda_de(lat, lon, self.tamano_celda)
+        tipos = frozenset(tipos) if tipos else None
+        limite_edad = time.monotonic() - EDAD_MAXIMA_POSICION_S
+
+        # Distancia mínima garantizada por cada anillo de celdas adicional
+        alto_km = self.tamano_celda * KM_POR_GRADO
+        ancho_km = alto_km * max(math.cos(math.radians(lat)), 0.01)
+        paso_km = min(alto_km, ancho_km)
+        anillo_maximo = int(radio_km // paso_km) + 1
+
+        encontrados = []
+        with self._lock:
+            for anillo in range(anillo_maximo + 1):
+                for celda in self._celdas_del_anillo(fila0, col0, anillo):
+                    for conductor_id in self._celdas.get(celda, ()):
+                        if conductor_id in excluir:
+                            continue
+                        if admitidos is not None and conductor_id not in admitidos:
+                            continue
+                        c_lat, c_lon, _, c_tipos, actualizado = self._conductores[conductor_id]
+                        if actualizado < limite_edad:
+                            continue
+                        if tipos is not None and not (tipos & c_tipos):
+                            continue
+                        distancia = calcular_distancia_haversine(lat, lon, c_lat, c_lon)
+                        if distancia <= radio_km:
+                            encontrados.append((conductor_id, distancia))
+
+                # Ningún conductor fuera de este anillo puede estar a menos de anillo * paso_km
+                if encontrados and len(encontrados) >= k:
+                    encontrados.sort(key=lambda par: par[1])
+                    del encontrados[k:]
+                    if encontrados[-1][1] <= anillo * paso_km:
+                        break
+
+        encontrados.sort(key=lambda par: par[1])
+        return encontrados[:k]
+
+    # --- Auxiliares internos ---
+
+    def _quitar_de_celda(self, conductor_id, celda):
+        ocupantes = self._celdas.get(celda)
+        if ocupantes is not None:
+            ocupantes.discard(conductor_id)
+            if not ocupantes:
+                del self._celdas[celda]
+
+    @staticmethod
+    def _celdas_del_anillo(fila0, col0, anillo):
+        if anillo == 0:
+            yield (fila0, col0)
+            return
+        for col in range(col0 - anillo, col0 + anillo + 1):
+            yield (fila0 - anillo, col)
+            yield (fila0 + anillo, col)
+        for fila in range(fila0 - anillo + 1, fila0 + anillo):
+            yield (fila, col0 - anillo)
+            yield (fila, col0 + anillo)
+
+
+# Índice único por proceso (compartido por vistas, consumers y tareas)
+indice_conductores = IndiceConductores()
+
+
+# ----------------------------------------------------------------------
+# 3. Funciones de Apoyo para las Vistas
+# ----------------------------------------------------------------------
+
+def tipos_vehiculo_aprobados(conductor):
+    """Tipos de vehículo aprobados del conductor (consulta a la BD)."""
+    from .models import Vehiculo
+
+    return set(
+        Vehiculo.objects.filter(conductor=conductor, aprobado=True).values_list('tipo', flat=True)
+    )
+
+
+def registrar_posicion_conductor(conductor, lat, lon):
+    """
+    Actualiza la posición del conductor en el índice. Solo entran conductores
+    'disponibles' con al menos un vehículo aprobado; los tipos de vehículo se
+    consultan una única vez, cuando el conductor entra al índice.
+    Devuelve True si el conductor quedó indexado.
+    """
+    if not conductor.disponible:
+        indice_conductores.retirar(conductor.pk)
+        return False
+
+    tipos = None
+    if conductor.pk not in indice_conductores:
+        tipos = tipos_vehiculo_aprobados(conductor)
+        if not tipos:
+            return False
+
+    indice_conductores.actualizar(conductor.pk, lat, lon, tipos=tipos)
+    return True
+
+
+def conductores_cercanos_a_viaje(viaje, k=5):
+    """k conductores compatibles más cercanos al origen de un Viaje."""
+    tipos = TIPOS_VEHICULO_POR_SERVICIO.get(viaje.tipo_servicio)
+    excluir = {viaje.cliente_id} if viaje.cliente_id else ()
+    return indice_conductores.cercanos(
+        viaje.origen_lat, viaje.origen_lon, k=k, tipos=tipos, excluir=excluir
+    )
+
+
+# ----------------------------------------------------------------------
+# 4. Aceptación Atómica de Solicitudes
+# ----------------------------------------------------------------------
+
+def reclamar_solicitud(modelo, solicitud_id, **asignacion):
+    """
+    Intenta tomar una solicitud (Viaje o SolicitudAsistencia) con un único
+    UPDATE condicional:
+
+        UPDATE ... SET estado='aceptado', conductor=... WHERE id=... AND estado='solicitado'
+
+    La BD garantiza que solo una de varias peticiones simultáneas encuentra
+    la fila en 'solicitado', así que como mucho un conductor gana.
+    Quien gana agrega el EventoEstado 'solicitado' -> 'aceptado' (transiciones.py).
+    Devuelve True si esta llamada se quedó con la solicitud.
+    """
+    from .demanda import mapa_demanda
+    from .colas_asistencia import cola_asistencia
+    from .transiciones import registrar_eventos, tipo_de
+
+    filas = modelo.objects.filter(pk=solicitud_id, estado='solicitado').update(
+        estado='aceptado', **asignacion
+    )
+    # El UPDATE no dispara post_save: se descuenta la demanda (o la cola) a mano
+    if filas == 1 and modelo._meta.model_name == 'viaje':
+        mapa_demanda.viaje_cerrado(int(solicitud_id), getattr(asignacion.get('conductor'), 'pk', None))
+    elif filas == 1 and modelo._meta.model_name == 'solicitudasistencia':
+        cola_asistencia.retirar(int(solicitud_id))
+    if filas == 1:
+        asignado = next(
+            (asignacion[campo] for campo in ('conductor', 'proveedor', 'repartidor') if campo in asignacion), None
+        )
+        registrar_eventos(
+            tipo_de(modelo), [(int(solicitud_id), 'solicitado', 'aceptado')],
+            {int(solicitud_id): getattr(asignado, 'pk', None)},
+        )
+    return filas == 1
+
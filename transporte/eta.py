@@ -0,0 +1,480 @@
+# transporte/eta.py
+
+import io
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .despacho import TAMANO_CELDA_GRADOS, indice_conductores, conductores_cercanos_a_viaje
+from .ruteo import ruta_vial
+from .tarifas import FACTOR_RUTA
+from .trazas import decodificar_polilinea
+from .ubicaciones import registro_ubicaciones
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+HORAS_SEMANA = 7 * 24
+
+# Velocidad urbana supuesta donde (y cuando) todavía no hay viajes observados
+VELOCIDAD_POR_DEFECTO_KMH = 25.0
+
+# Rango admitido para una velocidad aprendida
+VELOCIDAD_MINIMA_KMH = 5.0
+VELOCIDAD_MAXIMA_KMH = 90.0
+
+# Peso del valor previo, en segundos de conducción "ficticios": una celda-hora
+# con pocos segundos observados se parece más a su zona y a la hora global
+PESO_PREVIO_S = 900.0
+
+# Viajes con duración o velocidad media fuera de estos rangos se descartan (GPS o datos erróneos)
+DURACION_MINIMA_S = 60
+DURACION_MAXIMA_S = 4 * 3600
+DISTANCIA_MINIMA_M = 200.0
+VELOCIDAD_MEDIA_MAXIMA_KMH = 130.0
+
+# Un viaje recién completado espera esto antes de sumarse (su traza termina de compactarse)
+RETRASO_PROCESADO_S = 120
+
+# Viajes leídos por consulta en la actualización incremental
+TAMANO_LOTE_VIAJES = 2000
+
+# Vida de las tablas en memoria; pasado el TTL se relee el perfil de la BD
+TTL_PERFIL_S = 300
+
+# Tramos máximos en que se divide un trayecto al estimar (uno por celda cruzada)
+MAXIMO_TRAMOS = 12
+
+R_TIERRA_M = 6371000.0
+
+
+def hora_semana(fecha):
+    """0..167: lunes 00h es 0. Usa la hora local si USE_TZ está activo."""
+    if settings.USE_TZ and timezone.is_aware(fecha):
+        fecha = timezone.localtime(fecha)
+    return fecha.weekday() * 24 + fecha.hour
+
+
+def _distancias_m(lats, lons):
+    """Distancia haversine (m) entre puntos consecutivos; vectorizada."""
+    lat1, lat2 = np.radians(lats[:-1]), np.radians(lats[1:])
+    dlat = lat2 - lat1
+    dlon = np.radians(lons[1:] - lons[:-1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * R_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _distancia_m(lat1, lon1, lat2, lon2):
+    """Haversine escalar (m) sin numpy: es la ruta caliente de cada estimación."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * R_TIERRA_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+# ----------------------------------------------------------------------
+# 2. Tramos de un Viaje Completado
+# ----------------------------------------------------------------------
+
+def tramos_de_viaje(origen, destino, iniciado_en, finalizado_en, polilinea=''):
+    """
+    Reparte un viaje completado en tramos (celda, hora de la semana, metros,
+    segundos). Con traza se usan sus segmentos desde el punto más cercano al
+    origen (lo anterior es la llegada del conductor a recoger); sin traza, la
+    línea recta por FACTOR_RUTA dividida por celdas. El tiempo se reparte en
+    proporción a la distancia, así que cada tramo cae en la hora en que se
+    recorrió. Devuelve arrays (celdas (m, 2), horas, metros, segundos) o None
+    si el viaje no es plausible.
+    """
+    duracion = (finalizado_en - iniciado_en).total_seconds()
+    if not DURACION_MINIMA_S <= duracion <= DURACION_MAXIMA_S:
+        return None
+
+    puntos = np.asarray(decodificar_polilinea(polilinea) if polilinea else [], dtype=np.float64).reshape(-1, 2)
+    if len(puntos) >= 2:
+        # Distancia equirectangular al origen: basta para elegir el punto más cercano
+        al_origen = np.hypot(puntos[:, 0] - origen[0], (puntos[:, 1] - origen[1]) * math.cos(math.radians(origen[0])))
+        puntos = puntos[int(np.argmin(al_origen)):]
+    if len(puntos) < 2:
+        pasos = max(2, math.ceil(max(abs(destino[0] - origen[0]), abs(destino[1] - origen[1])) / TAMANO_CELDA_GRADOS) + 1)
+        puntos = np.column_stack((np.linspace(origen[0], destino[0], pasos), np.linspace(origen[1], destino[1], pasos)))
+        metros = _distancias_m(puntos[:, 0], puntos[:, 1]) * FACTOR_RUTA
+    else:
+        metros = _distancias_m(puntos[:, 0], puntos[:, 1])
+
+    total = float(metros.sum())
+    if total < DISTANCIA_MINIMA_M or total / duracion * 3.6 > VELOCIDAD_MEDIA_MAXIMA_KMH:
+        return None
+
+    medios = (puntos[:-1] + puntos[1:]) / 2
+    celdas = np.floor(medios / TAMANO_CELDA_GRADOS).astype(np.int64)
+    segundos = duracion * metros / total
+
+    # Hora de la semana en el punto medio de cada tramo
+    inicio = timezone.localtime(iniciado_en) if settings.USE_TZ and timezone.is_aware(iniciado_en) else iniciado_en
+    desfase = inicio.minute * 60 + inicio.second
+    transcurrido = np.cumsum(segundos) - segundos / 2
+    horas = (hora_semana(inicio) + ((desfase + transcurrido) // 3600).astype(np.int64)) % HORAS_SEMANA
+    return celdas, horas, metros, segundos
+
+
+# ----------------------------------------------------------------------
+# 3. Tablas de Velocidad (sumas por zona y hora de la semana)
+# ----------------------------------------------------------------------
+
+class TablasVelocidad:
+    """
+    Sumas de metros, segundos y viajes por (celda, hora de la semana). Son
+    aditivas, así que la actualización incremental solo suma los viajes
+    nuevos. Se serializan con np.savez_compressed (las filas de celdas poco
+    transitadas son casi todo ceros y comprimen muy bien).
+    """
+
+    def __init__(self, celdas=None, metros=None, segundos=None, viajes=None):
+        self.celdas = np.empty((0, 2), dtype=np.int32) if celdas is None else celdas
+        n = len(self.celdas)
+        self.metros = np.zeros((n, HORAS_SEMANA)) if metros is None else metros
+        self.segundos = np.zeros((n, HORAS_SEMANA)) if segundos is None else segundos
+        self.viajes = np.zeros((n, HORAS_SEMANA), dtype=np.uint32) if viajes is None else viajes
+        self._fila_de = {(int(a), int(b)): i for i, (a, b) in enumerate(self.celdas)}
+
+    def __len__(self):
+        return len(self.celdas)
+
+    @classmethod
+    def desde_bytes(cls, datos):
+        if not datos:
+            return cls()
+        with np.load(io.BytesIO(bytes(datos))) as archivo:
+            return cls(archivo['celdas'], archivo['metros'], archivo['segundos'], archivo['viajes'])
+
+    def a_bytes(self):
+        salida = io.BytesIO()
+        np.savez_compressed(
+            salida, celdas=self.celdas, metros=self.metros, segundos=self.segundos, viajes=self.viajes
+        )
+        return salida.getvalue()
+
+    def _filas(self, celdas):
+        """Fila de cada celda, agregando las que faltan (las tablas crecen en bloque)."""
+        claves = [(int(a), int(b)) for a, b in celdas]
+        nuevas = list(dict.fromkeys(c for c in claves if c not in self._fila_de))
+        if nuevas:
+            inicio = len(self.celdas)
+            for desplazamiento, clave in enumerate(nuevas):
+                self._fila_de[clave] = inicio + desplazamiento
+            ceros = np.zeros((len(nuevas), HORAS_SEMANA))
+            self.celdas = np.vstack((self.celdas, np.asarray(nuevas, dtype=np.int32)))
+            self.metros = np.vstack((self.metros, ceros))
+            self.segundos = np.vstack((self.segundos, ceros))
+            self.viajes = np.vstack((self.viajes, ceros.astype(np.uint32)))
+        return np.fromiter((self._fila_de[c] for c in claves), dtype=np.int64, count=len(claves))
+
+    def sumar(self, celdas, horas, metros, segundos):
+        filas = self._filas(celdas)
+        np.add.at(self.metros, (filas, horas), metros)
+        np.add.at(self.segundos, (filas, horas), segundos)
+        # Un viaje cuenta una vez por celda-hora aunque tenga varios tramos en ella
+        unicas = np.unique(np.column_stack((filas, horas)), axis=0)
+        np.add.at(self.viajes, (unicas[:, 0], unicas[:, 1]), 1)
+
+    def compilar(self):
+        """
+        (fila_de, velocidades): velocidades en m/s float32 de forma
+        (celdas + 1, 168); la última fila es el perfil global por hora, que
+        se usa para celdas sin datos (fila -1). Cada celda-hora se suaviza
+        hacia un previo = velocidad global de esa hora × factor de la zona.
+        """
+        defecto = VELOCIDAD_POR_DEFECTO_KMH / 3.6
+        minima, maxima = VELOCIDAD_MINIMA_KMH / 3.6, VELOCIDAD_MAXIMA_KMH / 3.6
+
+        global_hora = (self.metros.sum(axis=0) + PESO_PREVIO_S * defecto) / (self.segundos.sum(axis=0) + PESO_PREVIO_S)
+        global_total = (self.metros.sum() + PESO_PREVIO_S * defecto) / (self.segundos.sum() + PESO_PREVIO_S)
+        zona = (self.metros.sum(axis=1) + PESO_PREVIO_S * global_total) / (self.segundos.sum(axis=1) + PESO_PREVIO_S)
+        previo = global_hora[np.newaxis, :] * (zona / global_total)[:, np.newaxis]
+
+        velocidades = (self.metros + PESO_PREVIO_S * previo) / (self.segundos + PESO_PREVIO_S)
+        velocidades = np.vstack((velocidades, global_hora[np.newaxis, :]))
+        return dict(self._fila_de), np.clip(velocidades, minima, maxima).astype(np.float32)
+
+
+# ----------------------------------------------------------------------
+# 4. Actualización Incremental (programada)
+# ----------------------------------------------------------------------
+
+def actualizar_perfiles(maximo_viajes=None):
+    """
+    Suma al perfil los viajes completados después de la marca de agua
+    ('procesado_hasta', 'ultimo_viaje'), en orden y por lotes, usando el
+    índice (estado, finalizado_en, id): nunca relee el historial. La fila del
+    perfil se bloquea para que dos ejecuciones simultáneas no sumen dos veces.
+    Devuelve {'viajes', 'descartados', 'celdas', 'tiempo_ms'}.
+    """
+    from .models import Viaje, TrazaViaje, PerfilVelocidades
+
+    t0 = time.perf_counter()
+    limite = timezone.now() - timedelta(seconds=RETRASO_PROCESADO_S)
+    procesados = descartados = 0
+
+    with transaction.atomic():
+        PerfilVelocidades.objects.get_or_create(pk=1)
+        perfil = PerfilVelocidades.objects.select_for_update().get(pk=1)
+        tablas = TablasVelocidad.desde_bytes(perfil.tablas)
+
+        while maximo_viajes is None or procesados + descartados < maximo_viajes:
+            nuevos = Viaje.objects.filter(estado='completado', finalizado_en__lte=limite)
+            if perfil.procesado_hasta is not None:
+                nuevos = nuevos.filter(
+                    Q(finalizado_en__gt=perfil.procesado_hasta)
+                    | Q(finalizado_en=perfil.procesado_hasta, id__gt=perfil.ultimo_viaje)
+                )
+            tamano = TAMANO_LOTE_VIAJES
+            if maximo_viajes is not None:
+                tamano = min(tamano, maximo_viajes - procesados - descartados)
+            lote = list(
+                nuevos.order_by('finalizado_en', 'id').values_list(
+                    'id', 'origen_lat', 'origen_lon', 'destino_lat', 'destino_lon', 'iniciado_en', 'finalizado_en'
+                )[:tamano]
+            )
+            if not lote:
+                break
+
+            trazas = dict(
+                TrazaViaje.objects.filter(viaje_id__in=[fila[0] for fila in lote]).values_list('viaje_id', 'polilinea')
+            )
+            for viaje_id, o_lat, o_lon, d_lat, d_lon, iniciado_en, finalizado_en in lote:
+                tramos = None
+                if iniciado_en is not None:
+                    tramos = tramos_de_viaje(
+                        (float(o_lat), float(o_lon)), (float(d_lat), float(d_lon)),
+                        iniciado_en, finalizado_en, trazas.get(viaje_id, ''),
+                    )
+                if tramos is None:
+                    descartados += 1
+                    continue
+                tablas.sumar(*tramos)
+                procesados += 1
+
+            perfil.procesado_hasta, perfil.ultimo_viaje = lote[-1][6], lote[-1][0]
+
+        perfil.tablas = tablas.a_bytes()
+        perfil.viajes_procesados += procesados
+        perfil.save()
+
+    estimador_eta.invalidar()
+    return {
+        'viajes': procesados,
+        'descartados': descartados,
+        'celdas': len(tablas),
+        'tiempo_ms': round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+
+# ----------------------------------------------------------------------
+# 5. Estimador de ETA
+# ----------------------------------------------------------------------
+
+class EstimadorETA:
+    """
+    Tablas de velocidad compiladas en memoria: un dict celda -> fila y un
+    array float32 (celdas + 1, 168). Estimar un trayecto lo divide en
+    tramos de una celda, busca la velocidad de cada tramo en su zona y hora
+    y suma los tiempos: unas decenas de operaciones en Python puro, sin
+    consultas ni numpy en la ruta caliente. Las tablas se releen de la BD
+    pasado el TTL o al actualizarse en este proceso.
+    """
+
+    def __init__(self, ttl=TTL_PERFIL_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = None
+        self._construido_en = 0.0
+
+    def invalidar(self):
+        self._datos = None
+
+    def _obtener(self):
+        datos = self._datos
+        if datos is not None and time.monotonic() - self._construido_en < self.ttl:
+            return datos
+
+        with self._lock:
+            if self._datos is None or time.monotonic() - self._construido_en >= self.ttl:
+                self._datos = self._construir()
+                self._construido_en = time.monotonic()
+            return self._datos
+
+    @staticmethod
+    def _construir():
+        from .models import PerfilVelocidades
+
+        blob = PerfilVelocidades.objects.filter(pk=1).values_list('tablas', flat=True).first()
+        try:
+            tablas = TablasVelocidad.desde_bytes(blob)
+        except (ValueError, KeyError, OSError):
+            logger.exception("Perfil de velocidades ilegible; se usan las velocidades por defecto.")
+            tablas = TablasVelocidad()
+        return tablas.compilar()
+
+    def velocidad_kmh(self, lat, lon, hora):
+        """Velocidad aprendida (km/h) en la zona del punto a esa hora de la semana."""
+        fila_de, velocidades = self._obtener()
+        celda = (math.floor(float(lat) / TAMANO_CELDA_GRADOS), math.floor(float(lon) / TAMANO_CELDA_GRADOS))
+        return float(velocidades[fila_de.get(celda, -1), hora]) * 3.6
+
+    def segundos(self, o_lat, o_lon, d_lat, d_lon, hora=None):
+        """
+        Tiempo estimado (s) entre dos puntos saliendo a la hora de la semana
+        'hora' (por defecto, ahora). Con red vial (transporte/ruteo.py) se
+        sigue el trazado por carretera; sin ella, o si no hay camino, la
+        línea recta por FACTOR_RUTA.
+        """
+        fila_de, velocidades = self._obtener()
+        if hora is None:
+            hora = hora_semana(timezone.now())
+        o_lat, o_lon, d_lat, d_lon = float(o_lat), float(o_lon), float(d_lat), float(d_lon)
+
+        ruta = ruta_vial(o_lat, o_lon, d_lat, d_lon)
+        if ruta is not None and len(ruta['puntos']) > 1:
+            return self._segundos_por_trazado(ruta, fila_de, velocidades, hora)
+
+        metros = _distancia_m(o_lat, o_lon, d_lat, d_lon) * FACTOR_RUTA
+        tramos = min(MAXIMO_TRAMOS, max(1, math.ceil(max(abs(d_lat - o_lat), abs(d_lon - o_lon)) / TAMANO_CELDA_GRADOS)))
+        por_tramo = metros / tramos
+        paso_lat, paso_lon = (d_lat - o_lat) / tramos, (d_lon - o_lon) / tramos
+
+        total = 0.0
+        for i in range(tramos):
+            lat = o_lat + paso_lat * (i + 0.5)
+            lon = o_lon + paso_lon * (i + 0.5)
+            fila = fila_de.get((math.floor(lat / TAMANO_CELDA_GRADOS), math.floor(lon / TAMANO_CELDA_GRADOS)), -1)
+            total += por_tramo / velocidades[fila, hora]
+        return float(total)
+
+    @staticmethod
+    def _segundos_por_trazado(ruta, fila_de, velocidades, hora):
+        # Cada segmento del trazado va a la velocidad de la zona de su punto medio; los
+        # metros se escalan a los de la ruta (los extremos se ajustan al nodo más cercano)
+        puntos = ruta['puntos']
+        segmentos = [
+            (_distancia_m(a_lat, a_lon, b_lat, b_lon), (a_lat + b_lat) / 2, (a_lon + b_lon) / 2)
+            for (a_lat, a_lon), (b_lat, b_lon) in zip(puntos[:-1], puntos[1:])
+        ]
+        suma = sum(metros for metros, _, _ in segmentos)
+        if suma <= 0:
+            return 0.0
+        escala = ruta['metros'] / suma
+
+        total = 0.0
+        for metros, lat, lon in segmentos:
+            fila = fila_de.get((math.floor(lat / TAMANO_CELDA_GRADOS), math.floor(lon / TAMANO_CELDA_GRADOS)), -1)
+            total += metros * escala / velocidades[fila, hora]
+        return float(total)
+
+    def resumen(self):
+        fila_de, velocidades = self._obtener()
+        return {
+            'celdas': len(fila_de),
+            'velocidad_global_kmh': round(float(velocidades[-1].mean()) * 3.6, 1),
+        }
+
+
+# Estimador único por proceso
+estimador_eta = EstimadorETA()
+
+
+# ----------------------------------------------------------------------
+# 6. ETA de Viajes y Pedidos
+# ----------------------------------------------------------------------
+
+def posicion_conductor(conductor_id, conductor=None):
+    """(lat, lon) más reciente del conductor: buffer de pings, índice de despacho o último guardado."""
+    ultima = registro_ubicaciones.ultima(conductor_id)
+    if ultima is not None:
+        return ultima[1], ultima[2]
+    posicion = indice_conductores.posicion(conductor_id)
+    if posicion is not None:
+        return posicion
+    if conductor is not None and conductor.latitud is not None and conductor.longitud is not None:
+        return float(conductor.latitud), float(conductor.longitud)
+    return None
+
+
+def _resultado(recogida_s, entrega_s):
+    ahora = timezone.now()
+    return {
+        'recogida_s': round(recogida_s) if recogida_s is not None else None,
+        'entrega_s': round(entrega_s) if entrega_s is not None else None,
+        'recogida_en': (ahora + timedelta(seconds=recogida_s)).isoformat() if recogida_s is not None else None,
+        'entrega_en': (ahora + timedelta(seconds=entrega_s)).isoformat() if entrega_s is not None else None,
+    }
+
+
+def eta_viaje(viaje):
+    """
+    {'recogida_s', 'entrega_s', 'recogida_en', 'entrega_en'} de un Viaje:
+    - 'solicitado': desde el conductor compatible disponible más cercano.
+    - 'aceptado' / 'en_ruta_origen': desde la posición del conductor asignado.
+    - 'en_curso': solo la entrega, desde la posición del conductor.
+    None si el viaje ya terminó o no se conoce la posición de ningún conductor.
+    """
+    origen = (viaje.origen_lat, viaje.origen_lon)
+    destino = (viaje.destino_lat, viaje.destino_lon)
+    hora = hora_semana(timezone.now())
+
+    if viaje.estado == 'en_curso':
+        posicion = posicion_conductor(viaje.conductor_id, viaje.conductor)
+        if posicion is None:
+            return None
+        return _resultado(None, estimador_eta.segundos(*posicion, *destino, hora))
+
+    if viaje.estado == 'solicitado':
+        cercanos = conductores_cercanos_a_viaje(viaje, k=1)
+        posicion = indice_conductores.posicion(cercanos[0][0]) if cercanos else None
+    elif viaje.estado in ('aceptado', 'en_ruta_origen'):
+        posicion = posicion_conductor(viaje.conductor_id, viaje.conductor)
+    else:
+        return None
+    if posicion is None:
+        return None
+
+    recogida = estimador_eta.segundos(*posicion, *origen, hora)
+    llegada = timezone.now() + timedelta(seconds=recogida)
+    return _resultado(recogida, recogida + estimador_eta.segundos(*origen, *destino, hora_semana(llegada)))
+
+
+def eta_pedido(pedido):
+    """
+    ETA de un Pedido de domicilios: recogida en el comercio y entrega al
+    cliente desde la posición del repartidor. Sin repartidor asignado solo
+    se estima el tramo comercio -> entrega. None si ya se entregó o canceló.
+    """
+    comercio = pedido.comercio
+    recogida_punto = (comercio.latitud, comercio.longitud)
+    entrega_punto = (pedido.lat_entrega, pedido.lon_entrega)
+    hora = hora_semana(timezone.now())
+
+    if pedido.estado in ('entregado', 'cancelado'):
+        return None
+
+    posicion = posicion_conductor(pedido.repartidor_id, pedido.repartidor) if pedido.repartidor_id else None
+    if pedido.estado == 'en_camino':
+        if posicion is None:
+            return None
+        return _resultado(None, estimador_eta.segundos(*posicion, *entrega_punto, hora))
+
+    if posicion is None:
+        return _resultado(None, estimador_eta.segundos(*recogida_punto, *entrega_punto, hora))
+    recogida = estimador_eta.segundos(*posicion, *recogida_punto, hora)
+    llegada = timezone.now() + timedelta(seconds=recogida)
+    return _resultado(recogida, recogida + estimador_eta.segundos(*recogida_punto, *entrega_punto, hora_semana(llegada)))
@@ -1,6 +1,7 @@
 # transporte/forms.py
 from django import forms
 from .models import Viaje, Vehiculo, SolicitudAsistencia,MensajeViaje
+from .geocercas import exigir_cobertura
 
 
 # ----------------------------------------------------------------------
@@ -92,6 +93,11 @@ class AsistenciaSolicitudForm(forms.ModelForm):
             'descripcion': forms.Textarea(attrs={'rows': 3, 'placeholder': 'Detalla qué pasó (Ej: Se me estalló una llanta)'}),
         }
 
+    def clean(self):
+        datos = super().clean()
+        exigir_cobertura({'ubicacion_lat': (datos.get('ubicacion_lat'), datos.get('ubicacion_lon'))})
+        return datos
+
 # ----------------------------------------------------------------------
 # 2. Formularios para Conductores (Gestión de Vehículos)
 # ----------------------------------------------------------------------
@@ -0,0 +1,258 @@
+# transporte/geocercas.py
+
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Vida máxima del índice. Los cambios hechos en ESTE proceso lo invalidan al
+# instante; el TTL cubre los cambios hechos por otros procesos/workers.
+TTL_INDICE_S = 60
+
+# Hijos por nodo del R-tree
+CAPACIDAD_NODO = 8
+
+MENSAJE_FUERA_DE_ZONA = "La ubicación está fuera de nuestras zonas de servicio."
+
+
+def validar_poligono(poligono):
+    """Lanza ValidationError si 'poligono' no es una lista de al menos 3 vértices [lat, lon] válidos."""
+    try:
+        vertices = [(float(lat), float(lon)) for lat, lon in poligono]
+    except (TypeError, ValueError):
+        raise ValidationError({'poligono': "Debe ser una lista de vértices [lat, lon]."})
+    if len(vertices) < 3:
+        raise ValidationError({'poligono': "Un polígono necesita al menos 3 vértices."})
+    if not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in vertices):
+        raise ValidationError({'poligono': "Hay vértices con coordenadas fuera de rango."})
+    return vertices
+
+
+# ----------------------------------------------------------------------
+# 2. Punto en Polígono
+# ----------------------------------------------------------------------
+
+def compilar_poligono(vertices):
+    """
+    Precalcula por arista lo que la prueba del rayo necesita: vértice,
+    latitud del vértice anterior y pendiente lon/lat. Así validar un punto
+    son unas pocas operaciones vectorizadas, sin np.roll ni divisiones.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    lats, lons = vertices[:, 0].copy(), vertices[:, 1].copy()
+    lats_previas, lons_previas = np.roll(lats, 1), np.roll(lons, 1)
+    alto = lats_previas - lats
+    # Las aristas horizontales nunca cruzan el rayo (ver punto_en_poligono): su pendiente no importa
+    pendientes = np.divide(lons_previas - lons, alto, out=np.zeros_like(alto), where=alto != 0)
+    return lats, lons, lats_previas, pendientes
+
+
+def punto_en_poligono(lat, lon, poligono):
+    """
+    Prueba del rayo (par-impar) vectorizada sobre un polígono compilado:
+    cuenta cuántas aristas cruza un rayo horizontal hacia el este del punto.
+    """
+    lats, lons, lats_previas, pendientes = poligono
+    cruza = (lats > lat) != (lats_previas > lat)
+    lon_cruce = lons + (lat - lats) * pendientes
+    return bool(np.count_nonzero(cruza & (lon < lon_cruce)) & 1)
+
+
+# ----------------------------------------------------------------------
+# 3. R-tree Estático (empaquetado Sort-Tile-Recursive)
+# ----------------------------------------------------------------------
+
+def _orden_str(cajas, capacidad):
+    """Orden STR de las cajas: franjas verticales por longitud y, dentro de cada una, por latitud."""
+    n = len(cajas)
+    centros_lat = (cajas[:, 0] + cajas[:, 2]) / 2
+    centros_lon = (cajas[:, 1] + cajas[:, 3]) / 2
+    hojas = math.ceil(n / capacidad)
+    franjas = max(1, math.ceil(math.sqrt(hojas)))
+    por_franja = capacidad * math.ceil(hojas / franjas)
+
+    orden = np.argsort(centros_lon, kind='stable')
+    for inicio in range(0, n, por_franja):
+        tramo = orden[inicio:inicio + por_franja]
+        orden[inicio:inicio + por_franja] = tramo[np.argsort(centros_lat[tramo], kind='stable')]
+    return orden
+
+
+class ArbolRectangulos:
+    """
+    R-tree de solo lectura sobre cajas [lat_min, lon_min, lat_max, lon_max].
+
+    Se construye de una vez (las zonas cambian muy poco) empaquetando las
+    cajas con STR, así que los hijos de cada nodo son un tramo contiguo del
+    nivel inferior y el árbol entero son unos pocos arrays de numpy. Una
+    consulta desciende solo por los nodos cuya caja contiene el punto.
+    """
+
+    def __init__(self, cajas, capacidad=CAPACIDAD_NODO):
+        self.capacidad = capacidad
+        cajas = np.asarray(cajas, dtype=np.float64).reshape(-1, 4)
+        self.ids = _orden_str(cajas, capacidad) if len(cajas) else np.empty(0, dtype=np.int64)
+
+        # Niveles de la raíz a las hojas; el último guarda las cajas originales en orden STR
+        nivel = cajas[self.ids]
+        self.niveles = [nivel]
+        while len(nivel) > capacidad:
+            grupos = np.arange(0, len(nivel), capacidad)
+            nivel = np.column_stack((
+                np.minimum.reduceat(nivel[:, 0], grupos),
+                np.minimum.reduceat(nivel[:, 1], grupos),
+                np.maximum.reduceat(nivel[:, 2], grupos),
+                np.maximum.reduceat(nivel[:, 3], grupos),
+            ))
+            self.niveles.append(nivel)
+        self.niveles.reverse()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def consultar(self, lat, lon):
+        """Índices (en el orden original) de las cajas que contienen el punto."""
+        if not len(self.ids):
+            return self.ids
+        punto = np.array((lat, lon))
+        ultimo = len(self.niveles) - 1
+        candidatos = np.arange(len(self.niveles[0]))
+        for profundidad, nivel in enumerate(self.niveles):
+            cajas = nivel[candidatos]
+            candidatos = candidatos[((cajas[:, :2] <= punto) & (punto <= cajas[:, 2:])).all(axis=1)]
+            if profundidad == ultimo:
+                return self.ids[candidatos]
+            # Hijos de cada nodo que pasó el filtro: tramo contiguo del nivel siguiente
+            hijos = (candidatos[:, np.newaxis] * self.capacidad + np.arange(self.capacidad)).ravel()
+            candidatos = hijos[hijos < len(self.niveles[profundidad + 1])]
+
+
+# ----------------------------------------------------------------------
+# 4. Índice de Zonas de Servicio
+# ----------------------------------------------------------------------
+
+class IndiceGeocercas:
+    """
+    Zonas de servicio activas compiladas en memoria: vértices en arrays de
+    numpy, una caja global y un R-tree de cajas. Validar un punto cuesta un
+    descarte por caja global, un descenso por el árbol y la prueba del rayo
+    solo en los polígonos cuya caja contiene el punto (normalmente uno).
+    Se reconstruye de forma perezosa tras un cambio.
+    """
+
+    def __init__(self, ttl=TTL_INDICE_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = None
+        self._construido_en = 0.0
+
+    def invalidar(self):
+        self._datos = None
+
+    def _obtener(self):
+        datos = self._datos
+        if datos is not None and time.monotonic() - self._construido_en < self.ttl:
+            return datos
+
+        with self._lock:
+            if self._datos is None or time.monotonic() - self._construido_en >= self.ttl:
+                self._datos = self._construir()
+                self._construido_en = time.monotonic()
+            return self._datos
+
+    @staticmethod
+    def _construir():
+        from .models import ZonaServicio
+
+        zonas = []
+        for zona_id, nombre, poligono in ZonaServicio.objects.filter(activa=True).values_list('id', 'nombre', 'poligono'):
+            try:
+                compilado = compilar_poligono(validar_poligono(poligono))
+            except ValidationError:
+                logger.warning("Zona de servicio %s con polígono inválido; se ignora.", zona_id)
+                continue
+            zonas.append((zona_id, nombre, compilado))
+
+        cajas = np.array(
+            [(lats.min(), lons.min(), lats.max(), lons.max()) for _, _, (lats, lons, _, _) in zonas],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        caja_global = (
+            (cajas[:, 0].min(), cajas[:, 1].min(), cajas[:, 2].max(), cajas[:, 3].max()) if len(zonas) else None
+        )
+        return {'zonas': zonas, 'arbol': ArbolRectangulos(cajas), 'caja_global': caja_global}
+
+    def __len__(self):
+        return len(self._obtener()['zonas'])
+
+    def zona_de(self, lat, lon):
+        """(zona_id, nombre) de la primera zona que contiene el punto, o None."""
+        datos = self._obtener()
+        caja = datos['caja_global']
+        lat, lon = float(lat), float(lon)
+        if caja is None or not (caja[0] <= lat <= caja[2] and caja[1] <= lon <= caja[3]):
+            return None
+        for indice in datos['arbol'].consultar(lat, lon):
+            zona_id, nombre, poligono = datos['zonas'][indice]
+            if punto_en_poligono(lat, lon, poligono):
+                return zona_id, nombre
+        return None
+
+    def cubre(self, lat, lon):
+        """True si el punto está en alguna zona activa (o si no hay zonas configuradas)."""
+        if not self._obtener()['zonas']:
+            return True
+        return self.zona_de(lat, lon) is not None
+
+
+indice_geocercas = IndiceGeocercas()
+
+
+def exigir_cobertura(puntos):
+    """
+    Valida {campo: (lat, lon)} contra las zonas de servicio y lanza un único
+    ValidationError con los campos que quedan fuera. Sirve igual en
+    formularios y en serializadores de DRF. Se omiten puntos incompletos.
+    """
+    errores = {
+        campo: MENSAJE_FUERA_DE_ZONA
+        for campo, (lat, lon) in puntos.items()
+        if lat is not None and lon is not None and not indice_geocercas.cubre(lat, lon)
+    }
+    if errores:
+        raise ValidationError(errores)
+
+
+def punto_enviado(attrs, instancia, campo_lat, campo_lon):
+    """
+    (lat, lon) de un punto para exigir_cobertura. En una actualización
+    parcial la coordenada que no se envió se toma de 'instancia'; si no se
+    envió ninguna, (None, None) y el punto no se vuelve a validar.
+    """
+    if campo_lat not in attrs and campo_lon not in attrs:
+        return None, None
+    return tuple(
+        attrs[campo] if campo in attrs else getattr(instancia, campo, None)
+        for campo in (campo_lat, campo_lon)
+    )
+
+
+# ----------------------------------------------------------------------
+# 5. Invalidación al Cambiar una Zona
+# ----------------------------------------------------------------------
+
+@receiver(post_save, sender='transporte.ZonaServicio')
+@receiver(post_delete, sender='transporte.ZonaServicio')
+def invalidar_indice_geocercas(sender, **kwargs):
+    indice_geocercas.invalidar()
@@ -0,0 +1,52 @@
+# transporte/management/commands/actualizar_velocidades.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from transporte.eta import actualizar_perfiles, estimador_eta
+
+
+class Command(BaseCommand):
+    help = (
+        "Suma a los perfiles de velocidad (zona x hora de la semana) los viajes completados "
+        "desde la última pasada. Pensado para cron o para dejarlo corriendo con --intervalo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=900.0, help="Segundos entre pasadas.")
+        parser.add_argument('--maximo', type=int, default=None, help="Viajes máximos por pasada.")
+        parser.add_argument('--una-vez', action='store_true', help="Ejecuta una sola pasada y termina.")
+        parser.add_argument('--probar', type=int, default=0, help="Mide N estimaciones de ETA tras la pasada.")
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo']
+
+        while True:
+            inicio = time.monotonic()
+            resultado = actualizar_perfiles(options['maximo'])
+            self.stdout.write(
+                f"{resultado['viajes']} viajes sumados ({resultado['descartados']} descartados), "
+                f"{resultado['celdas']} celdas, {resultado['tiempo_ms']:.1f} ms"
+            )
+            if options['probar']:
+                self._probar(options['probar'])
+            if options['una_vez']:
+                return
+            time.sleep(max(0.0, intervalo - (time.monotonic() - inicio)))
+
+    def _probar(self, n):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        # Trayectos al azar en la misma región que benchmark_asignacion (Caracas)
+        puntos = np.column_stack((10.48 + rng.uniform(-0.15, 0.15, (n, 1)), -66.90 + rng.uniform(-0.15, 0.15, (n, 1)),
+                                  10.48 + rng.uniform(-0.15, 0.15, (n, 1)), -66.90 + rng.uniform(-0.15, 0.15, (n, 1))))
+        horas = rng.integers(0, 168, n)
+        estimador_eta.segundos(*puntos[0], int(horas[0]))  # Carga las tablas fuera de la medición
+
+        t0 = time.perf_counter()
+        for fila, hora in zip(puntos.tolist(), horas.tolist()):
+            estimador_eta.segundos(*fila, hora)
+        por_consulta = (time.perf_counter() - t0) / n * 1e6
+        self.stdout.write(f"{n} estimaciones: {por_consulta:.1f} µs por consulta")
@@ -0,0 +1,34 @@
+# transporte/management/commands/asignar_viajes.py
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from transporte.asignacion import ejecutar_ronda, metricas_asignacion, VENTANA_S
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta el motor de asignación por lotes: cada ventana agrupa los viajes "
+        "'solicitado' y los conductores libres y los asigna minimizando la distancia total de recogida."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ventana', type=float, default=VENTANA_S, help="Segundos entre rondas.")
+        parser.add_argument('--una-vez', action='store_true', help="Ejecuta una sola ronda y termina.")
+
+    def handle(self, *args, **options):
+        ventana = options['ventana']
+
+        while True:
+            inicio = time.monotonic()
+            # En un proceso aparte el índice en memoria está vacío: se usan las posiciones guardadas
+            asignados = ejecutar_ronda(desde_bd=True)
+            ronda = metricas_asignacion.resumen()['ultima_ronda']
+            self.stdout.write(
+                f"{ronda['viajes']} viajes, {ronda['conductores']} conductores -> "
+                f"{len(asignados)} asignados en {ronda['total_ms']:.1f} ms"
+            )
+            if options['una_vez']:
+                return
+            time.sleep(max(0.0, ventana - (time.monotonic() - inicio)))
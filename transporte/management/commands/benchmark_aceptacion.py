@@ -0,0 +1,96 @@
+# transporte/management/commands/benchmark_aceptacion.py
+
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from transporte.despacho import reclamar_solicitud
+from transporte.models import Vehiculo, Viaje
+from usuarios.models import UsuarioPersonalizado
+
+
+class Command(BaseCommand):
+    help = (
+        "Lanza muchos hilos que intentan aceptar el MISMO viaje a la vez y verifica "
+        "que exactamente uno gane. Crea datos temporales y los borra al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=32, help="Conductores compitiendo por cada viaje.")
+        parser.add_argument('--rondas', type=int, default=20, help="Cantidad de viajes disputados.")
+
+    def handle(self, *args, **options):
+        hilos = options['hilos']
+        rondas = options['rondas']
+        prefijo = f"bench_{uuid.uuid4().hex[:8]}"
+
+        cliente = UsuarioPersonalizado.objects.create_user(username=f"{prefijo}_cliente", rol='cliente')
+        conductores = [
+            UsuarioPersonalizado.objects.create_user(
+                username=f"{prefijo}_c{i}", rol='conductor', disponible=True
+            )
+            for i in range(hilos)
+        ]
+        vehiculos = [
+            Vehiculo.objects.create(
+                conductor=c, tipo='auto', modelo='Bench', placa=f"{prefijo[-4:]}{i:04d}"[:10], aprobado=True
+            )
+            for i, c in enumerate(conductores)
+        ]
+
+        try:
+            errores = []
+            latencias = []
+            for ronda in range(rondas):
+                viaje = Viaje.objects.create(
+                    cliente=cliente, origen_lat=10.48, origen_lon=-66.90, destino_lat=10.50, destino_lon=-66.85
+                )
+                ganadores = self._disputar(viaje.pk, conductores, vehiculos, latencias)
+
+                viaje.refresh_from_db()
+                if len(ganadores) != 1 or viaje.conductor_id != ganadores[0]:
+                    errores.append((viaje.pk, ganadores, viaje.conductor_id))
+
+            latencias.sort()
+            p50 = latencias[len(latencias) // 2] * 1000
+            p99 = latencias[int(len(latencias) * 0.99) - 1] * 1000
+            self.stdout.write(f"Motor de BD       : {connection.vendor}")
+            self.stdout.write(f"Viajes disputados : {rondas} x {hilos} hilos ({len(latencias)} intentos)")
+            self.stdout.write(f"Latencia intento  : p50 {p50:.2f} ms | p99 {p99:.2f} ms")
+
+            if errores:
+                raise CommandError(f"Aceptaciones inconsistentes (viaje, ganadores, conductor): {errores}")
+            self.stdout.write(self.style.SUCCESS("OK: cada viaje fue aceptado exactamente una vez."))
+        finally:
+            Viaje.objects.filter(cliente=cliente).delete()
+            UsuarioPersonalizado.objects.filter(username__startswith=prefijo).delete()
+
+    def _disputar(self, viaje_id, conductores, vehiculos, latencias):
+        """Todos los hilos esperan en una barrera y luego intentan el UPDATE condicional a la vez."""
+        barrera = threading.Barrier(len(conductores))
+        ganadores = []
+        lock = threading.Lock()
+
+        def intentar(conductor, vehiculo):
+            try:
+                barrera.wait()
+                inicio = time.perf_counter()
+                gano = reclamar_solicitud(Viaje, viaje_id, conductor=conductor, vehiculo_usado=vehiculo)
+                with lock:
+                    latencias.append(time.perf_counter() - inicio)
+                    if gano:
+                        ganadores.append(conductor.pk)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=intentar, args=(c, v)) for c, v in zip(conductores, vehiculos)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return ganadores
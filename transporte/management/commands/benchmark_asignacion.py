@@ -0,0 +1,53 @@
+# transporte/management/commands/benchmark_asignacion.py
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from transporte.asignacion import (
+    construir_matriz_costos,
+    resolver_asignacion,
+    VENTANA_S,
+)
+
+
+class Command(BaseCommand):
+    help = "Mide el tiempo del motor de asignación (matriz + húngaro) con N viajes x N conductores sintéticos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--n', type=int, default=2000, help="Viajes y conductores por ronda.")
+        parser.add_argument('--repeticiones', type=int, default=3)
+
+    def handle(self, *args, **options):
+        n = options['n']
+        rng = np.random.default_rng(0)
+        tipos_servicio = [{'auto'}, {'moto'}]
+
+        for repeticion in range(options['repeticiones']):
+            v_lat = 10.48 + rng.uniform(-0.15, 0.15, n)
+            v_lon = -66.90 + rng.uniform(-0.15, 0.15, n)
+            c_lat = 10.48 + rng.uniform(-0.15, 0.15, n)
+            c_lon = -66.90 + rng.uniform(-0.15, 0.15, n)
+            v_tipos = [tipos_servicio[i] for i in rng.integers(0, 2, n)]
+            c_tipos = [tipos_servicio[i] for i in rng.integers(0, 2, n)]
+
+            inicio = time.perf_counter()
+            costos = construir_matriz_costos(v_lat, v_lon, v_tipos, c_lat, c_lon, c_tipos)
+            t_matriz = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            pares = resolver_asignacion(costos)
+            t_resolver = time.perf_counter() - inicio
+
+            total = t_matriz + t_resolver
+            media = np.mean([c for _, _, c in pares]) if pares else 0.0
+            self.stdout.write(
+                f"[{repeticion + 1}] {n}x{n}: matriz {t_matriz * 1000:.1f} ms | "
+                f"húngaro {t_resolver * 1000:.1f} ms | {len(pares)} asignados | "
+                f"recogida media {media:.2f} km"
+            )
+            if total > VENTANA_S:
+                self.stdout.write(self.style.WARNING(f"  La ronda ({total:.2f} s) excede la ventana de {VENTANA_S} s."))
+
+        self.stdout.write(self.style.SUCCESS("Benchmark completado."))
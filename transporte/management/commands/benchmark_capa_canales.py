@@ -0,0 +1,162 @@
+# transporte/management/commands/benchmark_capa_canales.py
+
+import asyncio
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from SuperService.capa_canales import CapaSocketsUnix
+
+GRUPO = 'bench'
+
+
+async def _consumir(capa, canal, mensajes, latencias, limite):
+    """Recibe hasta 'mensajes' mensajes y anota la latencia envío -> recepción de cada uno."""
+    for _ in range(mensajes):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return
+        try:
+            mensaje = await asyncio.wait_for(capa.receive(canal), restante)
+        except asyncio.TimeoutError:
+            return
+        latencias.append(time.monotonic() - mensaje['t'])
+
+
+async def _publicar(capa, mensajes, tamano, intervalo):
+    carga = 'x' * tamano
+    for i in range(mensajes):
+        # time.monotonic() es el mismo reloj para todos los procesos del host
+        await capa.group_send(GRUPO, {'type': 'bench', 'i': i, 't': time.monotonic(), 'carga': carga})
+        await asyncio.sleep(intervalo)
+
+
+def _trabajador(directorio, miembros, mensajes, espera_s, listos, resultados):
+    """Proceso hijo: une 'miembros' canales al grupo y mide lo que recibe."""
+    async def principal():
+        capa = CapaSocketsUnix(directorio=directorio, capacity=mensajes + 1)
+        canales = [await capa.new_channel() for _ in range(miembros)]
+        for canal in canales:
+            await capa.group_add(GRUPO, canal)
+        listos.put(capa.id)
+
+        latencias = []
+        limite = time.monotonic() + espera_s
+        await asyncio.gather(*(_consumir(capa, canal, mensajes, latencias, limite) for canal in canales))
+        resultados.put((time.monotonic(), latencias, capa.descartados))
+
+    asyncio.run(principal())
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la capa de canales por sockets Unix (varios procesos) con la capa "
+        "en memoria (un proceso): mensajes entregados por segundo y latencia de "
+        "reparto de group_send. No toca la base de datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=4, help="Procesos con miembros del grupo.")
+        parser.add_argument('--miembros', type=int, default=50, help="Canales unidos al grupo por proceso.")
+        parser.add_argument('--mensajes', type=int, default=2000, help="Cantidad de group_send.")
+        parser.add_argument('--tamano', type=int, default=200, help="Bytes de carga por mensaje.")
+        parser.add_argument(
+            '--intervalo', type=float, default=0.0,
+            help="Pausa entre group_send (ms). Con 0 se mide en ráfaga (rendimiento); con >0, la latencia sin cola.",
+        )
+        parser.add_argument('--espera', type=float, default=60.0, help="Tiempo máximo de cada medición (s).")
+
+    def handle(self, *args, **options):
+        procesos = options['procesos']
+        miembros = options['miembros']
+        mensajes = options['mensajes']
+        self.stdout.write(
+            f"{mensajes} group_send de {options['tamano']} bytes a {procesos * miembros} canales "
+            f"({procesos} x {miembros})"
+        )
+
+        entregas, duracion, latencias = asyncio.run(self._medir_en_memoria(options))
+        self._informar("En memoria (1 proceso)", entregas, duracion, latencias, procesos * miembros * mensajes)
+
+        entregas, duracion, latencias = self._medir_sockets(options)
+        self._informar(f"Sockets Unix ({procesos} procesos)", entregas, duracion, latencias, procesos * miembros * mensajes)
+
+    async def _medir_en_memoria(self, options):
+        mensajes = options['mensajes']
+        capa = InMemoryChannelLayer(capacity=mensajes + 1)
+        canales = [await capa.new_channel() for _ in range(options['procesos'] * options['miembros'])]
+        for canal in canales:
+            await capa.group_add(GRUPO, canal)
+
+        latencias = []
+        limite = time.monotonic() + options['espera']
+        consumidores = [asyncio.create_task(_consumir(capa, canal, mensajes, latencias, limite)) for canal in canales]
+        inicio = time.monotonic()
+        await _publicar(capa, mensajes, options['tamano'], options['intervalo'] / 1000)
+        await asyncio.gather(*consumidores)
+        return len(latencias), time.monotonic() - inicio, latencias
+
+    def _medir_sockets(self, options):
+        procesos = options['procesos']
+        directorio = tempfile.mkdtemp(prefix='canales-')
+        contexto = multiprocessing.get_context('fork')
+        listos, resultados = contexto.Queue(), contexto.Queue()
+        hijos = [
+            contexto.Process(
+                target=_trabajador,
+                args=(directorio, options['miembros'], options['mensajes'], options['espera'], listos, resultados),
+            )
+            for _ in range(procesos)
+        ]
+        try:
+            for hijo in hijos:
+                hijo.start()
+            for _ in hijos:
+                listos.get(timeout=30)
+            return asyncio.run(self._publicar_sockets(directorio, procesos, resultados, options))
+        except queue.Empty:
+            raise CommandError("Los procesos de prueba no respondieron a tiempo.")
+        finally:
+            for hijo in hijos:
+                hijo.join(timeout=5)
+                if hijo.is_alive():
+                    hijo.terminate()
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    async def _publicar_sockets(self, directorio, procesos, resultados, options):
+        capa = CapaSocketsUnix(directorio=directorio)
+        await capa.new_channel()
+
+        # Esperar a que este proceso conozca las suscripciones de todos los hijos
+        limite = time.monotonic() + 10
+        while len(capa._remotos.get(GRUPO, ())) < procesos:
+            if time.monotonic() > limite:
+                raise CommandError("Las suscripciones al grupo no llegaron a este proceso.")
+            await asyncio.sleep(0.01)
+
+        inicio = time.monotonic()
+        await _publicar(capa, options['mensajes'], options['tamano'], options['intervalo'] / 1000)
+        fin, latencias, descartados = inicio, [], 0
+        for _ in range(procesos):
+            terminado, recibidas, perdidas = await asyncio.to_thread(resultados.get, True, options['espera'] + 30)
+            fin = max(fin, terminado)
+            latencias.extend(recibidas)
+            descartados += perdidas
+        if descartados:
+            self.stdout.write(self.style.WARNING(f"Mensajes descartados por canales llenos: {descartados}"))
+        return len(latencias), fin - inicio, latencias
+
+    def _informar(self, titulo, entregas, duracion, latencias, esperadas):
+        latencias.sort()
+        p50 = latencias[len(latencias) // 2] * 1000 if latencias else 0
+        p99 = latencias[max(0, int(len(latencias) * 0.99) - 1)] * 1000 if latencias else 0
+        self.stdout.write(f"\n{titulo}")
+        self.stdout.write(f"  Entregas   : {entregas}/{esperadas} en {duracion:.2f} s ({entregas / duracion:,.0f} msg/s)")
+        self.stdout.write(f"  Latencia   : p50 {p50:.2f} ms | p99 {p99:.2f} ms")
+        if entregas < esperadas:
+            self.stdout.write(self.style.WARNING("  Faltaron entregas (tiempo agotado o canales llenos)."))
@@ -0,0 +1,96 @@
+# transporte/management/commands/benchmark_chat.py
+
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from SuperService.escritura_diferida import escritor_mensajes
+from transporte.models import MensajeViaje, Viaje
+from usuarios.models import UsuarioPersonalizado
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el chat de viajes de punta a punta con WebsocketCommunicator: cada cliente "
+        "envía mensajes y se cronometra la difusión a ambos participantes y la escritura "
+        "en la BD, guardando fila por fila y en lotes. Crea datos temporales y los borra al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viajes', type=int, default=50, help="Chats simultáneos (cliente + conductor).")
+        parser.add_argument('--mensajes', type=int, default=100, help="Mensajes que envía cada cliente.")
+
+    def handle(self, *args, **options):
+        prefijo = f"bench_{uuid.uuid4().hex[:8]}"
+        viajes = []
+        for i in range(options['viajes']):
+            cliente = UsuarioPersonalizado.objects.create_user(username=f"{prefijo}_cl{i}", rol='cliente')
+            conductor = UsuarioPersonalizado.objects.create_user(username=f"{prefijo}_co{i}", rol='conductor')
+            viaje = Viaje.objects.create(
+                cliente=cliente, conductor=conductor, estado='aceptado',
+                origen_lat=10.48, origen_lon=-66.90, destino_lat=10.50, destino_lon=-66.85,
+            )
+            viajes.append((viaje, cliente, conductor))
+
+        diferido_original = escritor_mensajes.diferido
+        try:
+            self.stdout.write(f"Motor de BD : {connection.vendor}")
+            self.stdout.write(f"Carga       : {len(viajes)} chats x {options['mensajes']} mensajes")
+            for titulo, diferido in (("Fila por mensaje", False), ("En lotes (write-behind)", True)):
+                escritor_mensajes.diferido = diferido
+                difusion, persistencia = asyncio.run(self._ronda(viajes, options['mensajes']))
+                total = len(viajes) * options['mensajes']
+                self.stdout.write(f"\n{titulo}")
+                self.stdout.write(f"  Difundidos : {total * 2} entregas en {difusion:.2f} s ({total / difusion:,.0f} msg/s)")
+                self.stdout.write(f"  Persistidos: {total} filas en {persistencia:.2f} s ({total / persistencia:,.0f} msg/s)")
+        finally:
+            escritor_mensajes.diferido = diferido_original
+            Viaje.objects.filter(cliente__username__startswith=prefijo).delete()
+            UsuarioPersonalizado.objects.filter(username__startswith=prefijo).delete()
+
+    async def _ronda(self, viajes, mensajes):
+        from SuperService.asgi import application
+
+        ids = [viaje.pk for viaje, _, _ in viajes]
+        contar = database_sync_to_async(lambda: MensajeViaje.objects.filter(viaje_id__in=ids).count())
+        await database_sync_to_async(lambda: MensajeViaje.objects.filter(viaje_id__in=ids).delete())()
+
+        emisores, receptores = [], []
+        for viaje, cliente, conductor in viajes:
+            for usuario in (cliente, conductor):
+                comunicador = WebsocketCommunicator(application, f'/ws/viaje/{viaje.pk}/')
+                comunicador.scope['user'] = usuario
+                conectado, _ = await comunicador.connect()
+                if not conectado:
+                    raise CommandError(f"No se pudo conectar al chat del viaje {viaje.pk}.")
+                receptores.append(comunicador)
+            emisores.append(receptores[-2])
+
+        async def enviar(comunicador):
+            for i in range(mensajes):
+                await comunicador.send_json_to({'message': f'mensaje {i}'})
+
+        async def recibir(comunicador):
+            for _ in range(mensajes):
+                await comunicador.receive_json_from(timeout=60)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*map(enviar, emisores), *map(recibir, receptores))
+        difusion = time.perf_counter() - inicio
+
+        esperadas = len(viajes) * mensajes
+        limite = time.perf_counter() + 60
+        while await contar() < esperadas:
+            if time.perf_counter() > limite:
+                raise CommandError("Los mensajes no llegaron a la BD a tiempo.")
+            await asyncio.sleep(0.005)
+        persistencia = time.perf_counter() - inicio
+
+        for comunicador in receptores:
+            await comunicador.disconnect()
+        return difusion, persistencia
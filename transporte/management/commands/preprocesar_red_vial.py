@@ -0,0 +1,55 @@
+# transporte/management/commands/preprocesar_red_vial.py
+
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transporte.ruteo import RedVial
+
+
+class Command(BaseCommand):
+    help = (
+        "Compila un extracto OSM (.osm, XML) en el grafo CSR de transporte/ruteo.py y lo guarda "
+        "como arreglos .npy para abrirlo con mmap (settings.RED_VIAL_DIR)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Extracto OSM en XML (p. ej. exportado de openstreetmap.org o con osmium).")
+        parser.add_argument('--salida', default=None, help="Directorio destino (por defecto settings.RED_VIAL_DIR).")
+        parser.add_argument('--probar', type=int, default=20, help="Rutas aleatorias para medir A* (0 = no medir).")
+
+    def handle(self, *args, **options):
+        salida = options['salida'] or getattr(settings, 'RED_VIAL_DIR', '')
+        if not salida:
+            raise CommandError("Indique --salida o defina RED_VIAL_DIR.")
+
+        inicio = time.perf_counter()
+        try:
+            red = RedVial.desde_osm(options['archivo'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f"No se pudo leer el extracto: {error}")
+        t_compilar = time.perf_counter() - inicio
+
+        red.guardar(salida)
+        self.stdout.write(
+            f"{len(red)} nodos, {red.aristas} aristas compilados en {t_compilar:.1f} s -> {salida}"
+        )
+
+        if options['probar']:
+            self._probar(RedVial.cargar(salida), options['probar'])
+
+    def _probar(self, red, n):
+        """A* entre nodos al azar de la red abierta con mmap (tal como la usan los workers)."""
+        rng = np.random.default_rng(0)
+        tiempos, encontradas = [], 0
+        for origen, destino in rng.integers(0, len(red), size=(n, 2)):
+            inicio = time.perf_counter()
+            ruta = red.ruta(red.lat[origen], red.lon[origen], red.lat[destino], red.lon[destino])
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            encontradas += ruta is not None
+
+        self.stdout.write(
+            f"A*: {encontradas}/{n} rutas | mediana {np.median(tiempos):.1f} ms | p95 {np.percentile(tiempos, 95):.1f} ms"
+        )
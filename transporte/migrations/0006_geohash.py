@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0005_alter_viaje_options_viaje_nombre_destino_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solicitudasistencia',
+            name='ubicacion_geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='viaje',
+            name='origen_geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0006_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrazaViaje',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polilinea', models.TextField(blank=True, default='')),
+                ('num_puntos', models.PositiveIntegerField(default=0)),
+                ('ultimo_lat_e5', models.IntegerField(default=0)),
+                ('ultimo_lon_e5', models.IntegerField(default=0)),
+                ('compactada', models.BooleanField(default=False)),
+                ('puntos_originales', models.PositiveIntegerField(default=0)),
+                ('actualizada_en', models.DateTimeField(auto_now=True)),
+                ('viaje', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='traza', to='transporte.viaje')),
+            ],
+            options={
+                'verbose_name': 'Traza de Viaje',
+                'verbose_name_plural': 'Trazas de Viaje',
+            },
+        ),
+    ]
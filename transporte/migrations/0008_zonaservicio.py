@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0007_trazaviaje'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZonaServicio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100)),
+                ('poligono', models.JSONField(help_text='Vértices [[lat, lon], ...] en orden; el polígono se cierra solo.')),
+                ('activa', models.BooleanField(default=True)),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Zona de Servicio',
+                'verbose_name_plural': 'Zonas de Servicio',
+            },
+        ),
+    ]
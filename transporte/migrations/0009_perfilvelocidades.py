@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0008_zonaservicio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfilVelocidades',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tablas', models.BinaryField(blank=True, default=b'')),
+                ('procesado_hasta', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_viaje', models.PositiveIntegerField(default=0)),
+                ('viajes_procesados', models.PositiveIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Perfil de Velocidades',
+                'verbose_name_plural': 'Perfiles de Velocidades',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='viaje',
+            index=models.Index(fields=['estado', 'finalizado_en', 'id'], name='viaje_estado_fin_idx'),
+        ),
+    ]
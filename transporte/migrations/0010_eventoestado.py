@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transporte', '0009_perfilvelocidades'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoEstado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('viaje', 'Viaje'), ('asistencia', 'Asistencia Vial'), ('pedido', 'Pedido'), ('lote', 'Lote de Entrega')], max_length=20)),
+                ('objeto_id', models.PositiveIntegerField()),
+                ('estado_anterior', models.CharField(blank=True, default='', max_length=20)),
+                ('estado_nuevo', models.CharField(max_length=20)),
+                ('datos', models.JSONField(blank=True, default=dict)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos_estado', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Evento de Estado',
+                'verbose_name_plural': 'Eventos de Estado',
+                'indexes': [models.Index(fields=['tipo', 'objeto_id', 'id'], name='evento_objeto_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0010_eventoestado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensajeviaje',
+            index=models.Index(fields=['viaje', 'timestamp', 'id'], name='mensajeviaje_hist_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transporte', '0011_mensajeviaje_hist_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensajeviaje',
+            name='secuencia',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mensajeviaje',
+            index=models.Index(fields=['viaje', 'secuencia'], name='mensajeviaje_seq_idx'),
+        ),
+    ]
@@ -2,6 +2,7 @@
 from django.db import models
 from django.conf import settings # 🟢 ¡CRÍTICO: IMPORTAR SETTINGS AQUÍ!
 from usuarios.models import UsuarioPersonalizado # Importar el modelo de usuario personalizado
+from domicilios.utils import GeohashMixin, GeoQuerySet # Columnas geohash para búsquedas por cercanía
 
 # ----------------------------------------------------------------------
 # 1. Gestión de Vehículos (Usados para Viajes, Envíos y Asistencia)
@@ -47,10 +48,12 @@ class Vehiculo(models.Model):
 # 2. Gestión de Viajes Solicitados
 # ----------------------------------------------------------------------
 
-class Viaje(models.Model):
+class Viaje(GeohashMixin, models.Model):
     """
     Representa una solicitud de viaje de un cliente.
     """
+    # (campo_lat, campo_lon, campo_geohash) para GeohashMixin / GeoQuerySet
+    GEOHASH_CAMPOS = ('origen_lat', 'origen_lon', 'origen_geohash')
     
     # --- Choices ---
     ESTADO_CHOICES = (
@@ -93,6 +96,9 @@ class Viaje(models.Model):
     origen_lon = models.DecimalField(max_digits=9, decimal_places=6)
     destino_lat = models.DecimalField(max_digits=9, decimal_places=6)
     destino_lon = models.DecimalField(max_digits=9, decimal_places=6)
+
+    # Geohash del origen (se recalcula en save()); indexado para búsquedas "cerca de"
+    origen_geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     
     # 🟢 CAMPOS FALTANTES QUE CAUSARON EL FIELDERROR:
     tipo_servicio = models.CharField(
@@ -122,22 +128,46 @@ class Viaje(models.Model):
     iniciado_en = models.DateTimeField(null=True, blank=True)
     finalizado_en = models.DateTimeField(null=True, blank=True)
 
+    objects = GeoQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Viaje"
         verbose_name_plural = "Viajes"
         # Opcional: Para ordenar en la administración por la fecha de solicitud
         ordering = ['-creado_en'] 
+        indexes = [
+            # Lectura incremental de viajes completados para los perfiles de velocidad (eta.py)
+            models.Index(fields=['estado', 'finalizado_en', 'id'], name='viaje_estado_fin_idx'),
+        ]
     
     def __str__(self):
         return f"Viaje #{self.id} de {self.cliente.username} - {self.get_estado_display()}"
+
+    def save(self, *args, **kwargs):
+        # Sella el inicio y el fin del recorrido; los perfiles de velocidad del ETA dependen de ellos
+        from django.utils import timezone
+
+        sellados = set()
+        if self.estado in ('en_curso', 'completado') and self.iniciado_en is None:
+            self.iniciado_en = timezone.now()
+            sellados.add('iniciado_en')
+        if self.estado == 'completado' and self.finalizado_en is None:
+            self.finalizado_en = timezone.now()
+            sellados.add('finalizado_en')
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and sellados:
+            kwargs['update_fields'] = set(update_fields) | sellados
+        super().save(*args, **kwargs)
 # ----------------------------------------------------------------------
 # 3. Gestión de Asistencia Vial (Servicio Relacionado)
 # ----------------------------------------------------------------------
 
-class SolicitudAsistencia(models.Model):
+class SolicitudAsistencia(GeohashMixin, models.Model):
     """
     Representa una solicitud de asistencia vial (grúa, cambio de llanta, etc.).
     """
+    GEOHASH_CAMPOS = ('ubicacion_lat', 'ubicacion_lon', 'ubicacion_geohash')
+
     TIPO_ASISTENCIA_CHOICES = (
         ('grua', 'Servicio de Grúa'),
         ('llanta', 'Cambio de Llanta'),
@@ -165,11 +195,14 @@ class SolicitudAsistencia(models.Model):
     # Ubicación del incidente
     ubicacion_lat = models.DecimalField(max_digits=9, decimal_places=6)
     ubicacion_lon = models.DecimalField(max_digits=9, decimal_places=6)
+    ubicacion_geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     descripcion = models.TextField(blank=True)
 
     estado = models.CharField(max_length=20, choices=Viaje.ESTADO_CHOICES, default='solicitado') # Reutilizamos los estados de Viaje
     creado_en = models.DateTimeField(auto_now_add=True)
 
+    objects = GeoQuerySet.as_manager()
+
     def __str__(self):
         return f"Asistencia Vial #{self.id} - {self.get_tipo_asistencia_display()}"
 
@@ -195,11 +228,126 @@ class MensajeViaje(models.Model):
     )
     contenido = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Secuencia del chat en vivo para reanudar tras reconectar (SuperService/reanudacion_chat.py)
+    secuencia = models.BigIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['timestamp']
         verbose_name = "Mensaje de Viaje"
         verbose_name_plural = "Mensajes de Viaje"
+        # Historial por páginas (SuperService/historial_chat.py)
+        indexes = [
+            models.Index(fields=['viaje', 'timestamp', 'id'], name='mensajeviaje_hist_idx'),
+            models.Index(fields=['viaje', 'secuencia'], name='mensajeviaje_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f'Mensaje de {self.emisor.username} en Viaje #{self.viaje.id}'
+
+class TrazaViaje(models.Model):
+    """
+    Recorrido GPS de un Viaje guardado como UNA polilínea codificada
+    (formato de Google, precisión 1e-5 ≈ 1 m). Las posiciones se anexan en
+    lotes mientras el viaje está activo (transporte/trazas.py) y al pasar a
+    'completado' se compacta con Douglas-Peucker para mostrarla en el mapa.
+    """
+    viaje = models.OneToOneField('Viaje', on_delete=models.CASCADE, related_name='traza')
+    polilinea = models.TextField(blank=True, default='')
+    num_puntos = models.PositiveIntegerField(default=0)
+
+    # Último punto codificado (enteros ×1e5): la polilínea se codifica por deltas,
+    # así que anexar solo requiere conocer el punto anterior
+    ultimo_lat_e5 = models.IntegerField(default=0)
+    ultimo_lon_e5 = models.IntegerField(default=0)
+
+    compactada = models.BooleanField(default=False)
+    puntos_originales = models.PositiveIntegerField(default=0)
+    actualizada_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Traza de Viaje"
+        verbose_name_plural = "Trazas de Viaje"
+
+    def __str__(self):
+        return f'Traza del Viaje #{self.viaje_id} ({self.num_puntos} puntos)'
+
+class ZonaServicio(models.Model):
+    """
+    Área donde se presta el servicio. El polígono se guarda como una lista
+    de vértices [[lat, lon], ...] y se compila en memoria en un índice
+    (transporte/geocercas.py) que valida viajes, pedidos y asistencias.
+    Sin zonas activas no se restringe ninguna ubicación.
+    """
+    nombre = models.CharField(max_length=100)
+    poligono = models.JSONField(help_text="Vértices [[lat, lon], ...] en orden; el polígono se cierra solo.")
+    activa = models.BooleanField(default=True)
+    creada_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Zona de Servicio"
+        verbose_name_plural = "Zonas de Servicio"
+
+    def __str__(self):
+        return self.nombre
+
+    def clean(self):
+        from .geocercas import validar_poligono
+        validar_poligono(self.poligono)
+
+
+class PerfilVelocidades(models.Model):
+    """
+    Velocidades medias aprendidas de los viajes completados, por zona
+    (celda de despacho) y hora de la semana. Las tablas se guardan como un
+    único blob de NumPy (transporte/eta.py) y se actualizan de forma
+    incremental: 'procesado_hasta' y 'ultimo_viaje' marcan el último viaje
+    sumado, así que cada pasada solo lee los viajes nuevos.
+    """
+    tablas = models.BinaryField(blank=True, default=b'')
+    procesado_hasta = models.DateTimeField(null=True, blank=True)
+    ultimo_viaje = models.PositiveIntegerField(default=0)
+    viajes_procesados = models.PositiveIntegerField(default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Perfil de Velocidades"
+        verbose_name_plural = "Perfiles de Velocidades"
+
+    def __str__(self):
+        return f'Perfil de velocidades ({self.viajes_procesados} viajes)'
+
+
+class EventoEstado(models.Model):
+    """
+    Cambio de estado de un Viaje, SolicitudAsistencia, Pedido o LoteEntrega
+    (transporte/transiciones.py). Solo se agregan filas: el id creciente
+    sirve de cursor para que analítica lea la tabla como un registro de
+    cambios ('id > último leído') y para que un cliente recupere lo que se
+    perdió mientras estaba desconectado.
+    """
+    TIPO_CHOICES = (
+        ('viaje', 'Viaje'),
+        ('asistencia', 'Asistencia Vial'),
+        ('pedido', 'Pedido'),
+        ('lote', 'Lote de Entrega'),
+    )
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    objeto_id = models.PositiveIntegerField()
+    estado_anterior = models.CharField(max_length=20, blank=True, default='')
+    estado_nuevo = models.CharField(max_length=20)
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='eventos_estado'
+    )
+    datos = models.JSONField(default=dict, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Evento de Estado"
+        verbose_name_plural = "Eventos de Estado"
+        indexes = [
+            models.Index(fields=['tipo', 'objeto_id', 'id'], name='evento_objeto_idx'),
+        ]
 
     def __str__(self):
-        return f'Mensaje de {self.emisor.username} en Viaje #{self.viaje.id}'
\ No newline at end of file
+        return f'{self.tipo} #{self.objeto_id}: {self.estado_anterior or "—"} → {self.estado_nuevo}'
@@ -0,0 +1,257 @@
+# transporte/ofertas.py
+
+import asyncio
+import contextvars
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .despacho import indice_conductores, TIPOS_VEHICULO_POR_SERVICIO
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros de las Oleadas
+# ----------------------------------------------------------------------
+
+# Cantidad acumulada de conductores avisados en cada oleada (los más cercanos primero)
+OLEADAS = (5, 15, 40)
+
+# Espera entre una oleada y la siguiente si nadie aceptó (segundos)
+INTERVALO_OLEADA_S = 10.0
+
+
+def grupo_conductor(conductor_id):
+    """Grupo de Channels personal de cada conductor (lo une UbicacionConductorConsumer)."""
+    return f'conductor_{conductor_id}'
+
+
+def enviar_a_conductores(conductor_ids, mensaje):
+    """Envía el mismo evento al grupo personal de cada conductor."""
+    capa = get_channel_layer()
+    if capa is None:
+        return
+    for conductor_id in conductor_ids:
+        async_to_sync(capa.group_send)(grupo_conductor(conductor_id), mensaje)
+
+
+def datos_oferta(viaje):
+    """Contenido de la oferta (solo tipos serializables por la capa de canales)."""
+    return {
+        'viaje_id': viaje.pk,
+        'tipo_servicio': viaje.tipo_servicio,
+        'origen': [float(viaje.origen_lat), float(viaje.origen_lon)],
+        'destino': [float(viaje.destino_lat), float(viaje.destino_lon)],
+        'nombre_origen': viaje.nombre_origen or '',
+        'nombre_destino': viaje.nombre_destino or '',
+        'tarifa_estimada': str(viaje.tarifa_estimada) if viaje.tarifa_estimada is not None else None,
+    }
+
+
+def mensaje_oferta(datos, distancia_km):
+    """Evento 'oferta_viaje' para un conductor concreto (con su distancia al origen)."""
+    return {'type': 'oferta_viaje', 'oferta': dict(datos, distancia_km=round(distancia_km, 2))}
+
+
+def ejecutar_en_bucle(loop, funcion, *args):
+    """
+    Ejecuta 'funcion' (o agenda la corrutina que devuelva) en el hilo de
+    'loop' con un contexto limpio: el de la vista que llama pertenece a otro
+    hilo y arrastraría su ejecutor de sync_to_async.
+    """
+    def ejecutar():
+        resultado = funcion(*args)
+        if asyncio.iscoroutine(resultado):
+            loop.create_task(resultado)
+
+    loop.call_soon_threadsafe(ejecutar, context=contextvars.Context())
+
+
+def sigue_solicitado(viaje_id):
+    from .models import Viaje
+
+    return Viaje.objects.filter(pk=viaje_id, estado='solicitado').exists()
+
+
+# ----------------------------------------------------------------------
+# 2. Difusión por Oleadas
+# ----------------------------------------------------------------------
+
+class DifusorOfertas:
+    """
+    Empuja cada Viaje nuevo a los conductores compatibles más cercanos y, si
+    nadie lo acepta, amplía el círculo en oleadas sucesivas. Cada oleada se
+    calcula de nuevo contra el índice (los conductores se mueven) y nunca
+    repite a un conductor ya avisado. Al aceptarse el viaje se retira la
+    oferta de todos los que la recibieron.
+
+    Las oleadas corren en el bucle asyncio del proceso ASGI (registrado por
+    UbicacionConductorConsumer con iniciar()); las vistas síncronas solo
+    programan trabajo en ese bucle. Sin bucle registrado (p. ej. WSGI puro)
+    se envía únicamente la primera oleada.
+    """
+
+    def __init__(self, oleadas=OLEADAS, intervalo=INTERVALO_OLEADA_S):
+        self.oleadas = oleadas
+        self.intervalo = intervalo
+        self._loop = None
+        # viaje_id -> {'datos', 'tipos', 'excluir', 'avisados', 'oleada', 'temporizador'}
+        # Solo se toca desde el hilo del bucle, así que no necesita lock.
+        self._activas = {}
+
+    def __contains__(self, viaje_id):
+        return viaje_id in self._activas
+
+    def iniciar(self):
+        """Registra el bucle asyncio actual como dueño de las oleadas."""
+        self._loop = asyncio.get_running_loop()
+
+    def _bucle_disponible(self):
+        return self._loop is not None and self._loop.is_running() and not self._loop.is_closed()
+
+    def publicar(self, viaje):
+        """Registra la oferta y lanza la primera oleada (se puede llamar desde cualquier hilo)."""
+        oferta = {
+            'datos': datos_oferta(viaje),
+            'tipos': TIPOS_VEHICULO_POR_SERVICIO.get(viaje.tipo_servicio),
+            'excluir': {viaje.cliente_id} if viaje.cliente_id else set(),
+            'avisados': set(),
+            'oleada': 0,
+            'temporizador': None,
+        }
+        if self._bucle_disponible():
+            self._en_bucle(self._abrir, viaje.pk, oferta)
+        else:
+            lat, lon = oferta['datos']['origen']
+            cercanos = indice_conductores.cercanos(
+                lat, lon, k=self.oleadas[0], tipos=oferta['tipos'], excluir=oferta['excluir']
+            )
+            for conductor_id, distancia in cercanos:
+                enviar_a_conductores([conductor_id], mensaje_oferta(oferta['datos'], distancia))
+
+    def retirar(self, viaje_id, conductor_id=None):
+        """
+        Cierra la oferta (viaje aceptado o cancelado) y avisa a quienes la
+        recibieron para que la quiten de su pantalla. 'conductor_id' es el
+        ganador, al que no hace falta avisar.
+        """
+        if self._bucle_disponible():
+            self._en_bucle(self._cerrar, viaje_id, conductor_id)
+
+    def _en_bucle(self, funcion, *args):
+        ejecutar_en_bucle(self._loop, funcion, *args)
+
+    # --- Dentro del bucle asyncio ---
+
+    async def _abrir(self, viaje_id, oferta):
+        if viaje_id in self._activas:
+            return
+        self._activas[viaje_id] = oferta
+        await self._oleada_segura(viaje_id)
+
+    async def _oleada(self, viaje_id):
+        from channels.db import database_sync_to_async
+
+        oferta = self._activas.get(viaje_id)
+        if oferta is None:
+            return
+        if oferta['oleada'] >= len(self.oleadas):
+            # Se agotaron las oleadas: el viaje queda para el dashboard / motor por lotes
+            self._activas.pop(viaje_id, None)
+            return
+
+        # El viaje pudo tomarse por otra vía (dashboard, motor por lotes) entre oleadas
+        if oferta['oleada'] > 0 and not await database_sync_to_async(sigue_solicitado)(viaje_id):
+            self._cerrar(viaje_id)
+            return
+
+        tope = self.oleadas[oferta['oleada']]
+        oferta['oleada'] += 1
+
+        lat, lon = oferta['datos']['origen']
+        faltan = tope - len(oferta['avisados'])
+        cercanos = indice_conductores.cercanos(
+            lat, lon, k=faltan, tipos=oferta['tipos'],
+            excluir=oferta['avisados'] | oferta['excluir'],
+        ) if faltan > 0 else []
+        capa = get_channel_layer()
+        for conductor_id, distancia in cercanos:
+            oferta['avisados'].add(conductor_id)
+            await capa.group_send(grupo_conductor(conductor_id), mensaje_oferta(oferta['datos'], distancia))
+
+        if viaje_id in self._activas:
+            oferta['temporizador'] = self._loop.call_later(self.intervalo, self._programar_oleada, viaje_id)
+
+    def _programar_oleada(self, viaje_id):
+        oferta = self._activas.get(viaje_id)
+        if oferta is not None:
+            oferta['temporizador'] = self._loop.create_task(self._oleada_segura(viaje_id))
+
+    async def _oleada_segura(self, viaje_id):
+        try:
+            await self._oleada(viaje_id)
+        except Exception:
+            logger.exception("Falló la oleada de ofertas del viaje %s.", viaje_id)
+
+    def _cerrar(self, viaje_id, conductor_id=None):
+        oferta = self._activas.pop(viaje_id, None)
+        if oferta is None:
+            return
+        if oferta['temporizador'] is not None:
+            oferta['temporizador'].cancel()
+        avisar = oferta['avisados'] - {conductor_id}
+        if avisar:
+            self._loop.create_task(self._avisar_retiro(viaje_id, avisar))
+
+    async def _avisar_retiro(self, viaje_id, conductor_ids):
+        capa = get_channel_layer()
+        for conductor_id in conductor_ids:
+            await capa.group_send(grupo_conductor(conductor_id), {'type': 'oferta_retirada', 'viaje_id': viaje_id})
+
+
+# Difusor único por proceso
+difusor_ofertas = DifusorOfertas()
+
+
+# ----------------------------------------------------------------------
+# 3. Funciones de Apoyo para las Vistas
+# ----------------------------------------------------------------------
+
+def publicar_oferta(viaje):
+    """
+    Publica el viaje recién creado cuando la transacción se confirme, en
+    oleadas o en cascada según settings.MODO_OFERTAS_VIAJE.
+    """
+    from django.conf import settings
+    from django.db import transaction
+    from .cascada import despachador_cascada
+
+    if getattr(settings, 'MODO_OFERTAS_VIAJE', 'oleadas') == 'cascada':
+        transaction.on_commit(lambda: despachador_cascada.publicar_viaje(viaje))
+    else:
+        transaction.on_commit(lambda: difusor_ofertas.publicar(viaje))
+
+
+def retirar_ofertas(viaje_ids, conductor_por_viaje=None):
+    """Retira las ofertas de viajes ya tomados. 'conductor_por_viaje' evita avisar al ganador."""
+    from .cascada import despachador_cascada
+
+    conductor_por_viaje = conductor_por_viaje or {}
+    for viaje_id in viaje_ids:
+        difusor_ofertas.retirar(viaje_id, conductor_por_viaje.get(viaje_id))
+        despachador_cascada.aceptada(('viaje', viaje_id), conductor_por_viaje.get(viaje_id))
+
+
+def publicar_oferta_asistencia(asistencia):
+    """Ofrece la asistencia en cascada a los proveedores cercanos al confirmar la transacción."""
+    from django.db import transaction
+    from .cascada import despachador_cascada
+
+    transaction.on_commit(lambda: despachador_cascada.publicar_asistencia(asistencia))
+
+
+def retirar_oferta_asistencia(asistencia_id, proveedor_id=None):
+    from .cascada import despachador_cascada
+
+    despachador_cascada.aceptada(('asistencia', asistencia_id), proveedor_id)
@@ -6,4 +6,10 @@ from . import consumers
 websocket_urlpatterns = [
     # Usa 'viaje_id' para que el consumer lo obtenga
     re_path(r'ws/viaje/(?P<viaje_id>\d+)/$', consumers.ViajeChatConsumer.as_asgi()),
+    # Pings de GPS de conductores/repartidores
+    re_path(r'ws/conductor/ubicacion/$', consumers.UbicacionConductorConsumer.as_asgi()),
+    # Oferta y demanda por zona (staff)
+    re_path(r'ws/demanda/$', consumers.DemandaConsumer.as_asgi()),
+    # Cambios de estado de un viaje, asistencia, pedido o lote
+    re_path(r'ws/estado/(?P<tipo>viaje|asistencia|pedido|lote)/(?P<objeto_id>\d+)/$', consumers.EstadoConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,448 @@
+# transporte/ruteo.py
+
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from domicilios.utils import R_TIERRA_KM
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros de la Red Vial
+# ----------------------------------------------------------------------
+
+# Velocidad (km/h) por tipo de vía OSM cuando la vía no trae 'maxspeed'.
+# Solo entran al grafo las vías de estos tipos (se ignoran peatonales, ciclovías, etc.).
+VELOCIDADES_KMH = {
+    'motorway': 90, 'motorway_link': 50,
+    'trunk': 70, 'trunk_link': 40,
+    'primary': 50, 'primary_link': 35,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 35, 'tertiary_link': 25,
+    'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15,
+}
+
+# Un punto a más de esto del nodo vial más cercano no se rutea (se usa la línea recta)
+DISTANCIA_MAXIMA_AJUSTE_M = 500.0
+
+# Fuentes por bloque en las consultas muchos-a-muchos (acota la memoria de SciPy)
+FUENTES_POR_BLOQUE = 64
+
+# Archivos del grafo preprocesado (un .npy por arreglo, para abrirlos con mmap)
+ARREGLOS = ('lat', 'lon', 'indptr', 'destinos', 'metros', 'segundos')
+
+R_TIERRA_M = R_TIERRA_KM * 1000
+METROS_POR_GRADO = math.radians(1) * R_TIERRA_M
+
+
+def _velocidad_kmh(etiquetas):
+    """Velocidad de la vía: 'maxspeed' numérico (km/h o mph) o la del tipo de vía."""
+    por_defecto = VELOCIDADES_KMH[etiquetas['highway']]
+    texto = etiquetas.get('maxspeed', '').strip().lower()
+    try:
+        if texto.endswith('mph'):
+            return float(texto[:-3]) * 1.609
+        return float(texto) or por_defecto
+    except ValueError:
+        return por_defecto
+
+
+def _sentido(etiquetas):
+    """1 = solo hacia adelante, -1 = solo hacia atrás, 0 = doble sentido."""
+    oneway = etiquetas.get('oneway', '').lower()
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway == 'no':
+        return 0
+    if etiquetas.get('junction') == 'roundabout' or etiquetas['highway'] in ('motorway', 'motorway_link'):
+        return 1
+    return 0
+
+
+# ----------------------------------------------------------------------
+# 2. Lectura de un Extracto OSM (XML)
+# ----------------------------------------------------------------------
+
+def leer_osm(ruta_archivo):
+    """
+    Lee un extracto .osm (XML) en dos pasadas con iterparse, liberando cada
+    elemento al procesarlo: primero las vías transitables, después solo las
+    coordenadas de los nodos que esas vías usan. La memoria depende de la
+    red vial, no del tamaño del archivo.
+    Devuelve (vias, coordenadas): vias = [(refs, kmh, sentido)], coordenadas = {osm_id: (lat, lon)}.
+    """
+    vias = []
+    usados = set()
+    for _, elemento in ET.iterparse(ruta_archivo, events=('end',)):
+        if elemento.tag == 'way':
+            etiquetas = {tag.get('k'): tag.get('v') for tag in elemento.iter('tag')}
+            if etiquetas.get('highway') in VELOCIDADES_KMH and etiquetas.get('access') not in ('no', 'private'):
+                refs = [int(nd.get('ref')) for nd in elemento.iter('nd')]
+                if len(refs) > 1:
+                    vias.append((refs, _velocidad_kmh(etiquetas), _sentido(etiquetas)))
+                    usados.update(refs)
+            elemento.clear()
+        elif elemento.tag in ('node', 'relation'):
+            elemento.clear()
+
+    coordenadas = {}
+    for _, elemento in ET.iterparse(ruta_archivo, events=('end',)):
+        if elemento.tag == 'node':
+            osm_id = int(elemento.get('id'))
+            if osm_id in usados:
+                coordenadas[osm_id] = (float(elemento.get('lat')), float(elemento.get('lon')))
+        if elemento.tag in ('node', 'way', 'relation'):
+            elemento.clear()
+    return vias, coordenadas
+
+
+# ----------------------------------------------------------------------
+# 3. Grafo en Arreglos (CSR)
+# ----------------------------------------------------------------------
+
+class RedVial:
+    """
+    Grafo dirigido de la red vial en formato CSR: las aristas que salen del
+    nodo i son destinos[indptr[i]:indptr[i + 1]], con su longitud (metros) y
+    su tiempo de recorrido (segundos) en arreglos paralelos. Son seis
+    arreglos de numpy, así que se pueden guardar en disco y abrir con mmap
+    (varios workers comparten las mismas páginas).
+
+    - nodo_cercano(): ajuste de un punto al nodo vial más cercano (KD-tree).
+    - ruta(): camino más corto entre dos puntos con A*.
+    - matriz(): muchos-a-muchos con el Dijkstra de SciPy (en C), por bloques.
+    """
+
+    def __init__(self, lat, lon, indptr, destinos, metros, segundos):
+        self.lat, self.lon = lat, lon
+        self.indptr, self.destinos = indptr, destinos
+        self.pesos = {'metros': metros, 'segundos': segundos}
+        self._arbol = None
+        self._matrices = {}
+        self._lock = threading.Lock()
+        # Cota de la heurística de A* para tiempos: nadie va más rápido que la vía más rápida
+        self.velocidad_maxima_ms = float((metros / np.maximum(segundos, 1e-6)).max()) if len(metros) else 1.0
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def aristas(self):
+        return len(self.destinos)
+
+    # --- Construcción, guardado y carga ---
+
+    @classmethod
+    def desde_vias(cls, vias, coordenadas):
+        aristas = []
+        for refs, kmh, sentido in vias:
+            refs = [ref for ref in refs if ref in coordenadas]
+            for a, b in zip(refs[:-1], refs[1:]):
+                if a == b:
+                    continue
+                if sentido >= 0:
+                    aristas.append((a, b, kmh))
+                if sentido <= 0:
+                    aristas.append((b, a, kmh))
+        if not aristas:
+            raise ValueError("El extracto no contiene vías transitables.")
+
+        # Ids OSM -> índices compactos 0..n-1
+        extremos = np.array([(a, b) for a, b, _ in aristas], dtype=np.int64)
+        osm_ids, indices = np.unique(extremos.ravel(), return_inverse=True)
+        origenes, destinos = indices.reshape(-1, 2).T
+        velocidades = np.array([kmh for _, _, kmh in aristas], dtype=np.float64)
+        lat = np.array([coordenadas[i][0] for i in osm_ids.tolist()], dtype=np.float64)
+        lon = np.array([coordenadas[i][1] for i in osm_ids.tolist()], dtype=np.float64)
+
+        metros = _metros_arista(lat[origenes], lon[origenes], lat[destinos], lon[destinos])
+        segundos = metros / (velocidades / 3.6)
+
+        # Ordenar por nodo de origen y comprimir en CSR
+        orden = np.argsort(origenes, kind='stable')
+        indptr = np.zeros(len(osm_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(origenes, minlength=len(osm_ids)), out=indptr[1:])
+        return cls(
+            lat, lon, indptr, destinos[orden].astype(np.int32),
+            metros[orden].astype(np.float32), segundos[orden].astype(np.float32),
+        )
+
+    @classmethod
+    def desde_osm(cls, ruta_archivo):
+        return cls.desde_vias(*leer_osm(ruta_archivo))
+
+    def guardar(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        arreglos = dict(zip(ARREGLOS, (self.lat, self.lon, self.indptr, self.destinos,
+                                       self.pesos['metros'], self.pesos['segundos'])))
+        for nombre, arreglo in arreglos.items():
+            np.save(os.path.join(directorio, f'{nombre}.npy'), np.ascontiguousarray(arreglo))
+        with open(os.path.join(directorio, 'red.json'), 'w') as archivo:
+            json.dump({'nodos': len(self), 'aristas': self.aristas}, archivo)
+
+    @classmethod
+    def cargar(cls, directorio, mmap=True):
+        modo = 'r' if mmap else None
+        # np.asarray deja un ndarray común sobre el mismo mapeo: sin copia y sin el
+        # costo de np.memmap en cada acceso elemento a elemento de A*
+        return cls(*(
+            np.asarray(np.load(os.path.join(directorio, f'{nombre}.npy'), mmap_mode=modo)) for nombre in ARREGLOS
+        ))
+
+    # --- Ajuste de puntos a la red ---
+
+    def _obtener_arbol(self):
+        if self._arbol is None:
+            with self._lock:
+                if self._arbol is None:
+                    self._arbol = cKDTree(_a_cartesianas(self.lat, self.lon))
+        return self._arbol
+
+    def nodos_cercanos(self, lats, lons):
+        """(nodos, distancias_m) del nodo vial más cercano a cada punto; nodo -1 si está demasiado lejos."""
+        cuerdas, nodos = self._obtener_arbol().query(_a_cartesianas(lats, lons))
+        distancias_m = 2 * R_TIERRA_M * np.arcsin(np.clip(np.asarray(cuerdas) / 2, 0.0, 1.0))
+        nodos = np.where(distancias_m <= DISTANCIA_MAXIMA_AJUSTE_M, nodos, -1)
+        return nodos.astype(np.int64), distancias_m
+
+    def nodo_cercano(self, lat, lon):
+        nodos, _ = self.nodos_cercanos([float(lat)], [float(lon)])
+        return int(nodos[0])
+
+    # --- Camino más corto (A*) ---
+
+    def ruta(self, o_lat, o_lon, d_lat, d_lon, peso='segundos'):
+        """
+        Camino más corto entre dos puntos. Devuelve {'metros', 'segundos',
+        'puntos'} o None si algún punto queda fuera de la red o no hay camino.
+        La heurística (línea recta, y para tiempos a la velocidad máxima de la
+        red) nunca sobreestima, así que el resultado es óptimo.
+        """
+        origen, destino = self.nodo_cercano(o_lat, o_lon), self.nodo_cercano(d_lat, d_lon)
+        if origen < 0 or destino < 0:
+            return None
+        camino = self.camino(origen, destino, peso)
+        if camino is None:
+            return None
+
+        nodos = np.asarray(camino, dtype=np.int64)
+        metros = segundos = 0.0
+        for u, v in zip(camino[:-1], camino[1:]):
+            arista = self._arista(u, v, peso)
+            metros += float(self.pesos['metros'][arista])
+            segundos += float(self.pesos['segundos'][arista])
+        return {
+            'metros': round(metros, 1),
+            'segundos': round(segundos, 1),
+            'puntos': list(zip(self.lat[nodos].tolist(), self.lon[nodos].tolist())),
+        }
+
+    def camino(self, origen, destino, peso='segundos'):
+        """Lista de nodos del camino más corto con A*, o None si no hay camino."""
+        pesos = self.pesos[peso]
+        indptr, destinos, lat, lon = self.indptr, self.destinos, self.lat, self.lon
+        d_lat, d_lon = float(lat[destino]), float(lon[destino])
+        # Equirectangular en metros: a escala de ciudad difiere de haversine en
+        # menos de 0.5 %, así que se rebaja un 1 % para no sobreestimar nunca
+        escala = METROS_POR_GRADO * 0.99
+        if peso == 'segundos':
+            escala /= self.velocidad_maxima_ms
+        cos_lat = math.cos(math.radians(d_lat))
+
+        def heuristica(nodo):
+            return math.hypot(lat[nodo] - d_lat, (lon[nodo] - d_lon) * cos_lat) * escala
+
+        costo = {origen: 0.0}
+        previo = {origen: -1}
+        abiertos = [(heuristica(origen), origen)]
+        cerrados = set()
+        while abiertos:
+            _, u = heapq.heappop(abiertos)
+            if u == destino:
+                camino = [u]
+                while previo[camino[-1]] >= 0:
+                    camino.append(previo[camino[-1]])
+                return camino[::-1]
+            if u in cerrados:
+                continue
+            cerrados.add(u)
+
+            inicio, fin = int(indptr[u]), int(indptr[u + 1])
+            base = costo[u]
+            for v, w in zip(destinos[inicio:fin].tolist(), pesos[inicio:fin].tolist()):
+                nuevo = base + w
+                if nuevo < costo.get(v, math.inf):
+                    costo[v] = nuevo
+                    previo[v] = u
+                    heapq.heappush(abiertos, (nuevo + heuristica(v), v))
+        return None
+
+    def _arista(self, u, v, peso):
+        """Índice de la arista u -> v más barata (puede haber paralelas)."""
+        inicio, fin = int(self.indptr[u]), int(self.indptr[u + 1])
+        candidatas = np.flatnonzero(self.destinos[inicio:fin] == v) + inicio
+        return int(candidatas[np.argmin(self.pesos[peso][candidatas])])
+
+    # --- Muchos a muchos (Dijkstra de SciPy) ---
+
+    def _matriz_dispersa(self, peso, inversa=False):
+        """Grafo como csr_matrix de SciPy; 'inversa' da el grafo con las aristas invertidas."""
+        clave = (peso, inversa)
+        if clave not in self._matrices:
+            if inversa:
+                self._matrices[clave] = self._matriz_dispersa(peso).T.tocsr()
+            else:
+                # Las aristas de costo 0 se confundirían con "sin arista"
+                datos = np.maximum(np.asarray(self.pesos[peso], dtype=np.float64), 1e-3)
+                self._matrices[clave] = csr_matrix(
+                    (datos, np.asarray(self.destinos), np.asarray(self.indptr)), shape=(len(self), len(self))
+                )
+        return self._matrices[clave]
+
+    def matriz(self, origenes, destinos, peso='segundos', limite=np.inf):
+        """
+        Costos (len(origenes) x len(destinos)) entre nodos; np.inf si no hay
+        camino o supera 'limite' y np.nan si el origen o el destino es -1
+        (punto fuera de la red).
+
+        Cada Dijkstra de SciPy resuelve una fuente contra todo el grafo, así
+        que se corre desde el lado con menos nodos distintos: si hay menos
+        destinos que orígenes se usa el grafo invertido desde los destinos.
+        Las fuentes se procesan por bloques para acotar la memoria intermedia.
+        """
+        origenes = np.asarray(origenes, dtype=np.int64)
+        destinos = np.asarray(destinos, dtype=np.int64)
+        resultado = np.full((len(origenes), len(destinos)), np.nan)
+        validos_o = np.flatnonzero(origenes >= 0)
+        validos_d = np.flatnonzero(destinos >= 0)
+        if not len(validos_o) or not len(validos_d):
+            return resultado
+
+        inversa = len(np.unique(destinos[validos_d])) < len(np.unique(origenes[validos_o]))
+        if inversa:
+            fuentes, filas_fuente, objetivos, columnas = destinos, validos_d, origenes, validos_o
+        else:
+            fuentes, filas_fuente, objetivos, columnas = origenes, validos_o, destinos, validos_d
+
+        grafo = self._matriz_dispersa(peso, inversa)
+        parcial = np.empty((len(filas_fuente), len(columnas)))
+        # Fuentes repetidas (p. ej. varios viajes desde el mismo punto) se calculan una vez
+        unicos, posicion = np.unique(fuentes[filas_fuente], return_inverse=True)
+        for inicio in range(0, len(unicos), FUENTES_POR_BLOQUE):
+            bloque = unicos[inicio:inicio + FUENTES_POR_BLOQUE]
+            costos = dijkstra(grafo, directed=True, indices=bloque, limit=limite)
+            filas = np.flatnonzero((posicion >= inicio) & (posicion < inicio + len(bloque)))
+            parcial[filas] = costos[np.ix_(posicion[filas] - inicio, objetivos[columnas])]
+
+        if inversa:
+            resultado[np.ix_(validos_o, validos_d)] = parcial.T
+        else:
+            resultado[np.ix_(validos_o, validos_d)] = parcial
+        return resultado
+
+    def matriz_puntos(self, o_lats, o_lons, d_lats, d_lons, peso='segundos', limite=np.inf):
+        """Igual que matriz() pero entre coordenadas (se ajustan a la red)."""
+        origenes, _ = self.nodos_cercanos(o_lats, o_lons)
+        destinos, _ = self.nodos_cercanos(d_lats, d_lons)
+        return self.matriz(origenes, destinos, peso, limite)
+
+
+def _a_cartesianas(lats, lons):
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.column_stack((cos_lat * np.cos(lons), cos_lat * np.sin(lons), np.sin(lats)))
+
+
+def _metros_arista(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * R_TIERRA_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# ----------------------------------------------------------------------
+# 4. Red del Proceso y Funciones para Tarifas, ETAs y Despacho
+# ----------------------------------------------------------------------
+
+_red = None
+_red_cargada = False
+_lock_red = threading.Lock()
+
+
+def obtener_red_vial():
+    """
+    Red vial del proceso (se carga una vez): settings.RED_VIAL_DIR apunta a
+    un grafo preprocesado con 'manage.py preprocesar_red_vial' (se abre con
+    mmap) y settings.RED_VIAL_OSM a un extracto .osm que se compila al
+    arrancar. Sin ninguno de los dos devuelve None y todo el sistema sigue
+    usando la distancia en línea recta.
+    """
+    global _red, _red_cargada
+    if _red_cargada:
+        return _red
+
+    from django.conf import settings
+
+    with _lock_red:
+        if _red_cargada:
+            return _red
+        directorio = getattr(settings, 'RED_VIAL_DIR', '')
+        archivo_osm = getattr(settings, 'RED_VIAL_OSM', '')
+        t0 = time.perf_counter()
+        try:
+            if directorio and os.path.exists(os.path.join(directorio, 'indptr.npy')):
+                _red = RedVial.cargar(directorio)
+            elif archivo_osm and os.path.exists(archivo_osm):
+                _red = RedVial.desde_osm(archivo_osm)
+            if _red is not None:
+                logger.info(
+                    "Red vial cargada: %s nodos, %s aristas en %.0f ms.",
+                    len(_red), _red.aristas, (time.perf_counter() - t0) * 1000,
+                )
+        except Exception:
+            logger.exception("No se pudo cargar la red vial; se usa la distancia en línea recta.")
+            _red = None
+        _red_cargada = True
+    return _red
+
+
+def establecer_red_vial(red):
+    """Reemplaza la red del proceso (p. ej. tras preprocesar un extracto nuevo)."""
+    global _red, _red_cargada
+    with _lock_red:
+        _red, _red_cargada = red, True
+
+
+def ruta_vial(o_lat, o_lon, d_lat, d_lon):
+    """{'metros', 'segundos', 'puntos'} por la red vial, o None si no hay red o no se puede rutear."""
+    red = obtener_red_vial()
+    if red is None:
+        return None
+    return red.ruta(float(o_lat), float(o_lon), float(d_lat), float(d_lon))
+
+
+def matriz_km_vial(o_lats, o_lons, d_lats, d_lons, limite_km=np.inf):
+    """
+    Distancias por carretera (km) entre dos conjuntos de puntos, o None si no
+    hay red vial. Los pares sin camino valen np.inf y los que tienen un punto
+    fuera de la red np.nan (quien llama decide si usar la línea recta).
+    """
+    red = obtener_red_vial()
+    if red is None:
+        return None
+    metros = red.matriz_puntos(o_lats, o_lons, d_lats, d_lons, peso='metros', limite=limite_km * 1000)
+    return metros / 1000.0
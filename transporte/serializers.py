@@ -6,6 +6,7 @@ from .models import (
     SolicitudAsistencia, 
     MensajeViaje
 )
+from .geocercas import exigir_cobertura, punto_enviado
 
 # --- 1. Serializador de Vehículo (FALTABA ESTE) ---
 class VehiculoSerializer(serializers.ModelSerializer):
@@ -20,7 +21,8 @@ class ViajeSerializer(serializers.ModelSerializer):
     # Mapeo: 'origen' es lo que manda la App, 'nombre_origen' es lo que está en tu models.py
     origen = serializers.CharField(source='nombre_origen')
     destino = serializers.CharField(source='nombre_destino')
-    monto = serializers.DecimalField(source='tarifa_estimada', max_digits=10, decimal_places=2)
+    # La tarifa la calcula el servidor (transporte/tarifas.py); si la App manda 'monto' se ignora
+    monto = serializers.DecimalField(source='tarifa_estimada', max_digits=10, decimal_places=2, required=False)
 
     class Meta:
         model = Viaje
@@ -29,6 +31,16 @@ class ViajeSerializer(serializers.ModelSerializer):
             'monto', 'estado', 'origen_lat', 'origen_lon', 
             'destino_lat', 'destino_lon'
         ]
+        # El estado solo cambia por la capa de transiciones (acción 'estado' / aceptar)
+        read_only_fields = ['estado']
+
+    def validate(self, attrs):
+        # Origen y destino deben estar dentro de una zona de servicio (índice en memoria)
+        exigir_cobertura({
+            'origen_lat': punto_enviado(attrs, self.instance, 'origen_lat', 'origen_lon'),
+            'destino_lat': punto_enviado(attrs, self.instance, 'destino_lat', 'destino_lon'),
+        })
+        return attrs
 
 # --- 3. Serializador de Mensajes ---
 class MensajeViajeSerializer(serializers.ModelSerializer):
@@ -36,8 +48,8 @@ class MensajeViajeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MensajeViaje
-        fields = ['id', 'viaje', 'emisor', 'emisor_username', 'contenido', 'timestamp']
-        read_only_fields = ['emisor', 'timestamp']
+        fields = ['id', 'viaje', 'emisor', 'emisor_username', 'contenido', 'timestamp', 'secuencia']
+        read_only_fields = ['emisor', 'timestamp', 'secuencia']
 
 # --- 4. Serializador de Asistencia Vial ---
 class SolicitudAsistenciaSerializer(serializers.ModelSerializer):
@@ -51,4 +63,8 @@ class SolicitudAsistenciaSerializer(serializers.ModelSerializer):
             'tipo_asistencia', 'ubicacion_lat', 'ubicacion_lon', 
             'descripcion', 'estado', 'creado_en'
         ]
-        read_only_fields = ['proveedor', 'estado', 'creado_en']
\ No newline at end of file
+        read_only_fields = ['proveedor', 'estado', 'creado_en']
+
+    def validate(self, attrs):
+        exigir_cobertura({'ubicacion_lat': punto_enviado(attrs, self.instance, 'ubicacion_lat', 'ubicacion_lon')})
+        return attrs
\ No newline at end of file
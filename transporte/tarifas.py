@@ -0,0 +1,148 @@
+# transporte/tarifas.py
+
+import math
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+
+from domicilios.utils import calcular_distancia_haversine
+from .ruteo import ruta_vial
+
+# ----------------------------------------------------------------------
+# 1. Tablas de Precios por Defecto
+# ----------------------------------------------------------------------
+
+# Se pueden reemplazar (total o parcialmente) con settings.TARIFAS_VIAJE
+TARIFAS_POR_DEFECTO = {
+    'economy': {'base': '1.50', 'por_km': '0.60', 'minima': '2.50'},
+    'premium': {'base': '2.50', 'por_km': '0.95', 'minima': '4.00'},
+    'moto': {'base': '1.00', 'por_km': '0.40', 'minima': '1.50'},
+}
+
+# Multiplicador por franja horaria: (hora_inicio, hora_fin, multiplicador), fin exclusivo
+FRANJAS_POR_DEFECTO = (
+    (6, 9, '1.20'),    # Hora pico de la mañana
+    (17, 20, '1.25'),  # Hora pico de la tarde
+    (22, 24, '1.15'),  # Nocturno
+    (0, 5, '1.15'),
+)
+
+# La ruta real es más larga que la línea recta; factor medio de tortuosidad urbana
+# (solo se usa si no hay red vial cargada o el punto queda fuera de ella)
+FACTOR_RUTA = 1.3
+
+# Tamaño de la celda de cotización en grados (0.002° ≈ 220 m): dos puntos de la
+# misma celda reciben la misma tarifa, lo que permite reutilizar cotizaciones
+TAMANO_CELDA_COTIZACION = 0.002
+
+# Máximo de cotizaciones (celda origen, celda destino, servicio, hora) en memoria
+MAXIMO_COTIZACIONES_CACHE = 50000
+
+CENTAVOS = Decimal('0.01')
+
+
+# ----------------------------------------------------------------------
+# 2. Tablas Compiladas (se cargan una vez por proceso)
+# ----------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def tablas_tarifas():
+    """
+    Devuelve (tarifas, multiplicador_por_hora): las tarifas por servicio en
+    Decimal y una tupla de 24 multiplicadores, de modo que cotizar no
+    vuelva a leer settings ni a recorrer las franjas.
+    """
+    configuradas = getattr(settings, 'TARIFAS_VIAJE', {}) or {}
+    tarifas = {}
+    for servicio, valores in TARIFAS_POR_DEFECTO.items():
+        combinados = dict(valores, **configuradas.get(servicio, {}))
+        tarifas[servicio] = {clave: Decimal(str(valor)) for clave, valor in combinados.items()}
+
+    multiplicadores = [Decimal('1')] * 24
+    for inicio, fin, multiplicador in getattr(settings, 'FRANJAS_TARIFA_VIAJE', FRANJAS_POR_DEFECTO):
+        for hora in range(inicio, fin):
+            multiplicadores[hora] = Decimal(str(multiplicador))
+
+    return tarifas, tuple(multiplicadores)
+
+
+def recargar_tablas():
+    """Vuelve a leer las tablas (p. ej. tras cambiar settings en caliente) y vacía las cotizaciones."""
+    tablas_tarifas.cache_clear()
+    _cotizar_celdas.cache_clear()
+
+
+def hora_actual():
+    ahora = timezone.localtime() if settings.USE_TZ else timezone.now()
+    return ahora.hour
+
+
+# ----------------------------------------------------------------------
+# 3. Cotización
+# ----------------------------------------------------------------------
+
+def celda_cotizacion(lat, lon):
+    return (
+        math.floor(float(lat) / TAMANO_CELDA_COTIZACION),
+        math.floor(float(lon) / TAMANO_CELDA_COTIZACION),
+    )
+
+
+def _centro(celda):
+    return ((celda[0] + 0.5) * TAMANO_CELDA_COTIZACION, (celda[1] + 0.5) * TAMANO_CELDA_COTIZACION)
+
+
+@lru_cache(maxsize=MAXIMO_COTIZACIONES_CACHE)
+def _cotizar_celdas(celda_origen, celda_destino, tipo_servicio, hora):
+    """
+    (distancia_km, tarifa) entre los centros de dos celdas; memorizada en LRU.
+    La distancia es la de la ruta más rápida por la red vial (transporte/ruteo.py)
+    y, sin red, la línea recta por FACTOR_RUTA.
+    """
+    tarifas, multiplicadores = tablas_tarifas()
+    tabla = tarifas[tipo_servicio]
+
+    ruta = ruta_vial(*_centro(celda_origen), *_centro(celda_destino))
+    if ruta is not None:
+        distancia_km = ruta['metros'] / 1000
+    else:
+        distancia_km = calcular_distancia_haversine(*_centro(celda_origen), *_centro(celda_destino)) * FACTOR_RUTA
+    tarifa = (tabla['base'] + tabla['por_km'] * Decimal(str(round(distancia_km, 3)))) * multiplicadores[hora]
+    tarifa = max(tarifa, tabla['minima']).quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+    return round(distancia_km, 2), tarifa
+
+
+def cotizar(origen_lat, origen_lon, destino_lat, destino_lon, tipo_servicio='economy', hora=None):
+    """Tarifa estimada (Decimal) de un viaje. Lanza KeyError si el servicio no existe."""
+    return cotizar_con_distancia(origen_lat, origen_lon, destino_lat, destino_lon, tipo_servicio, hora)[1]
+
+
+def cotizar_con_distancia(origen_lat, origen_lon, destino_lat, destino_lon, tipo_servicio='economy', hora=None):
+    """Igual que cotizar() pero devuelve (distancia_km estimada, tarifa)."""
+    if tipo_servicio not in tablas_tarifas()[0]:
+        raise KeyError(tipo_servicio)
+    return _cotizar_celdas(
+        celda_cotizacion(origen_lat, origen_lon),
+        celda_cotizacion(destino_lat, destino_lon),
+        tipo_servicio,
+        hora_actual() if hora is None else hora,
+    )
+
+
+def cotizar_todos(origen_lat, origen_lon, destino_lat, destino_lon, hora=None):
+    """{'distancia_km': ..., 'tarifas': {servicio: tarifa}} para todos los tipos de servicio."""
+    hora = hora_actual() if hora is None else hora
+    tarifas = {}
+    distancia_km = 0.0
+    for servicio in tablas_tarifas()[0]:
+        distancia_km, tarifas[servicio] = cotizar_con_distancia(
+            origen_lat, origen_lon, destino_lat, destino_lon, servicio, hora
+        )
+    return {'distancia_km': distancia_km, 'hora': hora, 'tarifas': tarifas}
+
+
+def estadisticas_cache():
+    info = _cotizar_celdas.cache_info()
+    return {'aciertos': info.hits, 'fallos': info.misses, 'tamano': info.currsize, 'maximo': info.maxsize}
@@ -1,3 +1,106 @@
-from django.test import TestCase
+import asyncio
+import multiprocessing
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from SuperService.capa_canales import CapaSocketsUnix
+from usuarios.models import UsuarioPersonalizado
+from .geocercas import indice_geocercas
+from .models import Viaje, ZonaServicio
+
+GRUPO = 'prueba'
+
+
+def _proceso_miembro(directorio, listo, recibidos, fin):
+    """Proceso hijo: une un canal al grupo y devuelve los dos primeros mensajes que recibe."""
+    async def principal():
+        capa = CapaSocketsUnix(directorio=directorio)
+        canal = await capa.new_channel()
+        await capa.group_add(GRUPO, canal)
+        listo.put(canal)
+        for _ in range(2):
+            recibidos.put(await asyncio.wait_for(capa.receive(canal), 10))
+        # Sigue conectado hasta que el padre cierre su nodo
+        await asyncio.to_thread(fin.wait, 10)
+
+    asyncio.run(principal())
+
+
+class CapaSocketsUnixDosProcesosTests(SimpleTestCase):
+    """Entrega entre dos procesos reales, como en benchmark_capa_canales."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(prefix='canales-')
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        contexto = multiprocessing.get_context('fork')
+        self.listo, self.recibidos, self.fin = contexto.Queue(), contexto.Queue(), contexto.Event()
+        self.hijo = contexto.Process(
+            target=_proceso_miembro, args=(self.directorio, self.listo, self.recibidos, self.fin)
+        )
+        self.hijo.start()
+        self.addCleanup(self._terminar_hijo)
+
+    def _terminar_hijo(self):
+        self.fin.set()
+        self.hijo.join(timeout=5)
+        if self.hijo.is_alive():
+            self.hijo.terminate()
+
+    def test_group_send_y_send_llegan_al_otro_proceso_y_el_cierre_es_limpio(self):
+        canal_hijo = self.listo.get(timeout=10)
+        capa = CapaSocketsUnix(directorio=self.directorio)
+
+        async def enviar():
+            await capa.new_channel()
+            # Se espera a conocer la suscripción del hijo (llega con su presentación)
+            limite = time.monotonic() + 10
+            while not capa._remotos.get(GRUPO):
+                self.assertLess(time.monotonic(), limite, "La suscripción del hijo no llegó.")
+                await asyncio.sleep(0.01)
+            await capa.group_send(GRUPO, {'type': 'grupo', 'datos': [1, 2]})
+            await capa.send(canal_hijo, {'type': 'directo', 'datos': 'hola'})
+
+        asyncio.run(enviar())
+        recibidos = [self.recibidos.get(timeout=10) for _ in range(2)]
+        self.assertEqual(recibidos, [
+            {'type': 'grupo', 'datos': [1, 2]},
+            {'type': 'directo', 'datos': 'hola'},
+        ])
+
+        # Con el hijo aún conectado: cerrar el nodo no debe registrar errores de asyncio
+        self.assertTrue(capa._nodo._lectores)
+        with self.assertNoLogs('asyncio', level='ERROR'):
+            capa._nodo.detener()
+
+
+# Las plantillas usan {% static %}: sin collectstatic no hay manifiesto
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SolicitarViajeFormularioTests(TestCase):
+    """El formulario web valida la cobertura y cotiza en el servidor."""
+
+    def setUp(self):
+        ZonaServicio.objects.create(nombre='Caracas', poligono=[[10.4, -67.0], [10.6, -67.0], [10.6, -66.8], [10.4, -66.8]])
+        indice_geocercas.invalidar()
+        self.addCleanup(indice_geocercas.invalidar)
+        self.cliente = UsuarioPersonalizado.objects.create_user('cliente', password='x')
+        self.client.force_login(self.cliente)
+
+    def solicitar(self, origen, destino):
+        return self.client.post('/transporte/viaje/solicitar/', {
+            'tipo_servicio': 'economy', 'origen_lat_lng': origen, 'destino_lat_lng': destino,
+            'nombre_origen': 'Casa', 'nombre_destino': 'Oficina',
+        })
+
+    def test_dentro_de_zona_crea_el_viaje_con_tarifa_del_servidor(self):
+        respuesta = self.solicitar('10.48, -66.90', '10.50, -66.85')
+        viaje = Viaje.objects.get(cliente=self.cliente)
+        self.assertRedirects(respuesta, f'/transporte/viaje/{viaje.pk}/', fetch_redirect_response=False)
+        self.assertGreater(viaje.tarifa_estimada, 0)
+
+    def test_fuera_de_zona_o_no_finito_no_crea_el_viaje(self):
+        for destino in ('11.50, -66.85', 'NaN, -66.85'):
+            self.assertEqual(self.solicitar('10.48, -66.90', destino).status_code, 200)
+        self.assertFalse(Viaje.objects.exists())
@@ -0,0 +1,420 @@
+# transporte/transiciones.py
+
+import logging
+import threading
+import time
+from operator import attrgetter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Transiciones Permitidas
+# ----------------------------------------------------------------------
+
+# Modelo de cada tipo de evento (mismas etiquetas que las ofertas en cascada)
+MODELOS_POR_TIPO = {
+    'viaje': 'transporte.Viaje',
+    'asistencia': 'transporte.SolicitudAsistencia',
+    'pedido': 'domicilios.Pedido',
+    'lote': 'domicilios.LoteEntrega',
+}
+
+# estado actual -> estados a los que se puede pasar
+TRANSICIONES = {
+    # Un viaje solo se completa desde 'en_curso': así queda sellado iniciado_en (eta.py)
+    'viaje': {
+        'solicitado': {'aceptado', 'cancelado'},
+        'aceptado': {'en_ruta_origen', 'en_curso', 'cancelado'},
+        'en_ruta_origen': {'en_curso', 'cancelado'},
+        'en_curso': {'completado'},
+    },
+    # Una asistencia se puede cerrar sin pasar por 'en_curso' (FinalizarAsistenciaView)
+    'asistencia': {
+        'solicitado': {'aceptado', 'cancelado'},
+        'aceptado': {'en_ruta_origen', 'en_curso', 'completado', 'cancelado'},
+        'en_ruta_origen': {'en_curso', 'completado', 'cancelado'},
+        'en_curso': {'completado'},
+    },
+    'pedido': {
+        'pendiente': {'preparando', 'cancelado'},
+        'preparando': {'listo', 'en_camino', 'cancelado'},
+        'listo': {'en_camino', 'cancelado'},
+        'en_camino': {'entregado'},
+    },
+    'lote': {
+        'solicitado': {'aceptado', 'cancelado'},
+        'aceptado': {'completado', 'cancelado'},
+    },
+}
+
+# Vida máxima de los participantes en caché. Las asignaciones hechas en ESTE
+# proceso la invalidan al instante; el TTL cubre las de otros procesos/workers.
+TTL_PARTICIPANTES_S = 120
+
+# Entradas a partir de las cuales se purgan las vencidas
+MAXIMO_PARTICIPANTES = 50000
+
+# Campos con los usuarios que pueden seguir los eventos de cada tipo
+PARTICIPANTES = {
+    'viaje': ('cliente_id', 'conductor_id'),
+    'asistencia': ('cliente_id', 'proveedor_id'),
+    'pedido': ('cliente_id', 'repartidor_id'),
+    'lote': ('repartidor_id',),
+}
+
+
+# Quién puede pedir cada estado por la API (atributos del objeto con el usuario);
+# '*' vale para el resto. 'aceptado' no está: se toma con la acción 'aceptar'.
+SOLICITANTES = {
+    'viaje': {'cancelado': ('cliente_id', 'conductor_id'), '*': ('conductor_id',)},
+    'asistencia': {'cancelado': ('cliente_id', 'proveedor_id'), '*': ('proveedor_id',)},
+    'pedido': {
+        'cancelado': ('cliente_id', 'comercio.propietario_id'),
+        'preparando': ('comercio.propietario_id',),
+        'listo': ('comercio.propietario_id',),
+        '*': ('repartidor_id',),
+    },
+    'lote': {'*': ('repartidor_id',)},
+}
+
+
+class TransicionInvalida(Exception):
+    """El cambio de estado no está permitido (o el objeto cambió mientras tanto)."""
+
+
+def tipo_de(modelo):
+    """'viaje', 'asistencia', 'pedido' o 'lote' para una clase o instancia de modelo."""
+    etiqueta = modelo._meta.label_lower
+    for tipo, nombre in MODELOS_POR_TIPO.items():
+        if nombre.lower() == etiqueta:
+            return tipo
+    raise KeyError(f"{modelo._meta.label} no tiene eventos de estado.")
+
+
+def modelo_de(tipo):
+    from django.apps import apps
+    return apps.get_model(MODELOS_POR_TIPO[tipo])
+
+
+def permitida(tipo, actual, nuevo):
+    return nuevo in TRANSICIONES[tipo].get(actual, ())
+
+
+def grupo_estado(tipo, objeto_id):
+    """Grupo de Channels con los suscriptores de un objeto (lo une EstadoConsumer)."""
+    return f'estado_{tipo}_{objeto_id}'
+
+
+# ----------------------------------------------------------------------
+# 2. Registro y Publicación de Eventos
+# ----------------------------------------------------------------------
+
+def datos_evento(evento):
+    """Contenido del evento tal como lo reciben los clientes (solo tipos serializables)."""
+    return {
+        'id': evento.pk,
+        'tipo': evento.tipo,
+        'objeto_id': evento.objeto_id,
+        'anterior': evento.estado_anterior,
+        'estado': evento.estado_nuevo,
+        'actor': evento.actor_id,
+        'datos': evento.datos,
+        'creado_en': evento.creado_en.isoformat(),
+    }
+
+
+def publicar_eventos(eventos):
+    """Envía cada evento al grupo de su objeto. Se llama tras el commit."""
+    capa = get_channel_layer()
+    if capa is None:
+        return
+    for evento in eventos:
+        try:
+            async_to_sync(capa.group_send)(
+                grupo_estado(evento.tipo, evento.objeto_id),
+                {'type': 'estado_evento', 'evento': datos_evento(evento)},
+            )
+        except Exception:
+            # El evento ya quedó en la tabla: quien no lo reciba lo recupera al reconectar
+            logger.exception("No se pudo publicar el evento de estado %s.", evento.pk)
+
+
+def registrar_eventos(tipo, cambios, actor_ids=None, datos=None):
+    """
+    Agrega en un solo INSERT los eventos de varios objetos que ya cambiaron
+    de estado (p. ej. por un UPDATE condicional) y los publica tras el
+    commit. 'cambios' es una lista de (objeto_id, estado_anterior, estado_nuevo);
+    'actor_ids' un dict opcional objeto_id -> usuario_id.
+    """
+    from .models import EventoEstado
+
+    if not cambios:
+        return []
+    actor_ids = actor_ids or {}
+    eventos = EventoEstado.objects.bulk_create([
+        EventoEstado(
+            tipo=tipo, objeto_id=objeto_id, estado_anterior=anterior or '', estado_nuevo=nuevo,
+            actor_id=actor_ids.get(objeto_id), datos=datos or {},
+        )
+        for objeto_id, anterior, nuevo in cambios
+    ])
+    # bulk_create no asigna la pk en todos los motores: se releen si hace falta
+    if any(evento.pk is None for evento in eventos):
+        eventos = list(
+            EventoEstado.objects.filter(tipo=tipo, objeto_id__in=[c[0] for c in cambios]).order_by('-id')[:len(cambios)]
+        )[::-1]
+    transaction.on_commit(lambda: publicar_eventos(eventos))
+    # Una aceptación cambia quién participa (conductor, proveedor o repartidor)
+    transaction.on_commit(lambda: participantes.invalidar(tipo, *[c[0] for c in cambios]))
+    return eventos
+
+
+# ----------------------------------------------------------------------
+# 3. Transición de Estado
+# ----------------------------------------------------------------------
+
+def transicionar(objeto, nuevo_estado, actor=None, datos=None, **campos):
+    """
+    Único punto para cambiar el estado de un Viaje, SolicitudAsistencia,
+    Pedido o LoteEntrega fuera de la aceptación por UPDATE condicional:
+
+    1. Bloquea la fila (select_for_update) y comprueba que el paso desde el
+       estado ACTUAL en la BD esté permitido; si no, TransicionInvalida.
+    2. Guarda con save(update_fields=...), así que las señales (demanda,
+       cola de asistencias, trazas) y el sellado de tiempos siguen igual.
+    3. Agrega un EventoEstado y lo publica en el grupo del objeto al hacer commit.
+
+    'campos' se asignan en el mismo save (p. ej. tarifa_final=...).
+    Devuelve la instancia actualizada.
+    """
+    from .models import EventoEstado
+
+    modelo = type(objeto)
+    tipo = tipo_de(modelo)
+
+    with transaction.atomic():
+        fila = modelo.objects.select_for_update().get(pk=objeto.pk)
+        anterior = fila.estado
+        if not permitida(tipo, anterior, nuevo_estado):
+            raise TransicionInvalida(
+                f"No se puede pasar de '{anterior}' a '{nuevo_estado}' ({tipo} #{objeto.pk})."
+            )
+        fila.estado = nuevo_estado
+        for campo, valor in campos.items():
+            setattr(fila, campo, valor)
+        fila.save(update_fields=['estado', *campos])
+
+        evento = EventoEstado.objects.create(
+            tipo=tipo, objeto_id=fila.pk, estado_anterior=anterior, estado_nuevo=nuevo_estado,
+            actor=actor if getattr(actor, 'is_authenticated', False) else None, datos=datos or {},
+        )
+        transaction.on_commit(lambda: publicar_eventos([evento]))
+
+    # La instancia del llamador queda al día con lo guardado
+    objeto.estado = fila.estado
+    for campo in campos:
+        setattr(objeto, campo, getattr(fila, campo))
+    for campo in ('iniciado_en', 'finalizado_en'):
+        if hasattr(fila, campo):
+            setattr(objeto, campo, getattr(fila, campo))
+    return objeto
+
+
+# ----------------------------------------------------------------------
+# 4. Lectura
+# ----------------------------------------------------------------------
+
+def es_participante(usuario, tipo, objeto_id):
+    """True si el usuario es staff o figura en el objeto (cliente, conductor, proveedor o repartidor)."""
+    if usuario.is_staff:
+        return True
+    return usuario.pk in participantes.obtener(tipo, objeto_id).usuarios
+
+
+def eventos_de(tipo, objeto_id, desde=0, limite=100):
+    """Eventos de un objeto posteriores al id 'desde', del más antiguo al más nuevo."""
+    from .models import EventoEstado
+
+    return [
+        datos_evento(evento)
+        for evento in EventoEstado.objects.filter(tipo=tipo, objeto_id=objeto_id, id__gt=desde).order_by('id')[:limite]
+    ]
+
+
+# ----------------------------------------------------------------------
+# 5. Participantes (caché por proceso)
+# ----------------------------------------------------------------------
+
+class EntradaParticipantes:
+    """Usuarios de un objeto en un momento dado. 'existe' es False si el objeto no está en la BD."""
+    __slots__ = ('usuarios', 'existe', 'vence')
+
+    def __init__(self, usuarios, existe, vence):
+        self.usuarios = usuarios
+        self.existe = existe
+        self.vence = vence
+
+
+class CacheParticipantes:
+    """
+    Participantes de cada viaje, asistencia, pedido o lote, leídos una vez
+    y compartidos por todas las conexiones del proceso. Una entrada se
+    reemplaza (nunca se modifica) al vencer o al invalidarse, así que quien
+    guardó la suya sabe que sigue vigente comparando identidad, sin tocar la BD.
+    """
+
+    def __init__(self, ttl=TTL_PARTICIPANTES_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = {}
+
+    def vigente(self, tipo, objeto_id):
+        """La entrada en caché si no venció, o None. Solo memoria."""
+        entrada = self._entradas.get((tipo, int(objeto_id)))
+        if entrada is not None and entrada.vence > time.monotonic():
+            return entrada
+        return None
+
+    def obtener(self, tipo, objeto_id):
+        """Entrada vigente; si no hay, la lee de la BD (una consulta) y la guarda."""
+        entrada = self.vigente(tipo, objeto_id)
+        if entrada is not None:
+            return entrada
+
+        valores = modelo_de(tipo).objects.filter(pk=objeto_id).values_list(*PARTICIPANTES[tipo]).first()
+        entrada = EntradaParticipantes(
+            frozenset(v for v in valores or () if v is not None), valores is not None,
+            time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            if len(self._entradas) >= MAXIMO_PARTICIPANTES:
+                ahora = time.monotonic()
+                self._entradas = {clave: e for clave, e in self._entradas.items() if e.vence > ahora}
+            self._entradas[(tipo, int(objeto_id))] = entrada
+        return entrada
+
+    def invalidar(self, tipo, *objeto_ids):
+        with self._lock:
+            for objeto_id in objeto_ids:
+                self._entradas.pop((tipo, int(objeto_id)), None)
+
+
+participantes = CacheParticipantes()
+
+
+class SesionParticipante:
+    """
+    Autorización de una conexión (chat, estado) resuelta en connect():
+    guarda la entrada de la caché con la que se autorizó. Mientras esa
+    entrada siga siendo la vigente, cada mensaje se valida solo en memoria;
+    tras una reasignación o al vencer el TTL hay que volver a resolverla.
+    """
+    __slots__ = ('usuario', 'tipo', 'objeto_id', 'entrada')
+
+    def __init__(self, usuario, tipo, objeto_id):
+        self.usuario = usuario
+        self.tipo = tipo
+        self.objeto_id = int(objeto_id)
+        self.entrada = None
+
+    def resolver(self):
+        """(Síncrono, puede consultar la BD.) True si el usuario puede participar."""
+        self.entrada = participantes.obtener(self.tipo, self.objeto_id)
+        return self.autorizado()
+
+    def autorizado(self):
+        if not self.entrada.existe:
+            return False
+        return self.usuario.is_staff or self.usuario.pk in self.entrada.usuarios
+
+    def vigente(self):
+        """True si la autorización sigue valiendo sin volver a la BD."""
+        return self.entrada is not None and participantes.vigente(self.tipo, self.objeto_id) is self.entrada
+
+
+@receiver(post_save, sender='transporte.Viaje')
+@receiver(post_save, sender='transporte.SolicitudAsistencia')
+@receiver(post_save, sender='domicilios.Pedido')
+@receiver(post_save, sender='domicilios.LoteEntrega')
+def invalidar_participantes(sender, instance, update_fields=None, **kwargs):
+    tipo = tipo_de(sender)
+    # Los saves de solo estado (transicionar) no cambian quién participa
+    campos = {*PARTICIPANTES[tipo], *(c[:-3] for c in PARTICIPANTES[tipo])}
+    if update_fields is not None and not campos & set(update_fields):
+        return
+    transaction.on_commit(lambda: participantes.invalidar(tipo, instance.pk))
+
+
+# ----------------------------------------------------------------------
+# 6. Alta de Solicitudes
+# ----------------------------------------------------------------------
+# La creación (sin estado anterior) también es un evento del registro de cambios.
+
+@receiver(post_save, sender='transporte.Viaje')
+@receiver(post_save, sender='transporte.SolicitudAsistencia')
+@receiver(post_save, sender='domicilios.Pedido')
+@receiver(post_save, sender='domicilios.LoteEntrega')
+def registrar_alta(sender, instance, created, **kwargs):
+    if created:
+        registrar_eventos(
+            tipo_de(sender), [(instance.pk, '', instance.estado)],
+            {instance.pk: getattr(instance, 'cliente_id', None)},
+        )
+
+
+# ----------------------------------------------------------------------
+# 7. Acciones de API Compartidas
+# ----------------------------------------------------------------------
+
+def puede_solicitar(usuario, objeto, tipo, nuevo_estado):
+    if usuario.is_staff:
+        return True
+    reglas = SOLICITANTES[tipo]
+    campos = reglas.get(nuevo_estado, reglas['*'])
+    return any(attrgetter(campo)(objeto) == usuario.pk for campo in campos)
+
+
+class AccionesEstadoMixin:
+    """
+    Acciones para los ViewSets de objetos con eventos de estado:
+    - POST <id>/estado/ {"estado": ...}: transición validada (409 si no se permite).
+    - GET <id>/eventos/?desde=<evento_id>: eventos posteriores, del más antiguo al más nuevo.
+    """
+
+    @action(detail=True, methods=['post'], url_path='estado', permission_classes=[IsAuthenticated])
+    def cambiar_estado(self, request, pk=None):
+        objeto = self.get_object()
+        tipo = tipo_de(objeto)
+        nuevo_estado = request.data.get('estado')
+        if nuevo_estado not in {e for destinos in TRANSICIONES[tipo].values() for e in destinos} or nuevo_estado == 'aceptado':
+            return Response({"error": "Estado no válido para esta acción."}, status=status.HTTP_400_BAD_REQUEST)
+        if not puede_solicitar(request.user, objeto, tipo, nuevo_estado):
+            return Response({"error": "No puedes pedir este cambio de estado."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            transicionar(objeto, nuevo_estado, actor=request.user)
+        except TransicionInvalida as error:
+            return Response({"error": str(error)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(objeto).data)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def eventos(self, request, pk=None):
+        objeto = self.get_object()
+        tipo = tipo_de(objeto)
+        if not es_participante(request.user, tipo, objeto.pk):
+            return Response({"error": "No participas en este servicio."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            desde = int(request.query_params.get('desde', 0))
+        except ValueError:
+            desde = 0
+        return Response(eventos_de(tipo, objeto.pk, desde))
@@ -0,0 +1,241 @@
+# transporte/trazas.py
+
+import logging
+import math
+
+import numpy as np
+from django.db.models import Case, When, Value, F, IntegerField, TextField
+from django.db.models.functions import Concat
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Estados en los que las pings del conductor se anexan a la traza del viaje
+ESTADOS_CON_TRAZA = ['aceptado', 'en_ruta_origen', 'en_curso']
+
+# Tolerancia inicial de Douglas-Peucker (metros)
+TOLERANCIA_COMPACTACION_M = 8.0
+
+# Tope de puntos de una traza compactada (se sube la tolerancia hasta cumplirlo)
+MAXIMO_PUNTOS_COMPACTADA = 400
+
+ESCALA = 1e5
+RADIO_TIERRA_M = 6371000.0
+
+
+# ----------------------------------------------------------------------
+# 2. Polilínea Codificada (algoritmo de Google)
+# ----------------------------------------------------------------------
+
+def _codificar_valor(valor):
+    valor = ~(valor << 1) if valor < 0 else (valor << 1)
+    trozos = []
+    while valor >= 0x20:
+        trozos.append(chr((0x20 | (valor & 0x1f)) + 63))
+        valor >>= 5
+    trozos.append(chr(valor + 63))
+    return ''.join(trozos)
+
+
+def codificar_polilinea(puntos, previo=(0, 0)):
+    """
+    Codifica [(lat, lon), ...] como deltas respecto del punto anterior.
+    'previo' es el último punto ya codificado (enteros ×1e5), lo que permite
+    anexar texto a una polilínea existente. Devuelve (texto, ultimo_e5).
+    """
+    lat_previa, lon_previa = previo
+    trozos = []
+    for lat, lon in puntos:
+        lat_e5 = int(round(lat * ESCALA))
+        lon_e5 = int(round(lon * ESCALA))
+        trozos.append(_codificar_valor(lat_e5 - lat_previa))
+        trozos.append(_codificar_valor(lon_e5 - lon_previa))
+        lat_previa, lon_previa = lat_e5, lon_e5
+    return ''.join(trozos), (lat_previa, lon_previa)
+
+
+def decodificar_polilinea(texto):
+    """Devuelve [(lat, lon), ...] a partir de una polilínea codificada."""
+    puntos = []
+    indice = lat = lon = 0
+    largo = len(texto)
+    while indice < largo:
+        delta = []
+        for _ in range(2):
+            resultado = desplazamiento = 0
+            while True:
+                byte = ord(texto[indice]) - 63
+                indice += 1
+                resultado |= (byte & 0x1f) << desplazamiento
+                desplazamiento += 5
+                if byte < 0x20:
+                    break
+            delta.append(~(resultado >> 1) if resultado & 1 else resultado >> 1)
+        lat += delta[0]
+        lon += delta[1]
+        puntos.append((lat / ESCALA, lon / ESCALA))
+    return puntos
+
+
+# ----------------------------------------------------------------------
+# 3. Simplificación Douglas-Peucker
+# ----------------------------------------------------------------------
+
+def douglas_peucker(puntos, tolerancia_m):
+    """
+    Índices de los puntos que se conservan. Se proyecta a metros con una
+    equirectangular local (suficiente a escala de ciudad) y se recorre con
+    una pila en lugar de recursión para trazas de miles de puntos.
+    """
+    n = len(puntos)
+    if n <= 2:
+        return list(range(n))
+
+    coords = np.asarray(puntos, dtype=np.float64)
+    lat0 = math.radians(coords[:, 0].mean())
+    y = np.radians(coords[:, 0]) * RADIO_TIERRA_M
+    x = np.radians(coords[:, 1]) * RADIO_TIERRA_M * math.cos(lat0)
+
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin - inicio < 2:
+            continue
+        dx, dy = x[fin] - x[inicio], y[fin] - y[inicio]
+        px, py = x[inicio + 1:fin] - x[inicio], y[inicio + 1:fin] - y[inicio]
+        largo = math.hypot(dx, dy)
+        if largo == 0:
+            distancias = np.hypot(px, py)
+        else:
+            distancias = np.abs(dx * py - dy * px) / largo
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia_m:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pila.append((inicio, medio))
+            pila.append((medio, fin))
+
+    return np.flatnonzero(conservar).tolist()
+
+
+def compactar_puntos(puntos, tolerancia_m=TOLERANCIA_COMPACTACION_M, maximo=MAXIMO_PUNTOS_COMPACTADA):
+    """Simplifica la traza subiendo la tolerancia hasta quedar en 'maximo' puntos o menos."""
+    indices = douglas_peucker(puntos, tolerancia_m)
+    while len(indices) > maximo:
+        tolerancia_m *= 2
+        indices = douglas_peucker(puntos, tolerancia_m)
+    return [puntos[i] for i in indices]
+
+
+# ----------------------------------------------------------------------
+# 4. Escritura: Anexar Pings a las Trazas Activas
+# ----------------------------------------------------------------------
+
+def anexar_muestras(muestras_por_conductor):
+    """
+    Anexa las pings pendientes {conductor_id: [(marca, lat, lon), ...]} a la
+    traza del viaje activo de cada conductor. Son tres consultas por lote sin
+    importar cuántos viajes haya: viajes activos, últimos puntos y un UPDATE
+    con CASE que concatena solo el texto nuevo (no reescribe la traza).
+    Devuelve el número de trazas actualizadas.
+    """
+    from .models import Viaje, TrazaViaje
+
+    if not muestras_por_conductor:
+        return 0
+
+    viaje_por_conductor = dict(
+        Viaje.objects.filter(
+            conductor_id__in=list(muestras_por_conductor), estado__in=ESTADOS_CON_TRAZA
+        ).values_list('conductor_id', 'id')
+    )
+    if not viaje_por_conductor:
+        return 0
+
+    viaje_ids = list(viaje_por_conductor.values())
+    existentes = {
+        viaje_id: (traza_id, (lat_e5, lon_e5))
+        for traza_id, viaje_id, lat_e5, lon_e5 in TrazaViaje.objects.filter(viaje_id__in=viaje_ids)
+        .values_list('id', 'viaje_id', 'ultimo_lat_e5', 'ultimo_lon_e5')
+    }
+
+    nuevas = []
+    anexos = {}
+    for conductor_id, viaje_id in viaje_por_conductor.items():
+        puntos = [(lat, lon) for _, lat, lon in muestras_por_conductor[conductor_id]]
+        if viaje_id in existentes:
+            traza_id, previo = existentes[viaje_id]
+            texto, ultimo = codificar_polilinea(puntos, previo)
+            anexos[traza_id] = (texto, len(puntos), ultimo)
+        else:
+            texto, ultimo = codificar_polilinea(puntos)
+            nuevas.append(TrazaViaje(
+                viaje_id=viaje_id, polilinea=texto, num_puntos=len(puntos),
+                ultimo_lat_e5=ultimo[0], ultimo_lon_e5=ultimo[1],
+            ))
+
+    if nuevas:
+        TrazaViaje.objects.bulk_create(nuevas, ignore_conflicts=True)
+    if anexos:
+        TrazaViaje.objects.filter(pk__in=list(anexos), compactada=False).update(
+            polilinea=Concat(
+                F('polilinea'),
+                Case(*[When(pk=t, then=Value(a[0])) for t, a in anexos.items()], output_field=TextField()),
+                output_field=TextField(),
+            ),
+            num_puntos=F('num_puntos') + Case(
+                *[When(pk=t, then=Value(a[1])) for t, a in anexos.items()], output_field=IntegerField()
+            ),
+            ultimo_lat_e5=Case(*[When(pk=t, then=Value(a[2][0])) for t, a in anexos.items()]),
+            ultimo_lon_e5=Case(*[When(pk=t, then=Value(a[2][1])) for t, a in anexos.items()]),
+            actualizada_en=timezone.now(),
+        )
+    return len(nuevas) + len(anexos)
+
+
+# ----------------------------------------------------------------------
+# 5. Compactación y Lectura
+# ----------------------------------------------------------------------
+
+def compactar_traza(viaje_id):
+    """Reemplaza la traza cruda por su versión Douglas-Peucker. Devuelve la traza o None."""
+    from .models import TrazaViaje
+
+    traza = TrazaViaje.objects.filter(viaje_id=viaje_id, compactada=False).first()
+    if traza is None:
+        return None
+
+    puntos = decodificar_polilinea(traza.polilinea)
+    simplificados = compactar_puntos(puntos)
+    traza.polilinea, ultimo = codificar_polilinea(simplificados)
+    traza.ultimo_lat_e5, traza.ultimo_lon_e5 = ultimo
+    traza.puntos_originales = len(puntos)
+    traza.num_puntos = len(simplificados)
+    traza.compactada = True
+    traza.save()
+    return traza
+
+
+def ruta_de_viaje(viaje_id):
+    """[[lat, lon], ...] de la traza del viaje (una sola lectura) o lista vacía."""
+    from .models import TrazaViaje
+
+    polilinea = TrazaViaje.objects.filter(viaje_id=viaje_id).values_list('polilinea', flat=True).first()
+    return [list(punto) for punto in decodificar_polilinea(polilinea)] if polilinea else []
+
+
+@receiver(post_save, sender='transporte.Viaje')
+def compactar_al_completar(sender, instance, **kwargs):
+    if instance.estado == 'completado':
+        try:
+            compactar_traza(instance.pk)
+        except Exception:
+            logger.exception("No se pudo compactar la traza del viaje %s.", instance.pk)
@@ -0,0 +1,187 @@
+# transporte/ubicaciones.py
+
+import asyncio
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.conf import settings
+
+from .despacho import indice_conductores
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 1. Parámetros de Ingesta
+# ----------------------------------------------------------------------
+
+# Muestras recientes que se conservan en memoria por conductor
+TAMANO_BUFFER = 120
+
+# Cada cuánto se vuelcan a la BD las posiciones pendientes (segundos)
+INTERVALO_VACIADO_S = 2.0
+
+# Filas por sentencia UPDATE en bulk_update
+TAMANO_LOTE_BD = 500
+
+CUANTIZADOR = Decimal('0.000001')
+
+
+def fecha_de_marca(marca):
+    """Convierte un time.time() en datetime respetando USE_TZ."""
+    if settings.USE_TZ:
+        return datetime.fromtimestamp(marca, tz=timezone.utc)
+    return datetime.fromtimestamp(marca)
+
+
+# ----------------------------------------------------------------------
+# 2. Registro de Ubicaciones en Vivo (Write-Behind)
+# ----------------------------------------------------------------------
+
+class RegistroUbicaciones:
+    """
+    Recibe las pings de GPS de los conductores y las absorbe en memoria:
+
+    - Un buffer circular (deque con maxlen) por conductor con las últimas muestras.
+    - Un diccionario de posiciones "sucias" que solo guarda la más reciente
+      por conductor; cien pings del mismo conductor entre dos vaciados se
+      convierten en UNA fila del bulk_update.
+    - Las muestras recibidas desde el último vaciado, que se anexan en bloque
+      a la traza del viaje activo del conductor (transporte/trazas.py).
+
+    El vaciado lo hace una tarea asyncio cada INTERVALO_VACIADO_S, de modo que
+    la BD recibe como mucho una sentencia por lote y no una por ping.
+    """
+
+    def __init__(self, tamano_buffer=TAMANO_BUFFER, intervalo=INTERVALO_VACIADO_S):
+        self.tamano_buffer = tamano_buffer
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._pendientes = {}
+        self._trazas_pendientes = {}
+        self._ultimo_vaciado = time.monotonic()
+        self._tarea = None
+
+    def registrar(self, conductor_id, lat, lon):
+        """
+        Registra una ping. Solo toca memoria (O(1)); devuelve la muestra guardada.
+        ValueError si la posición no es finita o está fuera de rango: una sola
+        muestra así haría fallar el vaciado de todo el lote.
+        """
+        lat, lon = float(lat), float(lon)
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Posición inválida: ({lat}, {lon}).")
+        muestra = (time.time(), lat, lon)
+        with self._lock:
+            buffer = self._buffers.get(conductor_id)
+            if buffer is None:
+                buffer = self._buffers[conductor_id] = deque(maxlen=self.tamano_buffer)
+            buffer.append(muestra)
+            self._pendientes[conductor_id] = muestra
+            traza = self._trazas_pendientes.setdefault(conductor_id, [])
+            if len(traza) < self.tamano_buffer:
+                traza.append(muestra)
+
+        # El índice de despacho solo se mueve si el conductor ya está indexado
+        indice_conductores.mover(conductor_id, lat, lon)
+        return muestra
+
+    def ultima(self, conductor_id):
+        """Última muestra (timestamp, lat, lon) del conductor o None."""
+        buffer = self._buffers.get(conductor_id)
+        return buffer[-1] if buffer else None
+
+    def recientes(self, conductor_id):
+        """Copia de las muestras en el buffer circular del conductor."""
+        with self._lock:
+            return list(self._buffers.get(conductor_id, ()))
+
+    def olvidar(self, conductor_id):
+        """Libera el buffer de un conductor desconectado (las pendientes se conservan)."""
+        with self._lock:
+            self._buffers.pop(conductor_id, None)
+
+    # --- Persistencia ---
+
+    def _tomar_pendientes(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            trazas, self._trazas_pendientes = self._trazas_pendientes, {}
+            self._ultimo_vaciado = time.monotonic()
+        return pendientes, trazas
+
+    def vaciar(self):
+        """Escribe en la BD las posiciones pendientes (síncrono). Devuelve las filas escritas."""
+        from usuarios.models import UsuarioPersonalizado
+        from .trazas import anexar_muestras
+
+        pendientes, trazas = self._tomar_pendientes()
+        if not pendientes:
+            return 0
+
+        try:
+            anexar_muestras(trazas)
+        except Exception:
+            logger.exception("No se pudieron anexar las trazas de %d conductores.", len(trazas))
+
+        objetos = []
+        for conductor_id, (marca, lat, lon) in pendientes.items():
+            objetos.append(UsuarioPersonalizado(
+                pk=conductor_id,
+                latitud=Decimal(lat).quantize(CUANTIZADOR),
+                longitud=Decimal(lon).quantize(CUANTIZADOR),
+                ubicacion_actualizada_en=fecha_de_marca(marca),
+            ))
+
+        try:
+            UsuarioPersonalizado.objects.bulk_update(
+                objetos,
+                ['latitud', 'longitud', 'ubicacion_actualizada_en'],
+                batch_size=TAMANO_LOTE_BD,
+            )
+        except Exception:
+            # Reinsertar lo no escrito sin pisar muestras más nuevas que hayan llegado
+            with self._lock:
+                for conductor_id, muestra in pendientes.items():
+                    self._pendientes.setdefault(conductor_id, muestra)
+            logger.exception("No se pudieron guardar %d posiciones de conductores.", len(objetos))
+            return 0
+        return len(objetos)
+
+    def vaciar_si_corresponde(self):
+        """Vaciado síncrono para contextos sin bucle asyncio (vistas WSGI)."""
+        # También si la tarea periódica murió: nadie más vaciaría
+        sin_tarea = self._tarea is None or self._tarea.done()
+        if sin_tarea and time.monotonic() - self._ultimo_vaciado >= self.intervalo:
+            return self.vaciar()
+        return 0
+
+    def iniciar(self):
+        """Arranca (una vez por proceso) la tarea periódica de vaciado en el bucle actual."""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._bucle_vaciado())
+
+    async def _bucle_vaciado(self):
+        from channels.db import database_sync_to_async
+
+        while True:
+            await asyncio.sleep(self.intervalo)
+            if not self._pendientes:
+                continue
+            try:
+                await database_sync_to_async(self.vaciar)()
+            except Exception:
+                # La tarea debe sobrevivir: el próximo intervalo reintenta con lo que haya
+                logger.exception("Falló el vaciado periódico de posiciones.")
+
+
+registro_ubicaciones = RegistroUbicaciones()
+
+# Al apagar el proceso se escribe lo que quede pendiente
+atexit.register(registro_ubicaciones.vaciar)
@@ -14,6 +14,7 @@ router.register(r'vehiculos', views.VehiculoViewSet, basename='vehiculo')
 router.register(r'viajes', views.ViajeViewSet, basename='viaje')
 router.register(r'asistencias', views.SolicitudAsistenciaViewSet, basename='asistencia')
 router.register(r'mensajes', views.MensajeViajeViewSet, basename='mensaje')
+router.register(r'despacho', views.DespachoViewSet, basename='despacho')
 
 # 2. DEFINICIÓN DE RUTAS (Web + API)
 urlpatterns = [
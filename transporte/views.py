@@ -1,5 +1,8 @@
 # transporte/views.py
 
+import math
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
@@ -28,8 +31,31 @@ from .models import (
     Viaje, 
     Vehiculo, 
     SolicitudAsistencia, 
-    MensajeViaje # 🔑 Importación de modelo de chat
+    MensajeViaje, # 🔑 Importación de modelo de chat
+    EventoEstado,
+)
+from .despacho import (
+    indice_conductores,
+    registrar_posicion_conductor,
+    conductores_cercanos_a_viaje,
+    tipos_vehiculo_aprobados,
+    TIPOS_VEHICULO_POR_SERVICIO,
+    RADIO_BUSQUEDA_KM,
+    reclamar_solicitud,
 )
+from .ubicaciones import registro_ubicaciones
+from .asignacion import metricas_asignacion
+from .ofertas import publicar_oferta, retirar_ofertas, publicar_oferta_asistencia, retirar_oferta_asistencia
+from .cascada import despachador_cascada
+from .tarifas import cotizar as cotizar_tarifa, cotizar_todos
+from .demanda import mapa_demanda, zona_de
+from .trazas import ruta_de_viaje, codificar_polilinea
+from .ruteo import ruta_vial
+from .colas_asistencia import cola_asistencia, puede_atender
+from .geocercas import indice_geocercas
+from .eta import eta_viaje, estimador_eta
+from .transiciones import transicionar, TransicionInvalida, AccionesEstadoMixin, datos_evento
+from SuperService.historial_chat import PaginacionHistorial, pagina_anterior
 
 
 # ----------------------------------------------------------------------
@@ -132,10 +158,18 @@ class SolicitarViajeView(LoginRequiredMixin, View):
                 # Separar las coordenadas y convertirlas a Decimal
                 origen_lat, origen_lon = map(lambda x: Decimal(x.strip()), origen_data.split(','))
                 destino_lat, destino_lon = map(lambda x: Decimal(x.strip()), destino_data.split(','))
+                # Decimal acepta 'NaN' e 'Infinity', que no son una posición
+                if not all(valor.is_finite() for valor in (origen_lat, origen_lon, destino_lat, destino_lon)):
+                    raise ValueError
             except Exception:
                 messages.error(request, "Error al procesar las coordenadas. Asegúrese de que la selección sea válida.")
                 return render(request, self.template_name, {'form': form})
 
+            # Origen y destino deben estar dentro de una zona de servicio
+            if not (indice_geocercas.cubre(origen_lat, origen_lon) and indice_geocercas.cubre(destino_lat, destino_lon)):
+                messages.error(request, "El origen o el destino está fuera de nuestras zonas de servicio.")
+                return render(request, self.template_name, {'form': form})
+
             # --- 3. Crear y Guardar el objeto Viaje ---
             try:
                 # Guardar la instancia (sin cometerla a la BD)
@@ -156,7 +190,13 @@ class SolicitarViajeView(LoginRequiredMixin, View):
                 if hasattr(viaje, 'nombre_destino'):
                     viaje.nombre_destino = nombre_destino
                 
+                # La tarifa se calcula en el servidor (tablas de precios + caché de cotizaciones)
+                viaje.tarifa_estimada = cotizar_tarifa(origen_lat, origen_lon, destino_lat, destino_lon, viaje.tipo_servicio)
+
                 viaje.save() # Guardar el objeto Viaje completo
+
+                # Empujar la oferta a los conductores cercanos (en lugar de esperar a que recarguen)
+                publicar_oferta(viaje)
                 
                 # Mensaje de éxito
                 origen_display = nombre_origen or f"({origen_lat.quantize(Decimal('.000001'))},...)"
@@ -190,6 +230,7 @@ class SolicitarAsistenciaView(ClienteRequiredMixin, View):
             asistencia.cliente = request.user
             asistencia.estado = 'solicitado'
             asistencia.save()
+            publicar_oferta_asistencia(asistencia)
             messages.success(request, f'Asistencia vial de {asistencia.get_tipo_asistencia_display()} solicitada. Buscando proveedor...')
             return redirect('asistencia_pendiente', asistencia_id=asistencia.id)
             
@@ -209,6 +250,8 @@ class ViajePendienteView(ClienteRequiredMixin, View):
             template_name = 'transporte/asistencia_pendiente.html' # Nuevo template para Asistencia
 
         context = {'solicitud': solicitud}
+        if isinstance(solicitud, Viaje):
+            context['eta'] = eta_viaje(solicitud)
         return render(request, template_name, context)
 
 # ----------------------------------------------------------------------
@@ -244,9 +287,20 @@ class ConductorDashboardView(ConductorRequiredMixin, View):
     template_name = 'transporte/conductor_dashboard.html'
     
     def get(self, request):
-        # Muestra solicitudes cercanas (Placeholder, la lógica real es compleja)
-        solicitudes_cercanas = Viaje.objects.filter(estado='solicitado').exclude(cliente=request.user)[:10] 
-        asistencias_cercanas = SolicitudAsistencia.objects.filter(estado='solicitado').exclude(cliente=request.user)[:5]
+        solicitudes_cercanas = Viaje.objects.filter(estado='solicitado').exclude(cliente=request.user)
+
+        # Si el conductor tiene posición en el índice de despacho, limitar a su zona (columna geohash indexada)
+        posicion = indice_conductores.posicion(request.user.pk)
+        if posicion:
+            solicitudes_cercanas = solicitudes_cercanas.en_radio(posicion[0], posicion[1], RADIO_BUSQUEDA_KM)
+        solicitudes_cercanas = solicitudes_cercanas[:10]
+
+        # Asistencias más urgentes (SLA) que sus vehículos pueden atender, desde la cola en memoria
+        pendientes = cola_asistencia.siguientes(
+            tipos_vehiculo_aprobados(request.user), k=5, excluir_cliente=request.user.pk
+        )
+        por_id = SolicitudAsistencia.objects.in_bulk([p['id'] for p in pendientes])
+        asistencias_cercanas = [por_id[p['id']] for p in pendientes if p['id'] in por_id]
         vehiculos = Vehiculo.objects.filter(conductor=request.user)
 
         context = {
@@ -270,25 +324,33 @@ class AceptarSolicitudView(ConductorRequiredMixin, View):
         else:
             messages.error(request, "Tipo de solicitud no válido.")
             return redirect('conductor_dashboard')
-            
-        solicitud = get_object_or_404(modelo, id=solicitud_id, estado='solicitado')
-        
-        if tipo_solicitud == 'viaje' and not Vehiculo.objects.filter(conductor=user, aprobado=True).exists():
-            messages.error(request, "Debes tener al menos un vehículo aprobado para aceptar viajes.")
+
+        if tipo_solicitud == 'viaje':
+            vehiculo = Vehiculo.objects.filter(conductor=user, aprobado=True).first()
+            if not vehiculo:
+                messages.error(request, "Debes tener al menos un vehículo aprobado para aceptar viajes.")
+                return redirect('conductor_dashboard')
+            # UPDATE condicional: solo un conductor puede ganar la solicitud
+            ganada = reclamar_solicitud(Viaje, solicitud_id, conductor=user, vehiculo_usado=vehiculo)
+        else:
+            tipo_asistencia = get_object_or_404(SolicitudAsistencia, id=solicitud_id).tipo_asistencia
+            if not puede_atender(tipo_asistencia, tipos_vehiculo_aprobados(user)):
+                messages.error(request, "Ninguno de tus vehículos aprobados puede atender este tipo de asistencia.")
+                return redirect('conductor_dashboard')
+            ganada = reclamar_solicitud(SolicitudAsistencia, solicitud_id, proveedor=user)
+
+        if not ganada:
+            get_object_or_404(modelo, id=solicitud_id)  # 404 si no existe
+            messages.warning(request, "Esta solicitud ya fue tomada por otro conductor.")
             return redirect('conductor_dashboard')
-            
-        solicitud.estado = 'aceptado'
-        
+
         if tipo_solicitud == 'viaje':
-            solicitud.conductor = user 
-            solicitud.vehiculo_usado = Vehiculo.objects.filter(conductor=user, aprobado=True).first()
+            retirar_ofertas([solicitud_id], {solicitud_id: user.pk})
             messages.success(request, f'Has aceptado el Viaje #{solicitud_id}. Dirígete al origen.')
-        
-        elif tipo_solicitud == 'asistencia':
-            solicitud.proveedor = user 
+        else:
+            retirar_oferta_asistencia(solicitud_id, user.pk)
             messages.success(request, f'Has aceptado la Asistencia #{solicitud_id}.')
 
-        solicitud.save()
         return redirect('conductor_dashboard')
 
 class FinalizarAsistenciaView(ConductorRequiredMixin, View):
@@ -296,16 +358,14 @@ class FinalizarAsistenciaView(ConductorRequiredMixin, View):
 
     @method_decorator(require_POST) 
     def post(self, request, asistencia_id):
-        asistencia = get_object_or_404(
-            SolicitudAsistencia, 
-            pk=asistencia_id, 
-            proveedor=request.user, 
-            estado__in=['aceptado', 'en_ruta_origen']
-        )
-        
-        asistencia.estado = 'completado'
-        asistencia.save()
-        
+        asistencia = get_object_or_404(SolicitudAsistencia, pk=asistencia_id, proveedor=request.user)
+
+        try:
+            transicionar(asistencia, 'completado', actor=request.user)
+        except TransicionInvalida:
+            messages.error(request, f'La Asistencia #{asistencia_id} no se puede completar en su estado actual.')
+            return redirect('conductor_dashboard')
+
         messages.success(request, f'Servicio de Asistencia #{asistencia_id} marcado como completado.')
         return redirect('conductor_dashboard')
 
@@ -325,6 +385,13 @@ class ToggleDisponibilidadView(LoginRequiredMixin, View):
         user = request.user
         user.disponible = not user.disponible
         user.save()
+
+        # Un conductor no disponible no debe aparecer en el índice de despacho (ni contar como oferta);
+        # al volver a estar disponible entra con su última posición conocida
+        if not user.disponible:
+            indice_conductores.retirar(user.pk)
+        elif user.latitud is not None and user.longitud is not None:
+            registrar_posicion_conductor(user, user.latitud, user.longitud)
         
         if user.disponible:
             messages.success(request, "Tu estado ahora es: **DISPONIBLE**. ¡Puedes recibir solicitudes!")
@@ -372,13 +439,16 @@ class ViajeDetailView(LoginRequiredMixin, View):
         
         # 2. Obtener datos para la plantilla
         # Asumiendo que el related_name del ForeignKey MensajeViaje a Viaje es 'mensajes'
-        mensajes = viaje.mensajes.all().order_by('timestamp') 
+        # Solo los más recientes; los anteriores se piden con "Cargar anteriores"
+        mensajes, anteriores = pagina_anterior(viaje.mensajes.select_related('emisor'))
         form = MensajeViajeForm()
 
         context = {
             'viaje': viaje,
             'mensajes': mensajes,
+            'mensajes_anteriores': anteriores,
             'mensaje_form': form, # El formulario del chat
+            'ruta': ruta_de_viaje(viaje.pk), # Traza GPS (una sola lectura de la polilínea)
         }
         return render(request, self.template_name, context)
 
@@ -401,10 +471,11 @@ class ViajeDetailView(LoginRequiredMixin, View):
             return redirect('transporte:viaje_detalle', viaje_id=viaje.id) 
             
         # Si el formulario no es válido, volvemos a renderizar con errores
-        mensajes = viaje.mensajes.all().order_by('timestamp')
+        mensajes, anteriores = pagina_anterior(viaje.mensajes.select_related('emisor'))
         context = {
             'viaje': viaje,
             'mensajes': mensajes,
+            'mensajes_anteriores': anteriores,
             'mensaje_form': form 
         }
         return render(request, self.template_name, context)
@@ -436,6 +507,9 @@ class AprobarVehiculoView(AdminRequiredMixin, View):
         
         vehiculo.aprobado = True
         vehiculo.save()
+
+        # Si el conductor ya está en el índice de despacho, refrescar sus tipos de vehículo
+        indice_conductores.actualizar_tipos(vehiculo.conductor_id, tipos_vehiculo_aprobados(vehiculo.conductor))
         
         # Opcional: Marcar al conductor como disponible (si tu lógica lo requiere)
         conductor = vehiculo.conductor
@@ -451,6 +525,7 @@ class AprobarVehiculoView(AdminRequiredMixin, View):
 
 # transporte/views.py (Solo las vistas de API - Añade esto al archivo)
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .serializers import (
     VehiculoSerializer, 
@@ -496,7 +571,7 @@ class VehiculoViewSet(viewsets.ModelViewSet):
 # --- 2. API para Viajes ---
 
 
-class ViajeViewSet(viewsets.ModelViewSet):
+class ViajeViewSet(AccionesEstadoMixin, viewsets.ModelViewSet):
     serializer_class = ViajeSerializer
     queryset = Viaje.objects.all()
     permission_classes = [AllowAny] 
@@ -524,17 +599,220 @@ class ViajeViewSet(viewsets.ModelViewSet):
             User = get_user_model()
             usuario = User.objects.filter(username="norbe").first() or User.objects.first()
             
-            # Guardamos asignando el cliente manualmente
-            serializer.save(cliente=usuario)
+            # Guardamos asignando el cliente manualmente; la tarifa la calcula el servidor,
+            # no se acepta el 'monto' que mande la App
+            datos_viaje = serializer.validated_data
+            tarifa = cotizar_tarifa(
+                datos_viaje['origen_lat'], datos_viaje['origen_lon'],
+                datos_viaje['destino_lat'], datos_viaje['destino_lon'],
+                datos_viaje.get('tipo_servicio', 'economy'),
+            )
+            viaje = serializer.save(cliente=usuario, tarifa_estimada=tarifa)
+            publicar_oferta(viaje)
             
             print("✅ ¡VIAJE GUARDADO PARA NORBE!")
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except Exception as e:
             print("❌ ERROR AL GUARDAR:", str(e))
             return Response({"error": str(e)}, status=500)
+
+    @action(detail=False, methods=['get'])
+    def cotizar(self, request):
+        """
+        Cotiza los tres tipos de servicio en una sola llamada:
+        GET cotizar/?origen_lat=&origen_lon=&destino_lat=&destino_lon=
+        """
+        try:
+            coordenadas = [
+                float(request.query_params[campo])
+                for campo in ('origen_lat', 'origen_lon', 'destino_lat', 'destino_lon')
+            ]
+            # float() acepta 'nan' e 'inf', con los que no se puede cotizar
+            if not all(math.isfinite(valor) for valor in coordenadas):
+                raise ValueError
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Se requieren 'origen_lat', 'origen_lon', 'destino_lat' y 'destino_lon' numéricos."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cotizacion = cotizar_todos(*coordenadas)
+        cotizacion['tarifas'] = {servicio: str(tarifa) for servicio, tarifa in cotizacion['tarifas'].items()}
+        return Response(cotizacion)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def aceptar(self, request, pk=None):
+        """El conductor toma el viaje. Responde 409 si otro conductor ganó antes."""
+        # El id va a reclamar_solicitud (UPDATE directo): uno no numérico no existe
+        if not str(pk).isdigit():
+            raise Http404
+        user = request.user
+        if user.rol not in ['conductor', 'repartidor_domicilios']:
+            return Response({"error": "Solo conductores pueden aceptar viajes."}, status=status.HTTP_403_FORBIDDEN)
+
+        vehiculo = Vehiculo.objects.filter(conductor=user, aprobado=True).first()
+        if not vehiculo:
+            return Response({"error": "Debes tener al menos un vehículo aprobado."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not reclamar_solicitud(Viaje, pk, conductor=user, vehiculo_usado=vehiculo):
+            get_object_or_404(Viaje, pk=pk)
+            return Response({"error": "El viaje ya fue tomado por otro conductor."}, status=status.HTTP_409_CONFLICT)
+
+        retirar_ofertas([int(pk)], {int(pk): user.pk})
+        viaje = Viaje.objects.get(pk=pk)
+        return Response(self.get_serializer(viaje).data)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def eta(self, request, pk=None):
+        """Tiempo estimado de recogida y de llegada al destino (perfiles de velocidad por zona y hora)."""
+        viaje = get_object_or_404(Viaje.objects.select_related('conductor'), pk=pk)
+        if request.user.pk not in (viaje.cliente_id, viaje.conductor_id) and not request.user.is_staff:
+            return Response({"error": "No participas en este viaje."}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response({"estado": viaje.estado, "eta": eta_viaje(viaje)})
         
+# --- 3. API de Despacho (Conductores Cercanos) ---
+class DespachoViewSet(viewsets.ViewSet):
+    """
+    API de despacho basada en el índice geográfico en memoria.
+    - POST ubicacion/: el conductor reporta su posición actual.
+    - GET cercanos/?viaje=<id>&k=5 (participantes del viaje) o ?lat=&lon=&tipo_servicio= (staff): conductores más cercanos.
+    - GET demanda/ (o ?lat=&lon=): viajes abiertos vs conductores disponibles por zona (staff).
+    - GET cobertura/?lat=&lon=: si el punto está dentro de una zona de servicio.
+    - GET ruta/?origen=lat,lon&destino=lat,lon: distancia, duración y trazado por carretera.
+    - GET eventos/?desde=<id>&tipo=: registro de cambios de estado para analítica (staff).
+    """
+    permission_classes = [IsAuthenticated]
+
+    @action(detail=False, methods=['post'])
+    def ubicacion(self, request):
+        user = request.user
+        if user.rol not in ['conductor', 'repartidor_domicilios']:
+            return Response({"error": "Solo conductores pueden reportar ubicación."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            lat = float(request.data.get('lat'))
+            lon = float(request.data.get('lon'))
+            # Mismo rango que UbicacionConductorConsumer (también descarta 'nan' e 'inf')
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({"error": "Parámetros 'lat' y 'lon' inválidos."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Misma ruta que las pings del WebSocket: memoria primero, BD en lotes
+        registro_ubicaciones.registrar(user.pk, lat, lon)
+        indexado = user.pk in indice_conductores or registrar_posicion_conductor(user, lat, lon)
+        registro_ubicaciones.vaciar_si_corresponde()
+        return Response({"indexado": indexado})
+
+    @action(detail=False, methods=['get'])
+    def cercanos(self, request):
+        try:
+            k = max(1, min(int(request.query_params.get('k', 5)), 50))
+        except ValueError:
+            k = 5
+
+        viaje_id = request.query_params.get('viaje')
+        if viaje_id:
+            if not str(viaje_id).isdigit():
+                raise Http404
+            viaje = get_object_or_404(Viaje, pk=viaje_id)
+            # Posiciones de conductores: solo para quien participa en el viaje (o staff)
+            if request.user.pk not in (viaje.cliente_id, viaje.conductor_id) and not request.user.is_staff:
+                return Response({"error": "No participas en este viaje."}, status=status.HTTP_403_FORBIDDEN)
+            resultados = conductores_cercanos_a_viaje(viaje, k=k)
+        else:
+            # Con lat/lon arbitrarios se podría triangular a los conductores: solo staff
+            if not request.user.is_staff:
+                return Response({"error": "Solo el personal puede consultar un punto arbitrario."}, status=status.HTTP_403_FORBIDDEN)
+            try:
+                lat = float(request.query_params.get('lat'))
+                lon = float(request.query_params.get('lon'))
+            except (TypeError, ValueError):
+                return Response({"error": "Indique 'viaje' o 'lat' y 'lon'."}, status=status.HTTP_400_BAD_REQUEST)
+            tipos = TIPOS_VEHICULO_POR_SERVICIO.get(request.query_params.get('tipo_servicio'))
+            resultados = indice_conductores.cercanos(lat, lon, k=k, tipos=tipos)
+
+        return Response([
+            {'conductor': conductor_id, 'distancia_km': round(distancia, 3)}
+            for conductor_id, distancia in resultados
+        ])
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def metricas(self, request):
+        """Latencias y volumen del motor por lotes y de las ofertas en cascada (solo staff)."""
+        return Response(dict(
+            metricas_asignacion.resumen(),
+            ofertas_cascada=despachador_cascada.resumen(),
+            cola_asistencia=cola_asistencia.resumen(),
+            perfiles_velocidad=estimador_eta.resumen(),
+        ))
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def demanda(self, request):
+        """Ratio demanda/oferta de una zona (?lat=&lon=) o de todas las zonas activas."""
+        if 'lat' in request.query_params or 'lon' in request.query_params:
+            try:
+                lat = float(request.query_params.get('lat'))
+                lon = float(request.query_params.get('lon'))
+                if not (math.isfinite(lat) and math.isfinite(lon)):
+                    raise ValueError
+            except (TypeError, ValueError):
+                return Response({"error": "Parámetros 'lat' y 'lon' inválidos."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(mapa_demanda.zona(zona_de(lat, lon)))
+
+        return Response(mapa_demanda.zonas())
+
+    @action(detail=False, methods=['get'])
+    def cobertura(self, request):
+        """Permite a la App avisar antes de enviar una solicitud fuera de zona."""
+        try:
+            lat = float(request.query_params.get('lat'))
+            lon = float(request.query_params.get('lon'))
+        except (TypeError, ValueError):
+            return Response({"error": "Parámetros 'lat' y 'lon' inválidos."}, status=status.HTTP_400_BAD_REQUEST)
+
+        zona = indice_geocercas.zona_de(lat, lon)
+        return Response({
+            'en_servicio': zona is not None or not len(indice_geocercas),
+            'zona': zona[1] if zona else None,
+        })
+
+    @action(detail=False, methods=['get'])
+    def ruta(self, request):
+        """Ruta más rápida por la red vial local (sin servicios externos). 404 si no se puede rutear."""
+        try:
+            o_lat, o_lon = (float(x) for x in request.query_params['origen'].split(','))
+            d_lat, d_lon = (float(x) for x in request.query_params['destino'].split(','))
+        except (KeyError, ValueError):
+            return Response({"error": "Indique 'origen' y 'destino' como lat,lon."}, status=status.HTTP_400_BAD_REQUEST)
+
+        ruta = ruta_vial(o_lat, o_lon, d_lat, d_lon)
+        if ruta is None:
+            return Response({"error": "No hay red vial cargada o los puntos quedan fuera de ella."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'distancia_km': round(ruta['metros'] / 1000, 3),
+            'duracion_s': ruta['segundos'],
+            'polilinea': codificar_polilinea(ruta['puntos'])[0],
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def eventos(self, request):
+        """Eventos de estado con id > 'desde', en orden; 'siguiente' es el cursor de la próxima lectura."""
+        try:
+            desde = int(request.query_params.get('desde', 0))
+            limite = min(int(request.query_params.get('limite', 500)), 5000)
+        except ValueError:
+            return Response({"error": "'desde' y 'limite' deben ser enteros."}, status=status.HTTP_400_BAD_REQUEST)
+
+        eventos = EventoEstado.objects.filter(id__gt=desde).order_by('id')
+        if request.query_params.get('tipo'):
+            eventos = eventos.filter(tipo=request.query_params['tipo'])
+        pagina = [datos_evento(evento) for evento in eventos[:limite]]
+        return Response({'eventos': pagina, 'siguiente': pagina[-1]['id'] if pagina else desde})
+
 # --- 4. API para Asistencia Vial ---
-class SolicitudAsistenciaViewSet(viewsets.ModelViewSet):
+class SolicitudAsistenciaViewSet(AccionesEstadoMixin, viewsets.ModelViewSet):
     serializer_class = SolicitudAsistenciaSerializer
     queryset = SolicitudAsistencia.objects.all()
     permission_classes = [IsAuthenticated]
@@ -549,22 +827,74 @@ class SolicitudAsistenciaViewSet(viewsets.ModelViewSet):
         ).distinct()
 
     def perform_create(self, serializer):
-        serializer.save(cliente=self.request.user)
+        asistencia = serializer.save(cliente=self.request.user)
+        publicar_oferta_asistencia(asistencia)
+
+    @action(detail=True, methods=['post'])
+    def aceptar(self, request, pk=None):
+        """El proveedor toma la asistencia. Responde 409 si otro proveedor ganó antes."""
+        if not str(pk).isdigit():
+            raise Http404
+        if request.user.rol not in ['conductor', 'repartidor_domicilios']:
+            return Response({"error": "Solo proveedores pueden aceptar asistencias."}, status=status.HTTP_403_FORBIDDEN)
+
+        tipo_asistencia = get_object_or_404(SolicitudAsistencia, pk=pk).tipo_asistencia
+        if not puede_atender(tipo_asistencia, tipos_vehiculo_aprobados(request.user)):
+            return Response(
+                {"error": "Ninguno de tus vehículos aprobados puede atender este tipo de asistencia."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not reclamar_solicitud(SolicitudAsistencia, pk, proveedor=request.user):
+            return Response({"error": "La asistencia ya fue tomada por otro proveedor."}, status=status.HTTP_409_CONFLICT)
+
+        retirar_oferta_asistencia(int(pk), request.user.pk)
+        asistencia = SolicitudAsistencia.objects.get(pk=pk)
+        return Response(self.get_serializer(asistencia).data)
+
+    @action(detail=False, methods=['get'])
+    def cola(self, request):
+        """Asistencias abiertas más urgentes (por SLA) que los vehículos del proveedor pueden atender."""
+        if request.user.rol not in ['conductor', 'repartidor_domicilios']:
+            return Response({"error": "Solo proveedores tienen cola de asistencias."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            k = min(int(request.query_params.get('k', 5)), 50)
+        except ValueError:
+            k = 5
+
+        pendientes = cola_asistencia.siguientes(tipos_vehiculo_aprobados(request.user), k=k, excluir_cliente=request.user.pk)
+        por_id = SolicitudAsistencia.objects.in_bulk([p['id'] for p in pendientes])
+        return Response([
+            dict(self.get_serializer(por_id[p['id']]).data, restante_s=p['restante_s'], vencida=p['vencida'])
+            for p in pendientes if p['id'] in por_id
+        ])
 
 
 class MensajeViajeViewSet(viewsets.ModelViewSet):  # <--- MIRA ESTE NOMBRE
+    """
+    El listado va por páginas hacia atrás: ?viaje=<id> para una conversación,
+    ?antes=<cursor> para los anteriores (SuperService/historial_chat.py).
+    """
     serializer_class = MensajeViajeSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionHistorial
     queryset = MensajeViaje.objects.all()
     
     def get_queryset(self):
         user = self.request.user
+        mensajes = MensajeViaje.objects.select_related('emisor')
+        if 'viaje' in self.request.query_params:
+            try:
+                mensajes = mensajes.filter(viaje_id=int(self.request.query_params['viaje']))
+            except ValueError:
+                return mensajes.none()
         if user.is_staff:
-            return MensajeViaje.objects.all()
+            return mensajes
             
-        return MensajeViaje.objects.filter(
+        # Las uniones con el viaje son hacia un solo registro: no hace falta distinct()
+        return mensajes.filter(
             Q(viaje__cliente=user) | Q(viaje__conductor=user)
-        ).distinct()
+        )
         
     def perform_create(self, serializer):
         serializer.save(emisor=self.request.user)
@@ -7,3 +7,4 @@ admin.site.register(PerfilConductor)
 # Registra los modelos para que aparezcan en el panel de administración
 admin.site.register(Mensaje)
 admin.site.register(ChatRoom)
+admin.site.register(ResumenBandeja)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UsuariosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'usuarios'
+
+    def ready(self):
+        # Registra las señales que mantienen la bandeja de chats (ResumenBandeja)
+        from . import bandeja  # noqa: F401
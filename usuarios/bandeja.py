@@ -0,0 +1,140 @@
+# usuarios/bandeja.py
+
+from operator import attrgetter
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from SuperService.escritura_diferida import filas_insertadas
+from .models import ChatRoom, Mensaje, ResumenBandeja
+
+# ----------------------------------------------------------------------
+# 1. Parámetros
+# ----------------------------------------------------------------------
+
+# Caracteres del último mensaje que se guardan para la bandeja (max_length del campo)
+LARGO_VISTA_PREVIA = ResumenBandeja._meta.get_field('vista_previa').max_length
+
+
+def vista_previa(texto):
+    if len(texto) <= LARGO_VISTA_PREVIA:
+        return texto
+    return texto[:LARGO_VISTA_PREVIA - 1] + '…'
+
+
+# ----------------------------------------------------------------------
+# 2. Filas de la bandeja (una por usuario y sala)
+# ----------------------------------------------------------------------
+
+def participantes_por_sala(room_ids):
+    """{room_id: [usuario_id, ...]} con una sola consulta a la tabla intermedia."""
+    intermedia = ChatRoom.participantes.through
+    salas = {}
+    for room_id, usuario_id in intermedia.objects.filter(chatroom_id__in=room_ids).values_list(
+        'chatroom_id', 'usuariopersonalizado_id'
+    ):
+        salas.setdefault(room_id, []).append(usuario_id)
+    return salas
+
+
+def asegurar_filas(salas):
+    """Crea las filas (usuario, sala) que falten; las existentes no se tocan."""
+    filas = [
+        ResumenBandeja(
+            usuario_id=usuario_id, room_id=room_id,
+            otro_participante_id=next((otro for otro in usuarios if otro != usuario_id), None),
+        )
+        for room_id, usuarios in salas.items()
+        for usuario_id in usuarios
+    ]
+    ResumenBandeja.objects.bulk_create(filas, ignore_conflicts=True)
+
+
+def registrar_mensajes(mensajes):
+    """
+    Lleva a la bandeja un lote de mensajes ya guardados. Por sala: un UPDATE
+    con el último mensaje (solo si es más nuevo que el que ya tiene la fila)
+    y otro con los no leídos de cada participante. Quien escribió en el lote
+    ya leyó lo anterior a su último mensaje; al resto se le suma el lote.
+    """
+    por_sala = {}
+    for mensaje in mensajes:
+        por_sala.setdefault(mensaje.room_id, []).append(mensaje)
+    salas = participantes_por_sala(por_sala)
+
+    with transaction.atomic():
+        asegurar_filas(salas)
+        for room_id, lote in por_sala.items():
+            # sort() es estable: a igual timestamp se respeta el orden de inserción
+            lote.sort(key=attrgetter('timestamp'))
+            ultimo = lote[-1]
+            ResumenBandeja.objects.filter(room_id=room_id).filter(
+                Q(ultimo_mensaje_en__isnull=True) | Q(ultimo_mensaje_en__lte=ultimo.timestamp)
+            ).update(
+                vista_previa=vista_previa(ultimo.contenido),
+                ultimo_mensaje_en=ultimo.timestamp,
+                ultimo_autor_id=ultimo.autor_id,
+            )
+
+            casos = []
+            for usuario_id in salas.get(room_id, ()):
+                propios = [i for i, mensaje in enumerate(lote) if mensaje.autor_id == usuario_id]
+                if propios:
+                    nuevos = sum(1 for mensaje in lote[propios[-1] + 1:] if mensaje.autor_id != usuario_id)
+                    casos.append(When(usuario_id=usuario_id, then=Value(nuevos)))
+                else:
+                    casos.append(When(usuario_id=usuario_id, then=F('no_leidos') + len(lote)))
+            if casos:
+                ResumenBandeja.objects.filter(room_id=room_id).update(
+                    no_leidos=Case(*casos, default=F('no_leidos'), output_field=PositiveIntegerField())
+                )
+
+
+def completar_salas(room_ids):
+    """
+    Crea las filas de los participantes de 'room_ids' que aún no las tengan
+    y les copia el último mensaje de la sala (p. ej. alguien que se une a
+    una sala con historial).
+    """
+    asegurar_filas(participantes_por_sala(room_ids))
+    for room_id in room_ids:
+        ultimo = Mensaje.objects.filter(room_id=room_id).order_by('-timestamp', '-pk').first()
+        if ultimo is not None:
+            ResumenBandeja.objects.filter(room_id=room_id, ultimo_mensaje_en__isnull=True).update(
+                vista_previa=vista_previa(ultimo.contenido),
+                ultimo_mensaje_en=ultimo.timestamp,
+                ultimo_autor_id=ultimo.autor_id,
+            )
+
+
+def marcar_leido(room_id, usuario_id):
+    """El usuario abrió la sala: sus no leídos vuelven a cero."""
+    ResumenBandeja.objects.filter(room_id=room_id, usuario_id=usuario_id, no_leidos__gt=0).update(no_leidos=0)
+
+
+# ----------------------------------------------------------------------
+# 3. Señales
+# ----------------------------------------------------------------------
+# Los mensajes de usuarios.ChatConsumer llegan en lotes desde el escritor
+# diferido (filas_insertadas); los guardados con save() llegan por post_save.
+
+@receiver(filas_insertadas, sender='usuarios.Mensaje')
+def bandeja_lote_insertado(sender, instancias, **kwargs):
+    registrar_mensajes(instancias)
+
+
+@receiver(post_save, sender='usuarios.Mensaje')
+def bandeja_mensaje_guardado(sender, instance, created, **kwargs):
+    if created:
+        registrar_mensajes([instance])
+
+
+@receiver(m2m_changed, sender=ChatRoom.participantes.through)
+def bandeja_participantes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    # sala.participantes.add(...) o usuario.chat_rooms.add(...)
+    room_ids = list(pk_set) if reverse else [instance.pk]
+    transaction.on_commit(lambda: completar_salas(room_ids))
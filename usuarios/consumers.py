@@ -7,6 +7,8 @@ from django.contrib.auth import get_user_model
 from .models import Mensaje, ChatRoom 
 import datetime # 🟢 CORRECCIÓN 1: Importación de datetime
 from django.utils import timezone # 💡 Recomendado para trabajar con fechas conscientes de zona horaria
+from SuperService.escritura_diferida import escritor_mensajes
+from SuperService.reanudacion_chat import SesionReanudacion
 
 # Obtiene el modelo de usuario personalizado del proyecto
 UsuarioPersonalizado = get_user_model()
@@ -18,6 +20,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_name = self.scope['url_route']['kwargs'].get('room_name')
         self.room_group_name = f'chat_{self.room_name}'
         self.user = self.scope["user"] 
+        # ?last_seq=<n> al reconectar: solo se reenvía lo perdido (SuperService/reanudacion_chat.py)
+        self.reanudacion = SesionReanudacion(self.room_group_name, self.scope)
 
         # 2. Manejo de errores de conexión y autenticación
         if not self.room_name or not self.user.is_authenticated:
@@ -25,6 +29,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
             
+        # La sala se busca una sola vez aquí y no en cada mensaje
+        self.room_id = await self.buscar_sala()
+        escritor_mensajes.iniciar()
+
         # 3. Unirse al grupo
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -33,10 +41,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # 4. Aceptar la conexión WebSocket
         await self.accept()
+        await self.reanudar()
 
 
     async def disconnect(self, close_code):
         """Se ejecuta al cerrar la conexión WebSocket."""
+        self.reanudacion.salir()
         if self.room_name: 
             await self.channel_layer.group_discard(
                 self.room_group_name,
@@ -45,8 +55,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
 
     async def receive(self, text_data):
-        """Recibe mensaje de WebSocket, lo guarda y lo reenvía al grupo."""
-        print("--- MENSAJE RECIBIDO EN CONSUMER ---") 
+        """Recibe mensaje de WebSocket, lo reenvía al grupo y lo encola para guardarlo."""
         text_data_json = json.loads(text_data)
         message = text_data_json.get('message', '')
         
@@ -58,14 +67,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         timestamp = timezone.now()
         timestamp_str = timestamp.strftime("%H:%M %p") 
 
-        # 1. Guardar el mensaje en la base de datos (operación síncrona)
-        try:
-            await self.save_message(message) 
-        except Exception as e:
-            print(f"Error al guardar mensaje: {e}")
+        # 1. Sin sala no hay dónde guardar el mensaje
+        if self.room_id is None:
+            print(f"Error al guardar mensaje: Sala {self.room_name} no encontrada.")
             return
 
         # 2. Enviar mensaje al grupo de la sala (broadcast)
+        seq = self.reanudacion.secuencia()
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -73,12 +81,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': message,
                 'username': self.user.username,
                 'timestamp': timestamp_str, # ⬅️ AHORA ENVIAMOS LA HORA
+                'seq': seq,
             }
         )
 
+        # 3. Guardar el mensaje en la base de datos (en lote, ver SuperService/escritura_diferida.py)
+        await self.save_message(message, seq)
+
 
     async def chat_message(self, event):
         """Recibe el mensaje del grupo y lo envía al WebSocket individual."""
+        # Ya enviado al reanudar la conexión
+        if not self.reanudacion.nuevo(event):
+            return
+
         message = event['message']
         username = event['username']
         timestamp = event['timestamp'] 
@@ -89,24 +105,49 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'username': username,
             'is_me': username == self.user.username,
             'timestamp': timestamp, 
+            'seq': event.get('seq'),
+        }))
+
+    async def reanudar(self):
+        """Reenvía los mensajes posteriores a ?last_seq= (si el cliente lo indicó)."""
+        eventos, completa = await self.reanudacion.iniciar(self.mensajes_desde_bd)
+        if self.reanudacion.last_seq is None:
+            return
+        for evento in eventos:
+            await self.chat_message(evento)
+        await self.send(text_data=json.dumps({
+            'tipo': 'reanudacion',
+            'seq': eventos[-1]['seq'] if eventos else self.reanudacion.last_seq,
+            'completa': completa,
         }))
         
         
     @sync_to_async
-    def save_message(self, content):
-        """
-        Método síncrono para interactuar con la ORM de Django y guardar el mensaje.
-        """
-        try:
-            # 🟢 CORRECCIÓN 2: Búsqueda por el campo 'room_name'
-            room = ChatRoom.objects.get(room_name=self.room_name) 
-        except ChatRoom.DoesNotExist:
-            raise Exception(f"Sala {self.room_name} no encontrada para guardar mensaje.")
-            
+    def buscar_sala(self):
+        """Id de la sala (o None si no existe)."""
+        # 🟢 CORRECCIÓN 2: Búsqueda por el campo 'room_name'
+        return ChatRoom.objects.filter(room_name=self.room_name).values_list('pk', flat=True).first()
+
+    async def save_message(self, content, seq):
+        """Encola el mensaje; se inserta en lote junto con los demás."""
         # 🟢 CORRECCIÓN 3: Se asume que el ForeignKey en Mensaje es 'room'
-        # (Si es 'sala', cambia 'room=' por 'sala=')
-        Mensaje.objects.create(
-            room=room,  
-            autor=self.user,
-            contenido=content
-        )
\ No newline at end of file
+        await escritor_mensajes.guardar(
+            Mensaje(room_id=self.room_id, autor=self.user, contenido=content, secuencia=seq)
+        )
+
+    def mensajes_desde_bd(self, desde, limite):
+        if self.room_id is None:
+            return []
+        mensajes = Mensaje.objects.filter(
+            room_id=self.room_id, secuencia__gt=desde
+        ).select_related('autor').order_by('secuencia')[:limite]
+        return [
+            {
+                'type': 'chat_message',
+                'message': m.contenido,
+                'username': m.autor.username,
+                'timestamp': m.timestamp.strftime("%H:%M %p"),
+                'seq': m.secuencia,
+            }
+            for m in mensajes
+        ]
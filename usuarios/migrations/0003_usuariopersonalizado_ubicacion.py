@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-17 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0002_chatroom_mensaje'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuariopersonalizado',
+            name='latitud',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='usuariopersonalizado',
+            name='longitud',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='usuariopersonalizado',
+            name='ubicacion_actualizada_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0003_usuariopersonalizado_ubicacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='mensajesala_hist_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def llenar_bandejas(apps, schema_editor):
+    """Una fila por participante de cada sala existente, con su último mensaje (sin no leídos)."""
+    ChatRoom = apps.get_model('usuarios', 'ChatRoom')
+    Mensaje = apps.get_model('usuarios', 'Mensaje')
+    ResumenBandeja = apps.get_model('usuarios', 'ResumenBandeja')
+    intermedia = ChatRoom.participantes.through
+
+    salas = {}
+    for room_id, usuario_id in intermedia.objects.values_list('chatroom_id', 'usuariopersonalizado_id'):
+        salas.setdefault(room_id, []).append(usuario_id)
+
+    filas = []
+    for room_id, usuarios in salas.items():
+        ultimo = Mensaje.objects.filter(room_id=room_id).order_by('-timestamp', '-pk').first()
+        for usuario_id in usuarios:
+            filas.append(ResumenBandeja(
+                usuario_id=usuario_id,
+                room_id=room_id,
+                otro_participante_id=next((otro for otro in usuarios if otro != usuario_id), None),
+                ultimo_autor_id=ultimo.autor_id if ultimo else None,
+                vista_previa=ultimo.contenido[:100] if ultimo else '',
+                ultimo_mensaje_en=ultimo.timestamp if ultimo else None,
+            ))
+    ResumenBandeja.objects.bulk_create(filas, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0004_mensaje_hist_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenBandeja',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vista_previa', models.CharField(blank=True, max_length=100)),
+                ('ultimo_mensaje_en', models.DateTimeField(blank=True, null=True)),
+                ('no_leidos', models.PositiveIntegerField(default=0)),
+                ('otro_participante', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='usuarios.chatroom')),
+                ('ultimo_autor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bandeja', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Resumen de Bandeja',
+                'verbose_name_plural': 'Resúmenes de Bandeja',
+                'indexes': [models.Index(fields=['usuario', '-ultimo_mensaje_en'], name='bandeja_usuario_fecha_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumenbandeja',
+            constraint=models.UniqueConstraint(fields=('usuario', 'room'), name='bandeja_usuario_sala_unica'),
+        ),
+        migrations.RunPython(llenar_bandejas, migrations.RunPython.noop),
+    ]
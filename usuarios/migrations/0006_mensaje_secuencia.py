@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0005_resumenbandeja'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensaje',
+            name='secuencia',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['room', 'secuencia'], name='mensajesala_seq_idx'),
+        ),
+    ]
@@ -31,6 +31,12 @@ class UsuarioPersonalizado(AbstractUser):
     telefono = models.CharField(max_length=15, unique=True, blank=True, null=True)
     disponible = models.BooleanField(default=False) # Para conductores/repartidores
 
+    # Última posición conocida (conductores/repartidores). La escribe en lotes
+    # el registro de ubicaciones en vivo (transporte/ubicaciones.py), no cada ping.
+    latitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitud = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    ubicacion_actualizada_en = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         """Devuelve una representación legible del objeto."""
         nombre_completo = self.get_full_name() or self.username
@@ -88,9 +94,49 @@ class Mensaje(models.Model):
     # CRÍTICO: El nombre del campo es 'timestamp' (Usado en la vista y plantillas)
     timestamp = models.DateTimeField(auto_now_add=True) 
 
+    # Secuencia del chat en vivo para reanudar tras reconectar (SuperService/reanudacion_chat.py)
+    secuencia = models.BigIntegerField(null=True, blank=True, editable=False)
+
     class Meta:
         # Ordenación por defecto, asegura que el último mensaje es el más reciente
         ordering = ['timestamp'] 
+        # Historial por páginas (SuperService/historial_chat.py)
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id'], name='mensajesala_hist_idx'),
+            models.Index(fields=['room', 'secuencia'], name='mensajesala_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mensaje de {self.autor.username} en {self.room.room_name}"
+
+class ResumenBandeja(models.Model):
+    """
+    Fila de la bandeja de chats de un usuario para una sala: vista previa
+    del último mensaje, el otro participante y cuántos mensajes no ha
+    leído. Se actualiza al escribir mensajes (usuarios/bandeja.py), así la
+    bandeja es UNA consulta por índice, tenga el usuario las salas que tenga.
+    """
+    usuario = models.ForeignKey(UsuarioPersonalizado, on_delete=models.CASCADE, related_name='bandeja')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='resumenes')
+    otro_participante = models.ForeignKey(
+        UsuarioPersonalizado, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    ultimo_autor = models.ForeignKey(
+        UsuarioPersonalizado, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    vista_previa = models.CharField(max_length=100, blank=True)
+    ultimo_mensaje_en = models.DateTimeField(null=True, blank=True)
+    no_leidos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Resumen de Bandeja"
+        verbose_name_plural = "Resúmenes de Bandeja"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'room'], name='bandeja_usuario_sala_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['usuario', '-ultimo_mensaje_en'], name='bandeja_usuario_fecha_idx'),
+        ]
 
     def __str__(self):
-        return f"Mensaje de {self.autor.username} en {self.room.room_name}"
\ No newline at end of file
+        return f"Bandeja de {self.usuario.username} en {self.room.room_name}"
@@ -109,8 +109,6 @@ class UsuarioDetalleSerializer(serializers.ModelSerializer):
         # Permite actualizar solo campos específicos
         instance.telefono = validated_data.get('telefono', instance.telefono)
         instance.disponible = validated_data.get('disponible', instance.disponible)
-        #instance.latitud = validated_data.get('latitud', instance.latitud)
-        #instance.longitud = validated_data.get('longitud', instance.longitud)
         
         instance.save()
         return instance
\ No newline at end of file
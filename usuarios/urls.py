@@ -42,6 +42,7 @@ urlpatterns = [
     # B. Rutas de VISTAS WEB (Chat P2P)
     path('chat/', views.chat_list_view, name='chat_inbox'), 
     path('chat/<int:user_id>/', views.chat_room_view, name='chat_room'),
+    path('chat/<int:user_id>/historial/', views.chat_historial_view, name='chat_historial'),
     
     # C. RUTA DE API CUSTOM (SOLUCIÓN AL 404 ORIGINAL)
     # Usa la vista ejecutable definida en el punto 1 para responder a la URL del Frontend.
@@ -5,10 +5,13 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
+from django.http import JsonResponse
 from django.db.models import Q # Importación necesaria para buscar salas de chat
 
 from .forms import LoginForm, ClienteRegistroForm, ConductorRegistroForm
-from .models import PerfilConductor, UsuarioPersonalizado, ChatRoom, Mensaje # Importamos los modelos de chat
+from SuperService.historial_chat import pagina_anterior, leer_limite
+from .models import PerfilConductor, UsuarioPersonalizado, ChatRoom, Mensaje, ResumenBandeja # Importamos los modelos de chat
+from .bandeja import marcar_leido
 from rest_framework import viewsets, status
 
 from .serializers import ClienteSerializer, ConductorRegistroSerializer, UsuarioDetalleSerializer
@@ -184,42 +187,16 @@ def chat_list_view(request):
     """
     Muestra la lista de salas de chat activas donde participa el usuario logueado.
     Ordena las salas por la fecha del último mensaje (timestamp).
+
+    Lee las filas de ResumenBandeja (usuarios/bandeja.py), que ya tienen la
+    vista previa, el otro participante y los no leídos: una consulta por el
+    índice (usuario, -ultimo_mensaje_en), sin importar cuántas salas haya.
     """
-    user = request.user
-    
-    # 1. Encontrar todas las salas donde el usuario es participante
-    chats_del_usuario = ChatRoom.objects.filter(participantes=user)
-    
-    # 2. Anotar la fecha del último mensaje en cada sala (usando 'timestamp')
-    # ¡CORRECCIÓN CLAVE AQUÍ! Usamos 'timestamp' en lugar de 'fecha_envio'.
-    chats_con_fecha = chats_del_usuario.annotate(
-        ultimo_mensaje_fecha=Max('mensajes__timestamp')
-    )
-    
-    # 3. Ordenar por la fecha del último mensaje (descendente)
-    chats_ordenados = chats_con_fecha.exclude(
-        ultimo_mensaje_fecha__isnull=True
-    ).order_by('-ultimo_mensaje_fecha')
-    
-    # 4. Obtener el otro participante y el último mensaje para mostrar en el template
-    lista_conversaciones = []
-    
-    for chat_room in chats_ordenados:
-        otro_participante = chat_room.participantes.exclude(pk=user.pk).first()
-        
-        try:
-            # Obtener el último mensaje usando el campo 'timestamp'
-            ultimo_mensaje = chat_room.mensajes.latest('timestamp') 
-        except Mensaje.DoesNotExist:
-            ultimo_mensaje = None 
-
-        if otro_participante:
-            lista_conversaciones.append({
-                'room': chat_room,
-                'otro_participante': otro_participante,
-                'ultimo_mensaje': ultimo_mensaje,
-                'room_name_js': chat_room.room_name,
-            })
+    lista_conversaciones = ResumenBandeja.objects.filter(
+        usuario=request.user,
+        ultimo_mensaje_en__isnull=False,
+        otro_participante__isnull=False,
+    ).select_related('otro_participante').order_by('-ultimo_mensaje_en')
 
     context = {
         'lista_conversaciones': lista_conversaciones,
@@ -246,18 +223,60 @@ def chat_room_view(request, user_id):
     # 3. ASEGURAR QUE AMBOS USUARIOS ESTÉN EN LA RELACIÓN M2M
     if created or not chat_room.participantes.filter(pk=user.pk).exists():
         chat_room.participantes.add(user, usuario_objetivo)
+
+    # La sala queda leída para este usuario en su bandeja
+    marcar_leido(chat_room.pk, user.pk)
     
-    # 4. Obtener historial (usando el campo 'timestamp')
-    historial = Mensaje.objects.filter(room=chat_room).order_by('timestamp') 
+    # 4. Obtener historial (usando el campo 'timestamp'): solo los más recientes,
+    # los anteriores se piden con "Cargar anteriores" (chat_historial_view)
+    historial, historial_anteriores = pagina_anterior(
+        Mensaje.objects.filter(room=chat_room).select_related('autor')
+    )
 
     context = {
         'room_name_js': room_name, # <-- CRÍTICO para el WebSocket
         'usuario_objetivo': usuario_objetivo,
         'historial': historial,
+        'historial_anteriores': historial_anteriores,
     }
     return render(request, 'usuarios/chat_room.html', context)
 
 
+@login_required
+def chat_historial_view(request, user_id):
+    """
+    Mensajes de la sala con 'user_id' anteriores a ?antes=<cursor>, del más
+    viejo al más nuevo (SuperService/historial_chat.py). JSON para el
+    botón "Cargar anteriores" de chat_room.html.
+    """
+    participantes_ids = sorted([request.user.pk, user_id])
+    chat_room = get_object_or_404(
+        ChatRoom, room_name=f'chat_{participantes_ids[0]}_{participantes_ids[1]}', participantes=request.user
+    )
+    try:
+        historial, anteriores = pagina_anterior(
+            Mensaje.objects.filter(room=chat_room).select_related('autor'),
+            request.GET.get('antes'), leer_limite(request.GET),
+        )
+    except ValueError:
+        return JsonResponse({'error': "Cursor inválido."}, status=400)
+
+    return JsonResponse({
+        'anteriores': anteriores,
+        'results': [
+            {
+                'id': mensaje.pk,
+                'autor': mensaje.autor_id,
+                'autor_username': mensaje.autor.username,
+                'contenido': mensaje.contenido,
+                'timestamp': mensaje.timestamp.isoformat(),
+                'secuencia': mensaje.secuencia,
+            }
+            for mensaje in historial
+        ],
+    })
+
+
 
 # usuarios/views.py
 